@@ -0,0 +1,194 @@
+"""
+Load benchmark for the API. Creates a test database, fills it with a
+synthetic dataset (see gndata_api.generator) and drives the list, detail,
+data, acl and in_bulk endpoints through the Django test client. Reports
+throughput and p50/p99 latency per endpoint.
+
+    python benchmark.py --database default --blocks 2 --requests 50
+
+With --micro, measures the time of iterating over and dehydrating in-memory
+Events instead (attribute access of versioned objects, no SQL per object).
+
+    python benchmark.py --micro --objects 100000
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile as tmp
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = int(round((len(ordered) - 1) * p / 100.0))
+    return ordered[index]
+
+
+def run(client, name, make_request, count):
+    """ runs a request 'count' times, returns a result row """
+    latencies, errors = [], 0
+    started = time.time()
+    for i in range(count):
+        start = time.time()
+        response = make_request()
+        latencies.append((time.time() - start) * 1000)
+        if response.status_code >= 400:
+            errors += 1
+    elapsed = time.time() - started
+
+    return (name, count, errors, count / elapsed, percentile(latencies, 50),
+            percentile(latencies, 99))
+
+
+def micro(owner, count):
+    """ times attribute reads and full dehydration of 'count' Events, built
+    in memory (the owner URI is fetched once) """
+    from django.test.client import RequestFactory
+    from django.utils import timezone
+    from ephys.api import EventResource
+    from ephys.models import Event
+
+    now = timezone.now()
+    events = [
+        Event(local_id="E%09d" % i, guid="%040d" % i, label="event %d" % i,
+              time=i / 10.0, segment_id="S000000001", block_id="B000000001",
+              owner=owner, date_created=now)
+        for i in range(count)
+    ]
+    names = [f.attname for f in Event._meta.local_fields]
+
+    start = time.time()
+    for event in events:
+        for name in names:
+            getattr(event, name)
+    reads = time.time() - start
+
+    resource = EventResource()
+    request = RequestFactory().get('/')
+    start = time.time()
+    for event in events:
+        resource.full_dehydrate(resource.build_bundle(obj=event,
+                                                      request=request))
+    dehydrate = time.time() - start
+
+    print "%d objects, %d fields" % (count, len(names))
+    print "%-22s %10.1f ms %10.2f us/object" % (
+        "attribute reads", reads * 1000, reads * 1e6 / count
+    )
+    print "%-22s %10.1f ms %10.2f us/object" % (
+        "full dehydrate", dehydrate * 1000, dehydrate * 1e6 / count
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API load benchmark")
+    parser.add_argument('--database', choices=['sqlite', 'default'],
+                        default='default', help="database to benchmark")
+    parser.add_argument('--requests', type=int, default=50,
+                        help="requests per endpoint")
+    parser.add_argument('--blocks', type=int, default=1)
+    parser.add_argument('--segments', type=int, default=3)
+    parser.add_argument('--channels', type=int, default=8)
+    parser.add_argument('--signal-length', type=int, default=10000)
+    parser.add_argument('--spikes', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=50)
+    parser.add_argument('--section-depth', type=int, default=3)
+    parser.add_argument('--section-width', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--micro', action='store_true',
+                        help="benchmark attribute access and dehydration of "
+                             "in-memory objects instead of the endpoints")
+    parser.add_argument('--objects', type=int, default=100000,
+                        help="number of objects for --micro")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gndata_api.settings")
+
+    # data files go to a temporary storage, configured before models import
+    from gndata_api import settings
+    media_root = tmp.mkdtemp()
+    settings.FILE_MEDIA_ROOT = media_root
+    if args.database == 'sqlite':
+        settings.DATABASES['default'] = settings.DATABASES['sqlite']
+
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.client import Client
+    from django.test.utils import setup_test_environment
+    from django.contrib.auth.models import User
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    try:
+        call_command('loaddata', 'users', verbosity=0)
+        bob = User.objects.get(pk=1)
+
+        if args.micro:
+            micro(bob, args.objects)
+            sys.exit(0)
+
+        from gndata_api.generator import DatasetGenerator
+        print "generating dataset..."
+        start = time.time()
+        created = DatasetGenerator(
+            bob, blocks=args.blocks, segments=args.segments,
+            channels=args.channels, signal_length=args.signal_length,
+            spikes=args.spikes, events=args.events,
+            section_depth=args.section_depth,
+            section_width=args.section_width, seed=args.seed
+        ).generate()
+        print "%d objects created in %.1f s" % (
+            sum(len(x) for x in created.values()), time.time() - start
+        )
+
+        client = Client()
+        client.login(username=bob.username, password="pass")
+
+        ephys = "/api/v1/electrophysiology"
+        pick = lambda name: random.choice(created[name]).pk
+        block = created['block'][0].pk
+
+        # the block snapshot is uploaded back with in_bulk
+        snapshot = os.path.join(media_root, 'snapshot.h5')
+        with open(snapshot, 'wb') as f:
+            response = client.get("%s/block/%s/snapshot/" % (ephys, block))
+            f.write(''.join(response.streaming_content))
+
+        def in_bulk():
+            with open(snapshot, 'rb') as f:
+                return client.post('/api/v1/in_bulk/', {'raw_file': f})
+
+        endpoints = [
+            ("list segment", lambda: client.get("%s/segment/" % ephys)),
+            ("list spike", lambda: client.get("%s/spike/" % ephys)),
+            ("list section", lambda: client.get("/api/v1/metadata/section/")),
+            ("detail segment", lambda: client.get(
+                "%s/segment/%s/" % (ephys, pick('segment')))),
+            ("detail analogsignal", lambda: client.get(
+                "%s/analogsignal/%s/" % (ephys, pick('analogsignal')))),
+            ("data analogsignal", lambda: client.get(
+                "%s/analogsignal/%s/signal/" % (ephys, pick('analogsignal')))),
+            ("acl block", lambda: client.get(
+                "%s/block/%s/acl/" % (ephys, block))),
+            ("in_bulk block", in_bulk),
+        ]
+
+        print
+        print "%-22s %8s %6s %10s %10s %10s" % (
+            "endpoint", "requests", "errors", "req/s", "p50 ms", "p99 ms"
+        )
+        for name, make_request in endpoints:
+            count = args.requests if name != "in_bulk block" else \
+                max(1, args.requests / 10)
+            print "%-22s %8d %6d %10.1f %10.1f %10.1f" % run(
+                client, name, make_request, count
+            )
+            sys.stdout.flush()
+
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(media_root)
@@ -1,13 +1,29 @@
-from tastypie import fields
+import os
+import tempfile as tmp
+
+import h5py
+
+from django.conf.urls import url
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.servers.basehttp import FileWrapper
+from django.http import StreamingHttpResponse
+from tastypie import fields, http
+from tastypie.bundle import Bundle
+from tastypie.utils import trailing_slash
 from ephys.models import *
+from ephys.snapshot import BlockSnapshot
+from ephys.storage import file_window, slice_file
+from gndata_api.utils import parse_time
 from rest.resource import BaseMeta
 from rest.resource import BaseGNodeResource, BaseFileResourceMixin
+from rest.resource import VersionedToOneField
+from rest.resource import ColumnsResourceMixin
 from permissions.resource import PermissionsResourceMixin
 from metadata.api import SectionResource
 
 
 class BlockResource(BaseGNodeResource, PermissionsResourceMixin):
-    metadata = fields.ToOneField(SectionResource, 'metadata', blank=True, null=True)
+    metadata = VersionedToOneField(SectionResource, 'metadata', blank=True, null=True)
     segment_set = fields.ToManyField(
         'ephys.api.SegmentResource', 'segment_set', related_name='block',
         full=False, blank=True, null=True
@@ -20,10 +36,68 @@ class BlockResource(BaseGNodeResource, PermissionsResourceMixin):
     class Meta(BaseMeta):
         queryset = Block.objects.all()
 
+    def prepend_urls(self):
+        return [
+            url(
+                r"^(?P<resource_name>%s)/(?P<pk>\w[\w-]*)/snapshot%s$" %
+                (self._meta.resource_name, trailing_slash()),
+                self.wrap_view('get_snapshot'),
+                name="api_block_snapshot"
+            )
+        ] + super(BlockResource, self).prepend_urls()
+
+    def get_snapshot(self, request, **kwargs):
+        """
+        Streams the whole Block tree (optionally at a given 'at_time') as an
+        HDF5 file in the 'in_bulk' layout.
+
+        Should return a StreamingHttpResponse (200 OK).
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+        self.log_throttled_access(request)
+
+        at_time = None
+        if 'at_time' in request.GET:
+            try:
+                at_time = parse_time(request.GET['at_time'])
+            except ValueError, e:
+                return http.HttpBadRequest(str(e))
+
+        try:
+            qs = Block.objects.filter(at_time=at_time) if at_time else \
+                Block.objects.all()
+            block = qs.get(pk=kwargs['pk'])
+        except ObjectDoesNotExist:
+            return http.HttpGone()
+
+        bundle = self.build_bundle(obj=block, request=request)
+        self.authorized_read_detail(self.get_object_list(request), bundle)
+
+        # the file is removed right away, so it disappears with the response
+        fd, path = tmp.mkstemp(suffix='.h5')
+        os.close(fd)
+        try:
+            with h5py.File(path, 'w') as f:
+                BlockSnapshot(block, request.user, at_time).write(f)
+            size = os.path.getsize(path)
+            snapshot = open(path, 'rb')
+        finally:
+            os.remove(path)
+
+        response = StreamingHttpResponse(
+            FileWrapper(snapshot, 2 ** 16), content_type='application/x-hdf'
+        )
+        response['Content-Disposition'] = "attachment; filename=%s.h5" % \
+                                          block.local_id
+        response['Content-Length'] = size
+        return response
+
 
 class SegmentResource(BaseGNodeResource):
-    metadata = fields.ToOneField(SectionResource, 'metadata', blank=True, null=True)
-    block = fields.ToOneField(BlockResource, 'block')
+    metadata = VersionedToOneField(SectionResource, 'metadata', blank=True, null=True)
+    block = VersionedToOneField(BlockResource, 'block')
     spiketrain_set = fields.ToManyField(
         'ephys.api.SpikeTrainResource', 'spiketrain_set',
         related_name='segment', full=False, blank=True, null=True
@@ -65,36 +139,109 @@ class SegmentResource(BaseGNodeResource):
         queryset = Segment.objects.all()
 
 
-class EventArrayResource(BaseGNodeResource, BaseFileResourceMixin):
-    segment = fields.ToOneField(SegmentResource, 'segment')
+class SegmentColumnsMixin(ColumnsResourceMixin):
+    """ columns of objects in a Segment (Events, Epochs), ordered by time """
+    columns_order_by = ('time',)
+
+    def hydrate_columns(self, values, parents):
+        """ objects belong to the Block of their Segment """
+        values['block_id'] = parents['segment'].block_id
+        return values
+
+
+class TimeWindowMixin(BaseFileResourceMixin):
+    """
+    Data requests with 'start_time' and / or 'end_time' return only the rows
+    of the arrays that have times within the window (bounds included). Rows
+    are found with a binary search in the sorted 'times' array, so only a few
+    values of it and the selected rows are read.
+    """
+    windowed_fields = ('times', 'waveforms', 'signal', 'labels', 'durations')
+
+    def time_window(self, request, obj):
+        """ index range (begin, stop) of the requested time window, None if
+        no window is requested or it covers all times """
+        bounds = [request.GET.get(x) for x in ('start_time', 'end_time')]
+        if bounds == [None, None]:
+            return None
+
+        start, end = [float(x) if x is not None else None for x in bounds]
+
+        # array bounds recorded at upload often answer without the file
+        low, high = obj.times_min, obj.times_max
+        if low is not None and high is not None:
+            if (start is not None and start > high) or \
+                    (end is not None and end < low):
+                return 0, 0
+            if (start is None or start <= low) and (end is None or end >= high):
+                return None
+
+        return file_window(obj.times.path, start, end)
+
+    def get_file(self, request, obj, attr_name, filepath):
+        if attr_name not in self.windowed_fields:
+            return super(TimeWindowMixin, self).get_file(
+                request, obj, attr_name, filepath
+            )
+
+        try:
+            window = self.time_window(request, obj)
+        except ValueError, e:
+            return http.HttpBadRequest(str(e))
+
+        if window is None:
+            return super(TimeWindowMixin, self).get_file(
+                request, obj, attr_name, filepath
+            )
+
+        fd, path = tmp.mkstemp(suffix='.h5')
+        os.close(fd)
+        try:
+            slice_file(filepath, path, *window)
+            size = os.path.getsize(path)
+            data = open(path, 'rb')
+        finally:
+            os.remove(path)
+
+        response = StreamingHttpResponse(
+            FileWrapper(data, 2 ** 16), content_type='application/x-hdf'
+        )
+        response['Content-Disposition'] = "attachment; filename=%s" % \
+                                          os.path.basename(filepath)
+        response['Content-Length'] = size
+        return response
+
+
+class EventArrayResource(BaseGNodeResource, TimeWindowMixin):
+    segment = VersionedToOneField(SegmentResource, 'segment')
 
     class Meta(BaseMeta):
         queryset = EventArray.objects.all()
 
 
-class EventResource(BaseGNodeResource):
-    segment = fields.ToOneField(SegmentResource, 'segment')
+class EventResource(BaseGNodeResource, SegmentColumnsMixin):
+    segment = VersionedToOneField(SegmentResource, 'segment')
 
     class Meta(BaseMeta):
         queryset = Event.objects.all()
 
 
-class EpochArrayResource(BaseGNodeResource, BaseFileResourceMixin):
-    segment = fields.ToOneField(SegmentResource, 'segment')
+class EpochArrayResource(BaseGNodeResource, TimeWindowMixin):
+    segment = VersionedToOneField(SegmentResource, 'segment')
 
     class Meta(BaseMeta):
         queryset = EpochArray.objects.all()
 
 
-class EpochResource(BaseGNodeResource):
-    segment = fields.ToOneField(SegmentResource, 'segment')
+class EpochResource(BaseGNodeResource, SegmentColumnsMixin):
+    segment = VersionedToOneField(SegmentResource, 'segment')
 
     class Meta(BaseMeta):
         queryset = Epoch.objects.all()
 
 
 class RCGResource(BaseGNodeResource):
-    block = fields.ToOneField(BlockResource, 'block')
+    block = VersionedToOneField(BlockResource, 'block')
     unit_set = fields.ToManyField(
         'ephys.api.UnitResource', 'unit_set',
         related_name='recordingchannelgroup', full=False, blank=True, null=True
@@ -136,16 +283,22 @@ class RCResource(BaseGNodeResource):
                 len(bundle.data['recordingchannelgroup']) == 0:
             raise ValueError("'recordingchannelgroup' attribute is mandatory")
 
-        rcg_field = self.fields['recordingchannelgroup']
-        rcg_uri = bundle.data['recordingchannelgroup'][0]
-        rcg = rcg_field.to_class().get_via_uri(rcg_uri, request=bundle.request)
+        # RCGs are usually resolved in bulk by 'hydrate' already
+        rcg = bundle.data['recordingchannelgroup'][0]
+        if isinstance(rcg, Bundle):
+            rcg = rcg.obj
+        else:
+            rcg_field = self.fields['recordingchannelgroup']
+            rcg = rcg_field.to_class().get_via_uri(rcg, request=bundle.request)
 
         bundle.obj.block_id = rcg.block_id
         return bundle
 
 
 class UnitResource(BaseGNodeResource):
-    recordingchannelgroup = fields.ToOneField(RCGResource, 'recordingchannelgroup')
+    recordingchannelgroup = VersionedToOneField(
+        RCGResource, 'recordingchannelgroup'
+    )
     spiketrain_set = fields.ToManyField(
         'ephys.api.SpikeTrainResource', 'spiketrain_set',
         related_name='unit', full=False, blank=True, null=True
@@ -159,17 +312,17 @@ class UnitResource(BaseGNodeResource):
         queryset = Unit.objects.all()
 
 
-class SpikeTrainResource(BaseGNodeResource, BaseFileResourceMixin):
-    segment = fields.ToOneField(SegmentResource, 'segment')
-    unit = fields.ToOneField(UnitResource, 'unit', blank=True, null=True)
+class SpikeTrainResource(BaseGNodeResource, TimeWindowMixin):
+    segment = VersionedToOneField(SegmentResource, 'segment')
+    unit = VersionedToOneField(UnitResource, 'unit', blank=True, null=True)
 
     class Meta(BaseMeta):
         queryset = SpikeTrain.objects.all()
 
 
 class ASAResource(BaseGNodeResource, BaseFileResourceMixin):
-    segment = fields.ToOneField(SegmentResource, 'segment')
-    recordingchannelgroup = fields.ToOneField(
+    segment = VersionedToOneField(SegmentResource, 'segment')
+    recordingchannelgroup = VersionedToOneField(
         RCGResource, 'recordingchannelgroup', blank=True, null=True
     )
 
@@ -178,8 +331,8 @@ class ASAResource(BaseGNodeResource, BaseFileResourceMixin):
 
 
 class AnalogSignalResource(BaseGNodeResource, BaseFileResourceMixin):
-    segment = fields.ToOneField(SegmentResource, 'segment')
-    recordingchannel = fields.ToOneField(
+    segment = VersionedToOneField(SegmentResource, 'segment')
+    recordingchannel = VersionedToOneField(
         RCResource, 'recordingchannel', blank=True, null=True
     )
 
@@ -187,9 +340,9 @@ class AnalogSignalResource(BaseGNodeResource, BaseFileResourceMixin):
         queryset = AnalogSignal.objects.all()
 
 
-class IRSAResource(BaseGNodeResource, BaseFileResourceMixin):
-    segment = fields.ToOneField(SegmentResource, 'segment')
-    recordingchannel = fields.ToOneField(
+class IRSAResource(BaseGNodeResource, TimeWindowMixin):
+    segment = VersionedToOneField(SegmentResource, 'segment')
+    recordingchannel = VersionedToOneField(
         RCResource, 'recordingchannel', blank=True, null=True
     )
 
@@ -198,8 +351,8 @@ class IRSAResource(BaseGNodeResource, BaseFileResourceMixin):
 
 
 class SpikeResource(BaseGNodeResource, BaseFileResourceMixin):
-    segment = fields.ToOneField(SegmentResource, 'segment')
-    unit = fields.ToOneField(UnitResource, 'unit', blank=True, null=True)
+    segment = VersionedToOneField(SegmentResource, 'segment')
+    unit = VersionedToOneField(UnitResource, 'unit', blank=True, null=True)
 
     class Meta(BaseMeta):
         queryset = Spike.objects.all()
\ No newline at end of file
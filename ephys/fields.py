@@ -1,3 +1,7 @@
+from collections import Counter
+
+import numpy as np
+
 from django.db import models
 from django import forms
 
@@ -48,3 +52,218 @@ class SamplingUnitField(UnitField):
     def __init__(self, *args, **kwargs):
         super(SamplingUnitField, self).__init__(*args, **kwargs)
         self._unit_type = 'sampling'
+
+
+class ArrayFileField(models.FileField):
+    """
+    This field stores a file with array data. Every inserted object version,
+    that references a content-addressed file, adds a reference to it, so files
+    shared between versions and objects are accounted in 'ArrayBlob'.
+
+    Metadata of the stored array is recorded in read-only companion fields
+    '<name>_shape', '<name>_dtype', '<name>_chunks', '<name>_checksum'
+    and, with 'bounds=True' (time arrays), '<name>_min' and '<name>_max'.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.bounds = kwargs.pop('bounds', False)
+        super(ArrayFileField, self).__init__(*args, **kwargs)
+
+    def contribute_to_class(self, cls, name):
+        super(ArrayFileField, self).contribute_to_class(cls, name)
+        if cls._meta.abstract:
+            return  # companions are added to the concrete models
+
+        companions = [
+            ('shape', models.CommaSeparatedIntegerField(max_length=255)),
+            ('dtype', models.CharField(max_length=32)),
+            ('chunks', models.CommaSeparatedIntegerField(max_length=255)),
+            ('checksum', models.CharField(max_length=40)),
+        ]
+        if self.bounds:
+            companions += [('min', models.FloatField()),
+                           ('max', models.FloatField())]
+
+        for key, field in companions:
+            field.null = field.blank = True
+            field.editable = False
+            field.companion_of = name
+            cls.add_to_class(self.companion_name(key, name), field)
+
+    def companion_name(self, key, name=None):
+        return "%s_%s" % (name or self.name, key)
+
+    @property
+    def info_keys(self):
+        keys = ['shape', 'dtype', 'chunks', 'checksum']
+        return keys + (self.bounds and ['min', 'max'] or [])
+
+    def update_info(self, instance):
+        """ records metadata of the array stored in the field (see
+        'dataset_info') in the companion fields, committing a new file first.
+        Metadata is taken from the 'ArrayBlob' of a content-addressed file, so
+        the file is read only if it is stored for the first time or is not
+        content-addressed. Returns the metadata. """
+        ffile = getattr(instance, self.attname)
+        if not ffile:
+            info = {}
+        else:
+            committed = ffile._committed
+            if not committed:
+                ffile.save(ffile.name, ffile, save=False)
+
+            checksum_from_name = getattr(self.storage, 'checksum_from_name',
+                                         lambda name: None)
+            checksum = checksum_from_name(ffile.name)
+            recorded = getattr(instance, self.companion_name('checksum'))
+            if committed and recorded and checksum in (None, recorded):
+                return dict((key, getattr(instance, self.companion_name(key)))
+                            for key in self.info_keys)
+
+            info = self.stored_info(ffile.name, checksum)
+
+        for key in self.info_keys:
+            setattr(instance, self.companion_name(key), info.get(key))
+        return info
+
+    def stored_info(self, name, checksum=None):
+        """ metadata of a stored array file, from its 'ArrayBlob' if the file
+        is registered with metadata, otherwise read from the file """
+        from ephys.models import ArrayBlob
+        from ephys.storage import file_info
+
+        blobs = ArrayBlob.objects.filter(checksum=checksum) if checksum else \
+            ArrayBlob.objects.none()
+        blob = blobs.first()
+        if blob is not None and blob.info is not None:
+            return blob.info
+
+        info = file_info(self.storage.path(name), checksum) or {}
+        if blob is not None and info:
+            blobs.update(**ArrayBlob.info_fields(info))
+        return info
+
+    def companion_values(self, value):
+        """ values of the companion fields for a stored file, which is set to
+        many objects at once (see 'VersionedQuerySet.update') """
+        name = getattr(value, 'name', value)
+        info = {}
+        if name:
+            checksum_from_name = getattr(self.storage, 'checksum_from_name',
+                                         lambda name: None)
+            info = self.stored_info(name, checksum_from_name(name))
+
+        get_field = self.model._meta.get_field
+        return dict((get_field(self.companion_name(key)), info.get(key))
+                    for key in self.info_keys)
+
+    def pre_save(self, model_instance, add):
+        self.update_info(model_instance)
+        return super(ArrayFileField, self).pre_save(model_instance, add)
+
+    def inserted(self, instances):
+        """ adds references to files held by inserted object versions, once
+        per distinct file (see 'VersionedQuerySet.bulk_create') """
+        counts, infos = Counter(), {}
+        for instance in instances:
+            name = getattr(instance, self.attname).name
+            if name:
+                counts[name] += 1
+                infos[name] = dict(
+                    (key, getattr(instance, self.companion_name(key)))
+                    for key in self.info_keys
+                )
+        self.retain(counts, infos)
+
+    def retain(self, counts, infos=None):
+        """ adds references to files held by object versions, which are
+        inserted or copied in the database (see 'VersionedQuerySet.update').
+
+        :param counts:  {file name: number of new rows referencing the file}
+        :param infos:   {file name: array metadata}, recorded for new files
+        """
+        checksum_from_name = getattr(self.storage, 'checksum_from_name', None)
+        if checksum_from_name is None:
+            return
+
+        from ephys.models import ArrayBlob
+        for name, count in counts.items():
+            checksum = checksum_from_name(name)
+            if checksum is not None:
+                ArrayBlob.objects.reference(checksum, name, self.storage, count,
+                                            info=(infos or {}).get(name))
+
+    def release(self, names):
+        """ releases references to files held by object versions, which are
+        removed from the database (see 'compact_history' command).
+
+        :param names:   file names of removed rows, one per row
+        """
+        checksum_from_name = getattr(self.storage, 'checksum_from_name', None)
+        if checksum_from_name is None:
+            return
+
+        from ephys.models import ArrayBlob
+        for name, count in Counter(names).items():
+            checksum = checksum_from_name(name)
+            if checksum is not None:
+                ArrayBlob.objects.release(checksum, count)
+
+
+class ArraySizeField(models.IntegerField):
+    """
+    This field stores the size in bytes of all arrays of an object, computed
+    from the shape and dtype recorded by its 'ArrayFileField's, so sizes are
+    known without reading files. Arrays of variable-length items (like
+    strings of an object dtype) are not counted.
+    """
+
+    @property
+    def array_fields(self):
+        return [f for f in self.model._meta.fields
+                if isinstance(f, ArrayFileField)]
+
+    @property
+    def info_attnames(self):
+        """ attnames of the (shape, dtype) companions of every array field """
+        return [(f.companion_name('shape'), f.companion_name('dtype'))
+                for f in self.array_fields]
+
+    def compute(self, get):
+        """ size in bytes, 'get' returns the value of a companion attname """
+        size = 0
+        for shape_name, dtype_name in self.info_attnames:
+            shape, dtype = get(shape_name), get(dtype_name)
+            if shape is None or not dtype:
+                continue
+
+            dtype = np.dtype(str(dtype))
+            if dtype.kind != 'O':
+                size += dtype.itemsize * int(np.prod(
+                    [int(x) for x in shape.split(',') if x]
+                ))
+        return size
+
+    def pre_save(self, model_instance, add):
+        # the field may come before the array fields, so their metadata is
+        # recorded here first (it is not read again by their 'pre_save')
+        for field in self.array_fields:
+            field.update_info(model_instance)
+
+        value = self.compute(lambda name: getattr(model_instance, name))
+        setattr(model_instance, self.attname, value)
+        return value
+
+    def depends_on(self, field):
+        return field in self.array_fields
+
+    def update_rows(self, queryset):
+        """ recomputes the size of rows selected by a plain QuerySet, like rows
+        copied by a set-based update, with one UPDATE per distinct shape and
+        dtype combination """
+        names = [name for pair in self.info_attnames for name in pair]
+        for values in queryset.order_by().values_list(*names).distinct():
+            info = dict(zip(names, values))
+            queryset.filter(**info).update(**{self.attname: self.compute(
+                info.get
+            )})
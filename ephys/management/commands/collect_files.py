@@ -0,0 +1,205 @@
+import os
+import shutil
+import datetime
+from optparse import make_option
+from multiprocessing.pool import ThreadPool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.db.models.query import QuerySet
+from django.utils import timezone
+
+from ephys.models import ArrayBlob
+from gndata_api import settings
+
+
+class Command(BaseCommand):
+    """
+    Garbage collector for data files. Versioned deletes and updates never
+    remove files from FILE_MEDIA_ROOT, as older object versions still reference
+    them. A file is removed or archived only when no stored object version
+    references it and no references are counted in its 'ArrayBlob', so files
+    of old versions are collected after 'compact_history' removed these
+    versions (and released their references). Run 'compact_history' first.
+    Files modified (or reused by an upload, see
+    'ContentAddressedStorage.touch') within the retention period are kept, as
+    they may belong to an upload in progress.
+
+    References are checked again for every batch, with 'ArrayBlob' rows
+    locked, and every file is moved aside before its modification time is
+    checked again, so files reused while the command runs are kept.
+    """
+    help = "Removes (or archives) data files not referenced by any stored " \
+           "object version, nor modified within the retention period. Run " \
+           "'compact_history' first to release files of old versions."
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--days', type='int', dest='days',
+            default=getattr(settings, 'FILE_RETENTION_DAYS', 30),
+            help="Keep files modified within this number of days "
+                 "(default: FILE_RETENTION_DAYS)."
+        ),
+        make_option(
+            '--dry-run', action='store_true', dest='dry_run', default=False,
+            help="Only report files that would be collected."
+        ),
+        make_option(
+            '--archive', dest='archive', default=None,
+            help="Move collected files to this directory instead of removing."
+        ),
+        make_option(
+            '--workers', type='int', dest='workers', default=4,
+            help="Number of parallel workers removing files."
+        ),
+        make_option(
+            '--batch-size', type='int', dest='batch_size', default=1000,
+            help="Number of files processed per batch."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['workers'] < 1 or \
+                options['batch_size'] < 1:
+            raise CommandError("Options must be positive numbers")
+
+        root = settings.FILE_MEDIA_ROOT
+        horizon = timezone.now() - datetime.timedelta(days=options['days'])
+        timestamp = (horizon - datetime.datetime(
+            1970, 1, 1, tzinfo=timezone.utc
+        )).total_seconds()
+
+        referenced = self.referenced_files()
+        candidates = self.unreferenced_files(root, referenced, timestamp)
+        total = sum(size for path, size in candidates)
+
+        self.stdout.write("%d files (%d bytes) are not referenced, nor "
+                          "modified since %s" % (len(candidates), total,
+                                                 horizon.isoformat()))
+
+        if options['dry_run']:
+            for path, size in candidates:
+                self.stdout.write("%12d  %s" % (size, path))
+            return
+
+        collect = lambda path: self.collect(root, path, timestamp,
+                                            options['archive'])
+        sizes = dict(candidates)
+        step = options['batch_size']
+        batches = [candidates[i:i + step] for i in range(0, len(candidates), step)]
+
+        collected = []
+        pool = ThreadPool(options['workers'])
+        try:
+            for batch in batches:
+                with transaction.atomic():
+                    paths = [x[0] for x in batch]
+                    in_use = self.counted_files(paths, lock=True)
+                    in_use.update(self.referenced_files(paths))
+
+                    done = []
+                    for path, error in pool.map(
+                            collect, [x for x in paths if x not in in_use]):
+                        if error is None:
+                            done.append(path)
+                        elif error:
+                            self.stderr.write("%s: %s" % (path, error))
+
+                    ArrayBlob.objects.filter(path__in=done).delete()
+                    collected.extend(done)
+        finally:
+            pool.close()
+            pool.join()
+
+        action = options['archive'] and "archived" or "removed"
+        self.stdout.write("%d files (%d bytes) %s" % (
+            len(collected), sum(sizes[x] for x in collected), action
+        ))
+
+    @staticmethod
+    def collect(root, path, timestamp, archive_root=None):
+        """ removes (or archives) a file, unless it was modified (reused)
+        after the timestamp. The file is moved aside first, so an upload
+        reusing it meanwhile either finds no file and stores it again, or
+        touches it before the check here.
+
+        :return:    (path, None) if collected, (path, '') if kept and
+                    (path, error message) if collecting failed
+        """
+        fullpath = os.path.join(root, path)
+        moved = fullpath + '.collecting'
+        try:
+            os.rename(fullpath, moved)
+            if os.stat(moved).st_mtime >= timestamp:
+                os.rename(moved, fullpath)
+                return path, ''
+
+            if archive_root:
+                target = os.path.join(archive_root, path)
+                if not os.path.exists(os.path.dirname(target)):
+                    try:
+                        os.makedirs(os.path.dirname(target))
+                    except OSError:  # created by another worker
+                        pass
+                shutil.move(moved, target)
+            else:
+                os.remove(moved)
+            return path, None
+
+        except EnvironmentError, e:
+            if os.path.exists(moved) and not os.path.exists(fullpath):
+                os.rename(moved, fullpath)
+            return path, str(e)
+
+    def counted_files(self, paths=None, lock=False):
+        """ file names with references counted in their 'ArrayBlob', among
+        given paths if any. Blob rows are locked with 'lock', until the end
+        of the transaction. """
+        blobs = ArrayBlob.objects.filter(ref_count__gt=0)
+        if paths is not None:
+            blobs = blobs.filter(path__in=paths)
+        if lock:
+            blobs = blobs.select_for_update()
+        return set(blobs.values_list('path', flat=True))
+
+    def referenced_files(self, paths=None):
+        """ file names referenced by all stored object versions, current and
+        closed, among given paths if any. Uses plain QuerySets as versioned
+        ones see only current versions. """
+        referenced = set()
+        for model in models.get_models():
+            file_fields = [f for f in model._meta.local_fields
+                           if isinstance(f, models.FileField)]
+            if not file_fields:
+                continue
+
+            for field in file_fields:
+                names = QuerySet(model).exclude(**{field.attname: ''})
+                if paths is not None:
+                    names = names.filter(**{field.attname + '__in': paths})
+                names = names.values_list(
+                    field.attname, flat=True
+                ).distinct()
+                referenced.update(name for name in names if name)
+
+        return referenced
+
+    def unreferenced_files(self, root, referenced, timestamp):
+        """ list of (relative path, size) of files in 'root', which are neither
+        referenced (by object versions or counted in 'ArrayBlob') nor modified
+        after the timestamp """
+        referenced = referenced | self.counted_files()
+
+        candidates = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                fullpath = os.path.join(dirpath, filename)
+                path = os.path.relpath(fullpath, root).replace('\\', '/')
+                if path in referenced:
+                    continue
+
+                stat = os.stat(fullpath)
+                if stat.st_mtime < timestamp:
+                    candidates.append((path, stat.st_size))
+
+        return candidates
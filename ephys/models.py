@@ -1,11 +1,15 @@
-from django.db import models
-from django.core.files import storage
+from django.core.exceptions import ValidationError
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
 from state_machine.models import BaseGnodeObject
 from state_machine.versioning.models import VersionedM2M
 from state_machine.versioning.descriptors import VersionedForeignKey
+from state_machine.versioning.descriptors import VersionedManyToManyField
 from metadata.models import Section
 from ephys.security import BlockBasedPermissionsMixin
 from ephys.fields import TimeUnitField, SignalUnitField, SamplingUnitField
+from ephys.fields import ArrayFileField, ArraySizeField
+from ephys.storage import ContentAddressedStorage
 from permissions.models import BasePermissionsMixin
 from gndata_api import settings
 from datetime import date
@@ -23,7 +27,7 @@ def make_upload_path(self, filename):
     return "%s/%s/%s" % (self.owner.username, today, filename)
 
 
-fs = storage.FileSystemStorage(location=settings.FILE_MEDIA_ROOT)
+fs = ContentAddressedStorage(location=settings.FILE_MEDIA_ROOT)
 
 DEFAULTS = {
     "name_max_length": 100,
@@ -36,6 +40,74 @@ DEFAULTS = {
 }
 
 
+class ArrayBlobManager(models.Manager):
+
+    def reference(self, checksum, path, storage, count=1, info=None):
+        """ adds references to a content-addressed file. Registers the file
+        first, with array metadata 'info' (see 'dataset_info') if given, if it
+        is referenced for the first time. """
+        qs = self.filter(checksum=checksum)
+        if qs.update(ref_count=F('ref_count') + count):
+            return
+
+        try:
+            with transaction.atomic():
+                self.create(
+                    checksum=checksum, path=path, size=storage.size(path),
+                    ref_count=count, **self.model.info_fields(info or {})
+                )
+        except IntegrityError:  # registered concurrently
+            qs.update(ref_count=F('ref_count') + count)
+
+    def release(self, checksum, count=1):
+        """ removes references of deleted object versions to a file """
+        qs = self.filter(checksum=checksum)
+        qs.update(ref_count=F('ref_count') - count)
+
+
+class ArrayBlob(models.Model):
+    """
+    A single array data file in the content-addressed storage. One file may be
+    shared by many objects and all their versions, 'ref_count' holds the number
+    of object versions (rows) referencing the file.
+
+    Note: ArrayBlobs are NOT version controlled.
+    """
+    checksum = models.CharField(max_length=40, unique=True)
+    path = models.CharField(max_length=255)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    # array metadata, empty for files registered before it was recorded
+    shape = models.CommaSeparatedIntegerField(max_length=255, blank=True, null=True)
+    dtype = models.CharField(max_length=32, blank=True, null=True)
+    chunks = models.CommaSeparatedIntegerField(max_length=255, blank=True, null=True)
+    min_value = models.FloatField(blank=True, null=True)
+    max_value = models.FloatField(blank=True, null=True)
+
+    objects = ArrayBlobManager()
+
+    @staticmethod
+    def info_fields(info):
+        """ model fields for array metadata (see 'dataset_info') """
+        names = {'shape': 'shape', 'dtype': 'dtype', 'chunks': 'chunks',
+                 'min': 'min_value', 'max': 'max_value'}
+        return dict((names[k], v) for k, v in info.items() if k in names)
+
+    @property
+    def info(self):
+        """ array metadata like given by 'dataset_info', None if unknown """
+        if self.dtype is None:
+            return None
+
+        return {
+            'shape': self.shape, 'dtype': self.dtype, 'chunks': self.chunks,
+            'checksum': self.checksum, 'min': self.min_value,
+            'max': self.max_value
+        }
+
+
 # 1 (of 15)
 class Block(BasePermissionsMixin, BaseGnodeObject):
     """
@@ -75,7 +147,7 @@ class BaseInfo(BaseGnodeObject):
 
 class DataObject(models.Model):
     """ implements methods and attributes for objects containing array data """
-    data_size = models.IntegerField(blank=True, null=True)
+    data_size = ArraySizeField(blank=True, null=True)
 
     class Meta:
         abstract = True
@@ -90,13 +162,12 @@ class DataObject(models.Model):
 
     def compute_size(self):
         """
-        :return: int - size of an object in bytes
+        :return: int - size of the arrays of an object in bytes, computed from
+        the shape and dtype recorded when the arrays were stored (stored as
+        'data_size' with every version, see 'ArraySizeField')
         """
-        raise NotImplementedError()
-
-    def save(self, *args, **kwargs):
-        self.data_size = self.compute_size()
-        super(DataObject, self).save(*args, **kwargs)
+        field = self._meta.get_field('data_size')
+        return field.compute(lambda name: getattr(self, name))
 
 
 # 2 (of 15)
@@ -123,8 +194,8 @@ class EventArray(BlockBasedPermissionsMixin, BaseInfo, DataObject):
     name = models.CharField(max_length=DEFAULTS['name_max_length'], blank=True, null=True)
 
     # NEO data arrays
-    labels = models.FileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
-    times = models.FileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
+    labels = ArrayFileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
+    times = ArrayFileField(storage=fs, upload_to=make_upload_path, blank=True, null=True, bounds=True)
     times__unit = TimeUnitField('times__unit', default=DEFAULTS['default_time_unit'])
 
     # NEO relationships
@@ -162,10 +233,10 @@ class EpochArray(BlockBasedPermissionsMixin, BaseInfo, DataObject):
     name = models.CharField(max_length=DEFAULTS['name_max_length'], blank=True, null=True)
 
     # NEO data arrays
-    labels = models.FileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
-    times = models.FileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
+    labels = ArrayFileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
+    times = ArrayFileField(storage=fs, upload_to=make_upload_path, blank=True, null=True, bounds=True)
     times__unit = TimeUnitField('times__unit', default=DEFAULTS['default_time_unit'])
-    durations = models.FileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
+    durations = ArrayFileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
     durations__unit = TimeUnitField('durations__unit', default=DEFAULTS['default_time_unit'])
 
     # NEO relationships
@@ -214,8 +285,10 @@ class RecordingChannel(BlockBasedPermissionsMixin, BaseInfo):
     index = models.IntegerField('index', null=True, blank=True)
 
     # NEO relationships
-    recordingchannelgroup = models.ManyToManyField(RecordingChannelGroup, \
-                       through='recordingchannel_rcg', blank=True, null=True)
+    recordingchannelgroup = VersionedManyToManyField(
+        RecordingChannelGroup, through='recordingchannel_rcg', blank=True,
+        null=True
+    )
 
     def save(self, *args, **kwargs):
         super(RecordingChannel, self).save(*args, **kwargs)
@@ -253,15 +326,11 @@ class SpikeTrain(BlockBasedPermissionsMixin, BaseInfo, DataObject):
     unit = VersionedForeignKey(Unit, blank=True, null=True)
 
     # NEO data arrays
-    times = models.FileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
+    times = ArrayFileField(storage=fs, upload_to=make_upload_path, blank=True, null=True, bounds=True)
     times__unit = TimeUnitField('times__unit', default=DEFAULTS['default_time_unit'])
-    waveforms = models.FileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
+    waveforms = ArrayFileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
     waveforms__unit = SignalUnitField('waveforms__unit', blank=True, null=True)
 
-    # rewrite the size property when waveforms are supported
-    def compute_size(self):
-        return self.times.size
-
     def save(self, *args, **kwargs):
         self.block = self.segment.block
         super(SpikeTrain, self).save(*args, **kwargs)
@@ -280,16 +349,13 @@ class AnalogSignalArray(BlockBasedPermissionsMixin, BaseInfo, DataObject):
     t_start__unit = TimeUnitField('t_start__unit', default=DEFAULTS['default_time_unit'])
 
     # NEO data arrays
-    signal = models.FileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
+    signal = ArrayFileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
     signal__unit = SignalUnitField('signals__unit', default=DEFAULTS['default_data_unit'])
 
     # NEO relationships
     segment = VersionedForeignKey(Segment)
     recordingchannelgroup = VersionedForeignKey(RecordingChannelGroup, blank=True, null=True)
 
-    def compute_size(self):
-        return self.signal.size
-
     def save(self, *args, **kwargs):
         self.block = self.segment.block
         super(AnalogSignalArray, self).save(*args, **kwargs)
@@ -312,7 +378,7 @@ class AnalogSignal(BlockBasedPermissionsMixin, BaseInfo, DataObject):
     recordingchannel = VersionedForeignKey(RecordingChannel, blank=True, null=True)
     
     # NEO data arrays
-    signal = models.FileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
+    signal = ArrayFileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
     signal__unit = SignalUnitField('signal__unit', default=DEFAULTS['default_data_unit'])
 
     def save(self, *args, **kwargs):
@@ -335,18 +401,28 @@ class IrregularlySampledSignal(BlockBasedPermissionsMixin, BaseInfo, DataObject)
     recordingchannel = VersionedForeignKey(RecordingChannel, blank=True, null=True)
 
     # NEO data arrays
-    signal = models.FileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
+    signal = ArrayFileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
     signal__unit = SignalUnitField('signal__unit', default=DEFAULTS['default_data_unit'])
-    times = models.FileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
+    times = ArrayFileField(storage=fs, upload_to=make_upload_path, blank=True, null=True, bounds=True)
     times__unit = TimeUnitField('times__unit', default=DEFAULTS['default_time_unit'])
 
-    def full_clean(self, *args, **kwargs):
-        """ Add some validation to keep 'signal' and 'times' dimensions
-        consistent. Currently switched off. """
-        super(IrregularlySampledSignal, self).full_clean(*args, **kwargs)
+    def clean(self):
+        """ keeps 'signal' and 'times' dimensions consistent. Lengths are
+        compared from the recorded shapes, files are read only if new. """
+        lengths = set()
+        for name in ('signal', 'times'):
+            field = self._meta.get_field(name)
+            shape = field.update_info(self).get('shape')
+            if shape:
+                lengths.add(shape.split(',')[0])
+
+        if len(lengths) > 1:
+            raise ValidationError("'signal' and 'times' should have the same "
+                                  "length")
 
     def save(self, *args, **kwargs):
         self.block = self.segment.block
+        self.clean()
         super(IrregularlySampledSignal, self).save(*args, **kwargs)
 
 
@@ -365,7 +441,7 @@ class Spike(BlockBasedPermissionsMixin, BaseInfo, DataObject):
     left_sweep__unit = TimeUnitField('left_sweep__unit', blank=True, null=True)
 
     # NEO data arrays
-    waveform = models.FileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
+    waveform = ArrayFileField(storage=fs, upload_to=make_upload_path, blank=True, null=True)
     waveform__unit = SignalUnitField('waveform__unit', default=DEFAULTS['default_data_unit'])
 
     # NEO relationships
@@ -0,0 +1,184 @@
+import h5py
+
+from tastypie.bundle import Bundle
+
+from ephys.models import Block
+from gndata_api import settings
+from metadata.models import Section, Property, Value
+
+
+def location(resource, local_id):
+    """ name of the HDF5 group for an object, as expected by 'in_bulk': the
+    object URL with '/' replaced by '-' """
+    url = "/api/v1/%s/%s/%s/" % (
+        resource._meta.api_name, resource._meta.resource_name, local_id
+    )
+    return url.replace('/', '-')
+
+
+def versioned(model, at_time, **filters):
+    """ objects of a given model at time (or current objects) """
+    if at_time is not None:
+        filters['at_time'] = at_time
+    return model.objects.filter(**filters)
+
+
+def resource_for(model, resources):
+    for resource in resources:
+        if resource._meta.object_class == model:
+            return resource
+    return None
+
+
+class BlockSnapshot(object):
+    """
+    Exports a Block with all its objects (Segments, RCGs, RCs, Units, data
+    objects) and linked metadata (Sections with Properties and Values) at a
+    given point in time into an HDF5 file in the 'in_bulk' layout: one group
+    per object with a 'json' dataset and one dataset per data field.
+
+    Every model is loaded with one query filtered by block (and time) instead
+    of walking relations object by object, and written as rows arrive.
+    """
+
+    def __init__(self, block, user, at_time=None, resources=None):
+        if resources is None:
+            from gndata_api.urls import EPHYS_RESOURCES, METADATA_RESOURCES
+            resources = EPHYS_RESOURCES.values() + METADATA_RESOURCES.values()
+
+        self.block = block
+        self.user = user
+        self.at_time = at_time
+        self.resources = resources
+
+    def models(self):
+        """ ephys models having objects in the block, Block first """
+        related = [r._meta.object_class for r in self.resources
+                   if 'block' in [f.name for f in
+                                  r._meta.object_class._meta.local_fields]]
+        return [Block] + sorted(related, key=lambda m: m.__name__)
+
+    def write(self, f):
+        """ writes the snapshot into an open h5py.File. Objects of every model
+        are fetched and written in chunks of EXPORT_CHUNK_SIZE, so large
+        blocks are not held in memory """
+        chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 1000)
+        section_ids = set()
+
+        for model in self.models():
+            resource = resource_for(model, self.resources)
+            if model == Block:
+                self.write_objects(f, resource, model, [self.block],
+                                   section_ids)
+                continue
+
+            objects = versioned(model, self.at_time,
+                                block_id=self.block.local_id)
+            chunk = []
+            for obj in objects.iterate_chunked(chunk_size):
+                chunk.append(obj)
+                if len(chunk) == chunk_size:
+                    self.write_objects(f, resource, model, chunk, section_ids)
+                    chunk = []
+            self.write_objects(f, resource, model, chunk, section_ids)
+
+        self.write_metadata(f, section_ids)
+
+    def write_objects(self, f, resource, model, objects, section_ids):
+        """ writes objects of a model, collecting IDs of linked sections """
+        m2m = self.load_m2m(resource, model, objects)
+        for obj in objects:
+            self.write_object(f, resource, obj, m2m)
+            if obj.metadata_id is not None:
+                section_ids.add(obj.metadata_id)
+
+    def write_metadata(self, f, section_ids):
+        """ writes linked sections, accessible for the user, together with
+        their properties and values """
+        sections = list(Section.security_filter(
+            versioned(Section, self.at_time, local_id__in=list(section_ids)),
+            self.user
+        ))
+        properties = list(versioned(
+            Property, self.at_time,
+            section_id__in=[s.local_id for s in sections]
+        ))
+        values = list(versioned(
+            Value, self.at_time,
+            property_id__in=[p.local_id for p in properties]
+        ))
+
+        for model, objects in ((Section, sections), (Property, properties),
+                               (Value, values)):
+            resource = resource_for(model, self.resources)
+            for obj in objects:
+                self.write_object(f, resource, obj, {})
+
+    def load_m2m(self, resource, model, objects):
+        """ IDs of m2m related objects as {(field name, local_id): [IDs]},
+        loaded with one query per m2m field from the 'through' model """
+        m2m = {}
+        if not objects:
+            return m2m
+
+        m2m_names = [f.name for f in model._meta.many_to_many]
+        for name, field in resource.fields.items():
+            if not getattr(field, 'is_m2m', False) or \
+                    field.attribute not in m2m_names:
+                continue
+
+            model_field = model._meta.get_field(field.attribute)
+            through = model_field.rel.through
+            source = through._meta.get_field(model_field.m2m_field_name())
+            target = through._meta.get_field(
+                model_field.m2m_reverse_field_name()
+            )
+
+            links = versioned(through, self.at_time, **{
+                '%s__in' % source.attname: [obj.local_id for obj in objects]
+            })
+            for link in links:
+                key = (name, getattr(link, source.attname))
+                m2m.setdefault(key, []).append(getattr(link, target.attname))
+
+        return m2m
+
+    def write_object(self, f, resource, obj, m2m):
+        group = f.create_group(location(resource, obj.local_id))
+        file_fields = getattr(resource, 'file_fields', {})
+        m2m_names = [f.name for f in obj._meta.many_to_many]
+
+        data = {}
+        bundle = Bundle(obj=obj)
+        for name, field in resource.fields.items():
+            if field.readonly and name not in file_fields:
+                continue
+
+            if name in file_fields:
+                self.write_array(group, name, getattr(obj, field.attribute))
+
+            elif getattr(field, 'is_m2m', False):
+                if field.attribute in m2m_names:
+                    data[name] = m2m.get((name, obj.local_id), [])
+
+            elif getattr(field, 'is_related', False):
+                model_field = obj._meta.get_field(field.attribute)
+                data[name] = getattr(obj, model_field.attname)
+
+            else:
+                data[name] = field.dehydrate(bundle)
+
+        group.create_dataset(
+            name='json', data=resource.serialize(None, data, 'application/json')
+        )
+
+    @staticmethod
+    def write_array(group, name, ffile):
+        """ copies the array of a data field into the snapshot """
+        if not ffile:
+            return
+
+        with h5py.File(ffile.path, 'r') as src:
+            names = sorted(src.keys())
+            if names:
+                src.copy(src[names[0]], group, name=name)
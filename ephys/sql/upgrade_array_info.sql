@@ -0,0 +1,78 @@
+-- Upgrade of existing databases to array details recorded at upload (shape,
+-- dtype, chunks, checksum and min / max of time arrays). Not run by syncdb,
+-- new databases get these columns with their tables. Run once:
+--
+--   psql <database> -f ephys/sql/upgrade_array_info.sql
+--
+-- Columns stay empty for existing object versions. They are filled with the
+-- next version of an object, times_min / times_max are not used before.
+--
+-- The ephys_arrayblob table is new, syncdb creates it with all its columns,
+-- so it is not altered here.
+
+BEGIN;
+
+ALTER TABLE ephys_eventarray ADD COLUMN labels_shape varchar(255) NULL;
+ALTER TABLE ephys_eventarray ADD COLUMN labels_dtype varchar(32) NULL;
+ALTER TABLE ephys_eventarray ADD COLUMN labels_chunks varchar(255) NULL;
+ALTER TABLE ephys_eventarray ADD COLUMN labels_checksum varchar(40) NULL;
+ALTER TABLE ephys_eventarray ADD COLUMN times_shape varchar(255) NULL;
+ALTER TABLE ephys_eventarray ADD COLUMN times_dtype varchar(32) NULL;
+ALTER TABLE ephys_eventarray ADD COLUMN times_chunks varchar(255) NULL;
+ALTER TABLE ephys_eventarray ADD COLUMN times_checksum varchar(40) NULL;
+ALTER TABLE ephys_eventarray ADD COLUMN times_min double precision NULL;
+ALTER TABLE ephys_eventarray ADD COLUMN times_max double precision NULL;
+
+ALTER TABLE ephys_epocharray ADD COLUMN durations_shape varchar(255) NULL;
+ALTER TABLE ephys_epocharray ADD COLUMN durations_dtype varchar(32) NULL;
+ALTER TABLE ephys_epocharray ADD COLUMN durations_chunks varchar(255) NULL;
+ALTER TABLE ephys_epocharray ADD COLUMN durations_checksum varchar(40) NULL;
+ALTER TABLE ephys_epocharray ADD COLUMN labels_shape varchar(255) NULL;
+ALTER TABLE ephys_epocharray ADD COLUMN labels_dtype varchar(32) NULL;
+ALTER TABLE ephys_epocharray ADD COLUMN labels_chunks varchar(255) NULL;
+ALTER TABLE ephys_epocharray ADD COLUMN labels_checksum varchar(40) NULL;
+ALTER TABLE ephys_epocharray ADD COLUMN times_shape varchar(255) NULL;
+ALTER TABLE ephys_epocharray ADD COLUMN times_dtype varchar(32) NULL;
+ALTER TABLE ephys_epocharray ADD COLUMN times_chunks varchar(255) NULL;
+ALTER TABLE ephys_epocharray ADD COLUMN times_checksum varchar(40) NULL;
+ALTER TABLE ephys_epocharray ADD COLUMN times_min double precision NULL;
+ALTER TABLE ephys_epocharray ADD COLUMN times_max double precision NULL;
+
+ALTER TABLE ephys_spiketrain ADD COLUMN times_shape varchar(255) NULL;
+ALTER TABLE ephys_spiketrain ADD COLUMN times_dtype varchar(32) NULL;
+ALTER TABLE ephys_spiketrain ADD COLUMN times_chunks varchar(255) NULL;
+ALTER TABLE ephys_spiketrain ADD COLUMN times_checksum varchar(40) NULL;
+ALTER TABLE ephys_spiketrain ADD COLUMN times_min double precision NULL;
+ALTER TABLE ephys_spiketrain ADD COLUMN times_max double precision NULL;
+ALTER TABLE ephys_spiketrain ADD COLUMN waveforms_shape varchar(255) NULL;
+ALTER TABLE ephys_spiketrain ADD COLUMN waveforms_dtype varchar(32) NULL;
+ALTER TABLE ephys_spiketrain ADD COLUMN waveforms_chunks varchar(255) NULL;
+ALTER TABLE ephys_spiketrain ADD COLUMN waveforms_checksum varchar(40) NULL;
+
+ALTER TABLE ephys_analogsignalarray ADD COLUMN signal_shape varchar(255) NULL;
+ALTER TABLE ephys_analogsignalarray ADD COLUMN signal_dtype varchar(32) NULL;
+ALTER TABLE ephys_analogsignalarray ADD COLUMN signal_chunks varchar(255) NULL;
+ALTER TABLE ephys_analogsignalarray ADD COLUMN signal_checksum varchar(40) NULL;
+
+ALTER TABLE ephys_analogsignal ADD COLUMN signal_shape varchar(255) NULL;
+ALTER TABLE ephys_analogsignal ADD COLUMN signal_dtype varchar(32) NULL;
+ALTER TABLE ephys_analogsignal ADD COLUMN signal_chunks varchar(255) NULL;
+ALTER TABLE ephys_analogsignal ADD COLUMN signal_checksum varchar(40) NULL;
+
+ALTER TABLE ephys_irregularlysampledsignal ADD COLUMN signal_shape varchar(255) NULL;
+ALTER TABLE ephys_irregularlysampledsignal ADD COLUMN signal_dtype varchar(32) NULL;
+ALTER TABLE ephys_irregularlysampledsignal ADD COLUMN signal_chunks varchar(255) NULL;
+ALTER TABLE ephys_irregularlysampledsignal ADD COLUMN signal_checksum varchar(40) NULL;
+ALTER TABLE ephys_irregularlysampledsignal ADD COLUMN times_shape varchar(255) NULL;
+ALTER TABLE ephys_irregularlysampledsignal ADD COLUMN times_dtype varchar(32) NULL;
+ALTER TABLE ephys_irregularlysampledsignal ADD COLUMN times_chunks varchar(255) NULL;
+ALTER TABLE ephys_irregularlysampledsignal ADD COLUMN times_checksum varchar(40) NULL;
+ALTER TABLE ephys_irregularlysampledsignal ADD COLUMN times_min double precision NULL;
+ALTER TABLE ephys_irregularlysampledsignal ADD COLUMN times_max double precision NULL;
+
+ALTER TABLE ephys_spike ADD COLUMN waveform_shape varchar(255) NULL;
+ALTER TABLE ephys_spike ADD COLUMN waveform_dtype varchar(32) NULL;
+ALTER TABLE ephys_spike ADD COLUMN waveform_chunks varchar(255) NULL;
+ALTER TABLE ephys_spike ADD COLUMN waveform_checksum varchar(40) NULL;
+
+COMMIT;
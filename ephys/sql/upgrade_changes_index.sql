@@ -0,0 +1,40 @@
+-- Upgrade of existing databases to the starts_at and ends_at indexes of
+-- versioned tables, used by the changes feed. Not run by syncdb, new
+-- databases get these indexes with their tables. Run once:
+--
+--   psql <database> -f ephys/sql/upgrade_changes_index.sql
+
+BEGIN;
+
+CREATE INDEX ephys_spiketrain_starts_at ON ephys_spiketrain (starts_at);
+CREATE INDEX ephys_spiketrain_ends_at ON ephys_spiketrain (ends_at);
+CREATE INDEX ephys_analogsignalarray_starts_at ON ephys_analogsignalarray (starts_at);
+CREATE INDEX ephys_analogsignalarray_ends_at ON ephys_analogsignalarray (ends_at);
+CREATE INDEX ephys_analogsignal_starts_at ON ephys_analogsignal (starts_at);
+CREATE INDEX ephys_analogsignal_ends_at ON ephys_analogsignal (ends_at);
+CREATE INDEX ephys_irregularlysampledsignal_starts_at ON ephys_irregularlysampledsignal (starts_at);
+CREATE INDEX ephys_irregularlysampledsignal_ends_at ON ephys_irregularlysampledsignal (ends_at);
+CREATE INDEX ephys_spike_starts_at ON ephys_spike (starts_at);
+CREATE INDEX ephys_spike_ends_at ON ephys_spike (ends_at);
+CREATE INDEX ephys_eventarray_starts_at ON ephys_eventarray (starts_at);
+CREATE INDEX ephys_eventarray_ends_at ON ephys_eventarray (ends_at);
+CREATE INDEX ephys_event_starts_at ON ephys_event (starts_at);
+CREATE INDEX ephys_event_ends_at ON ephys_event (ends_at);
+CREATE INDEX ephys_epocharray_starts_at ON ephys_epocharray (starts_at);
+CREATE INDEX ephys_epocharray_ends_at ON ephys_epocharray (ends_at);
+CREATE INDEX ephys_epoch_starts_at ON ephys_epoch (starts_at);
+CREATE INDEX ephys_epoch_ends_at ON ephys_epoch (ends_at);
+CREATE INDEX ephys_recordingchannel_starts_at ON ephys_recordingchannel (starts_at);
+CREATE INDEX ephys_recordingchannel_ends_at ON ephys_recordingchannel (ends_at);
+CREATE INDEX ephys_unit_starts_at ON ephys_unit (starts_at);
+CREATE INDEX ephys_unit_ends_at ON ephys_unit (ends_at);
+CREATE INDEX ephys_segment_starts_at ON ephys_segment (starts_at);
+CREATE INDEX ephys_segment_ends_at ON ephys_segment (ends_at);
+CREATE INDEX ephys_recordingchannelgroup_starts_at ON ephys_recordingchannelgroup (starts_at);
+CREATE INDEX ephys_recordingchannelgroup_ends_at ON ephys_recordingchannelgroup (ends_at);
+CREATE INDEX ephys_block_starts_at ON ephys_block (starts_at);
+CREATE INDEX ephys_block_ends_at ON ephys_block (ends_at);
+CREATE INDEX ephys_recordingchannel_rcg_starts_at ON ephys_recordingchannel_rcg (starts_at);
+CREATE INDEX ephys_recordingchannel_rcg_ends_at ON ephys_recordingchannel_rcg (ends_at);
+
+COMMIT;
@@ -0,0 +1,24 @@
+-- Upgrade of existing databases to the (local_id, starts_at) index used by
+-- the version history and diff requests. Not run by syncdb, new databases
+-- get the index with the custom SQL in ephys/sql/block.sql. Run once:
+--
+--   psql <database> -f ephys/sql/upgrade_history_index.sql
+
+BEGIN;
+
+CREATE INDEX ephys_spiketrain_history ON ephys_spiketrain (local_id, starts_at);
+CREATE INDEX ephys_analogsignalarray_history ON ephys_analogsignalarray (local_id, starts_at);
+CREATE INDEX ephys_analogsignal_history ON ephys_analogsignal (local_id, starts_at);
+CREATE INDEX ephys_irregularlysampledsignal_history ON ephys_irregularlysampledsignal (local_id, starts_at);
+CREATE INDEX ephys_spike_history ON ephys_spike (local_id, starts_at);
+CREATE INDEX ephys_eventarray_history ON ephys_eventarray (local_id, starts_at);
+CREATE INDEX ephys_event_history ON ephys_event (local_id, starts_at);
+CREATE INDEX ephys_epocharray_history ON ephys_epocharray (local_id, starts_at);
+CREATE INDEX ephys_epoch_history ON ephys_epoch (local_id, starts_at);
+CREATE INDEX ephys_recordingchannel_history ON ephys_recordingchannel (local_id, starts_at);
+CREATE INDEX ephys_unit_history ON ephys_unit (local_id, starts_at);
+CREATE INDEX ephys_segment_history ON ephys_segment (local_id, starts_at);
+CREATE INDEX ephys_recordingchannelgroup_history ON ephys_recordingchannelgroup (local_id, starts_at);
+CREATE INDEX ephys_block_history ON ephys_block (local_id, starts_at);
+
+COMMIT;
@@ -0,0 +1,263 @@
+import os
+import hashlib
+import tempfile as tmp
+from contextlib import contextmanager
+
+import h5py
+import numpy as np
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+# number of bytes hashed at once when reading large datasets
+HASH_CHUNK_BYTES = 2 ** 24
+
+# number of values read at once by 'search_sorted' for contiguous datasets
+SEARCH_BLOCK = 4096
+
+
+def dataset_blocks(dataset):
+    """ yields values of an HDF5 dataset in blocks of rows, about
+    HASH_CHUNK_BYTES each """
+    if len(dataset.shape) == 0:
+        yield np.asarray(dataset[()])
+        return
+
+    row_size = dataset.dtype.itemsize
+    for dim in dataset.shape[1:]:
+        row_size *= dim
+
+    step = max(1, HASH_CHUNK_BYTES / max(1, row_size))
+    for i in range(0, dataset.shape[0], step):
+        yield dataset[i:i + step]
+
+
+def block_bytes(block):
+    """ bytes of an array block to hash. Values of object arrays (variable
+    length strings) are hashed by their representation, not by pointers """
+    if block.dtype.kind == 'O':
+        return repr(block.tolist())
+    return block.tostring()
+
+
+def dataset_checksum(dataset):
+    """ SHA1 hex digest of an HDF5 dataset. Depends only on the array dtype,
+    shape and values, not on the dataset name or HDF5 file layout, so equal
+    arrays uploaded in different files have equal checksums. """
+    sha = hashlib.sha1()
+    sha.update(dataset.dtype.str)
+    sha.update(str(dataset.shape))
+    for block in dataset_blocks(dataset):
+        sha.update(block_bytes(block))
+    return sha.hexdigest()
+
+
+def dataset_info(dataset, checksum=None):
+    """ metadata of an HDF5 dataset, as stored in the database: shape and
+    chunk shape (None if not chunked) as comma-separated integers, dtype
+    string, checksum (see 'dataset_checksum') and min / max values (None if
+    the array is empty or not numeric). Values are read once, the checksum
+    is computed only if not given. """
+    sha = None
+    if checksum is None:
+        sha = hashlib.sha1()
+        sha.update(dataset.dtype.str)
+        sha.update(str(dataset.shape))
+
+    numeric = dataset.dtype.kind in 'iuf'
+    low = high = None
+    for block in dataset_blocks(dataset):
+        if sha is not None:
+            sha.update(block_bytes(block))
+        if numeric and block.size:
+            block_low, block_high = float(block.min()), float(block.max())
+            low = block_low if low is None else min(low, block_low)
+            high = block_high if high is None else max(high, block_high)
+
+    join = lambda dims: ",".join(str(x) for x in dims)
+    return {
+        'shape': join(dataset.shape),
+        'dtype': dataset.dtype.str,
+        'chunks': dataset.chunks and join(dataset.chunks) or None,
+        'checksum': checksum or sha.hexdigest(),
+        'min': low,
+        'max': high
+    }
+
+
+def search_sorted(dataset, value, side='left'):
+    """ like numpy.searchsorted for a sorted 1-D HDF5 dataset, without
+    reading it whole: a binary search reads single values until the range
+    fits into one block (one HDF5 chunk for chunked datasets), which is read
+    and searched. Reads O(log(n / block)) values and one block. """
+    block = dataset.chunks and dataset.chunks[0] or SEARCH_BLOCK
+    low, high = 0, dataset.shape[0]
+    while high - low > block:
+        middle = (low + high) // 2
+        probe = dataset[middle]
+        if probe < value or (side == 'right' and probe == value):
+            low = middle + 1
+        else:
+            high = middle
+
+    return low + int(np.searchsorted(dataset[low:high], value, side=side))
+
+
+def file_checksum(path):
+    """ checksum of the array stored in a given HDF5 file (first dataset).
+    Files which are not HDF5 (or are empty) are hashed as raw bytes. """
+    try:
+        with h5py.File(path, 'r') as f:
+            names = sorted(f.keys())
+            if names and isinstance(f[names[0]], h5py.Dataset):
+                return dataset_checksum(f[names[0]])
+    except IOError:
+        pass  # not an HDF5 file
+
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), ''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def file_info(path, checksum=None):
+    """ metadata of the array stored in a given HDF5 file (first dataset, see
+    'dataset_info'), None if the file is not HDF5 or holds no dataset """
+    try:
+        with h5py.File(path, 'r') as f:
+            names = sorted(f.keys())
+            if names and isinstance(f[names[0]], h5py.Dataset):
+                return dataset_info(f[names[0]], checksum)
+    except IOError:
+        pass  # not an HDF5 file
+    return None
+
+
+def file_window(path, start=None, end=None):
+    """ index range (begin, stop) of the values within [start, end] of the
+    sorted array stored in a given HDF5 file (first dataset). Any bound may be
+    None for an open range. """
+    with h5py.File(path, 'r') as f:
+        dataset = f[sorted(f.keys())[0]]
+        begin = 0 if start is None else search_sorted(dataset, start)
+        stop = dataset.shape[0] if end is None else \
+            search_sorted(dataset, end, side='right')
+    return begin, max(begin, stop)
+
+
+def slice_file(source, target, begin, stop):
+    """ writes rows [begin, stop) of the array stored in a given HDF5 file
+    (first dataset) into the target HDF5 file, under the same name """
+    with h5py.File(source, 'r') as f:
+        name = sorted(f.keys())[0]
+        with h5py.File(target, 'w') as out:
+            out.create_dataset(name, data=f[name][begin:stop])
+
+
+def extract_array(source, target):
+    """ writes the array of an HDF5 file (first dataset), without any other
+    objects and attributes, into the target HDF5 file. Chunks and compression
+    are kept. Returns False, writing nothing, if the source file holds nothing
+    else or is not an HDF5 file with an array. """
+    try:
+        with h5py.File(source, 'r') as f:
+            names = sorted(f.keys())
+            if not names or not isinstance(f[names[0]], h5py.Dataset):
+                return False
+
+            dataset = f[names[0]]
+            if len(names) == 1 and not len(f.attrs) and not len(dataset.attrs):
+                return False
+
+            with h5py.File(target, 'w') as out:
+                f.copy(dataset, out, name=names[0], without_attrs=True)
+            return True
+    except IOError:
+        return False  # not an HDF5 file
+
+
+@contextmanager
+def content_path(content):
+    """ path of a file on disk with the given uploaded content. Content is
+    written to a temporary file if it is not on disk yet (in-memory upload) """
+    if hasattr(content, 'temporary_file_path'):
+        yield content.temporary_file_path()
+        return
+
+    path = getattr(getattr(content, 'file', None), 'name', None)
+    if isinstance(path, basestring) and os.path.isfile(path):
+        yield path
+        return
+
+    fd, path = tmp.mkstemp(suffix='.h5')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in content.chunks():
+                f.write(chunk)
+        yield path
+    finally:
+        os.remove(path)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File storage for array data. Every file is stored under the checksum of
+    its array (see 'dataset_checksum'), so uploading identical arrays, e.g. with
+    every new version of an object or with repeated 'in_bulk' uploads, does not
+    create new files: all object versions share the same file on disk.
+
+    The 'upload_to' name given by the model field is ignored.
+    """
+
+    def content_name(self, checksum):
+        """ relative path of the file holding an array with a given checksum """
+        return "/".join([checksum[:2], checksum[2:4], checksum + ".h5"])
+
+    def checksum_from_name(self, name):
+        """ returns checksum for a content-addressed file name or None if a
+        file was not stored by this storage (legacy upload paths) """
+        checksum = os.path.basename(name or '').split('.')[0]
+        if len(checksum) == 40 and name == self.content_name(checksum):
+            return checksum
+        return None
+
+    def touch(self, name):
+        """ marks a stored file as used now, so the 'collect_files' command
+        keeps it. Returns False if the file does not exist. """
+        try:
+            os.utime(self.path(name), None)
+            return True
+        except OSError:
+            return False
+
+    def save(self, name, content):
+        """ stores the content under its checksum. HDF5 files are stored with
+        their array only (see 'extract_array'), so the stored file holds
+        exactly the content its checksum is computed of. If a file with the
+        same array already exists, nothing is written and existing name
+        returned (see 'touch') """
+        if not hasattr(content, 'chunks'):
+            content = File(content)
+
+        fd, array_path = tmp.mkstemp(suffix='.h5')
+        os.close(fd)
+        try:
+            with content_path(content) as path:
+                if extract_array(path, array_path):
+                    path = array_path
+
+                target = self.content_name(file_checksum(path))
+                if not self.touch(target):
+                    with open(path, 'rb') as f:
+                        stored = self._save(target, File(f))
+
+                    # stored concurrently: '_save' picks another name, the
+                    # file under the content name has the same array
+                    if stored != target:
+                        self.delete(stored)
+                        self.touch(target)
+        finally:
+            os.remove(array_path)
+
+        return target.replace('\\', '/')
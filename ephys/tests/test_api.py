@@ -1,7 +1,18 @@
+import os
+import uuid
+import tempfile as tmp
+
+import h5py
+import simplejson as json
+
+from django.core.files import File
+from django.db.models.query import QuerySet
+
 from gndata_api.utils import update_keys_for_model
 from gndata_api.urls import EPHYS_RESOURCES
 from rest.tests.base import TestApi
 from ephys.tests.assets import Assets
+from ephys.models import Epoch, EventArray, IrregularlySampledSignal, ArrayBlob
 
 
 class TestEphysApi(TestApi):
@@ -28,4 +39,345 @@ class TestEphysApi(TestApi):
         ]
         for resource in self.resources:
             update_keys_for_model(resource.Meta.object_class)
-        self.assets = Assets().fill()
\ No newline at end of file
+        self.assets = Assets().fill()
+
+    def test_block_snapshot(self):
+        block = self.assets['block'][0]
+        url = "/%s/electrophysiology/block/%s/snapshot/" % (
+            self.url_prefix, block.local_id
+        )
+
+        self.login(self.ed)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 401)
+
+        self.logout()
+        self.login(self.bob)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        path = os.path.join(tmp.gettempdir(), uuid.uuid1().hex + '.h5')
+        with open(path, 'wb') as f:
+            f.write(''.join(response.streaming_content))
+
+        with h5py.File(path, 'r') as f:
+            names = f.keys()
+            segments = [n for n in names if n.split('-')[4] == 'segment']
+            self.assertEqual(len(segments), block.segment_set.count())
+            self.assertTrue(
+                "-api-v1-electrophysiology-block-%s-" % block.local_id in names
+            )
+            for n in names:
+                self.assertTrue('json' in f[n].keys())
+
+        # the snapshot round-trips with the bulk upload
+        with open(path, 'rb') as f:
+            response = self.client.post('/api/v1/in_bulk/', {'raw_file': f})
+        self.assertEqual(response.status_code, 200, response.content)
+        os.remove(path)
+
+    def test_history_of_deleted_block(self):
+        segment = self.assets['segment'][0]
+        url = "/%s/electrophysiology/segment/%s/history/" % (
+            self.url_prefix, segment.local_id
+        )
+
+        self.login(self.bob)
+        response = self.client.delete("/%s/electrophysiology/block/%s/" % (
+            self.url_prefix, segment.block.local_id
+        ))
+        self.assertEqual(response.status_code, 204)
+
+        # access is checked against the block of the deleted segment version
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        versions = json.loads(response.content)['selected']
+        self.assertTrue(versions[-1]['ends_at'] is not None)
+
+        self.logout()
+        self.login(self.ed)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 401)
+
+    def test_in_bulk_invalid(self):
+        block = self.assets['block'][0]
+        self.login(self.bob)
+        response = self.client.get(
+            "/%s/electrophysiology/block/%s/snapshot/" % (
+                self.url_prefix, block.local_id
+            )
+        )
+
+        path = os.path.join(tmp.gettempdir(), uuid.uuid1().hex + '.h5')
+        with open(path, 'wb') as f:
+            f.write(''.join(response.streaming_content))
+
+        # 'times' of an IrregularlySampledSignal shorter than its 'signal'
+        with h5py.File(path, 'a') as f:
+            name = [n for n in f.keys() if
+                    n.split('-')[4] == 'irregularlysampledsignal'][0]
+            del f[name]['times']
+            f[name].create_dataset('times', data=[1.0, 2.0])
+
+        versions = QuerySet(IrregularlySampledSignal).count()
+        with open(path, 'rb') as f:
+            response = self.client.post('/api/v1/in_bulk/', {'raw_file': f})
+        os.remove(path)
+
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(QuerySet(IrregularlySampledSignal).count(), versions)
+
+    def test_in_bulk_related(self):
+        block = self.assets['block'][0]
+        self.login(self.bob)
+        response = self.client.get(
+            "/%s/electrophysiology/block/%s/snapshot/" % (
+                self.url_prefix, block.local_id
+            )
+        )
+
+        path = os.path.join(tmp.gettempdir(), uuid.uuid1().hex + '.h5')
+        with open(path, 'wb') as f:
+            f.write(''.join(response.streaming_content))
+
+        def upload():
+            with open(path, 'rb') as f:
+                return self.client.post('/api/v1/in_bulk/', {'raw_file': f})
+
+        try:
+            # objects of another user are not accessible
+            self.logout()
+            self.login(self.ed)
+            self.assertEqual(upload().status_code, 401)
+
+            # unknown related object
+            with h5py.File(path, 'a') as f:
+                name = [n for n in f.keys() if n.split('-')[4] == 'segment'][0]
+                data = json.loads(f[name]['json'].value)
+                data['block'] = 'UNKNOWN000'
+                del f[name]['json']
+                f[name].create_dataset('json', data=json.dumps(data))
+
+            self.logout()
+            self.login(self.bob)
+            response = upload()
+            self.assertEqual(response.status_code, 400, response.content)
+        finally:
+            os.remove(path)
+
+    def test_array_info(self):
+        irsa = self.assets['irsa'][0]
+        url = "/%s/electrophysiology/irregularlysampledsignal/%s/" % (
+            self.url_prefix, irsa.local_id
+        )
+
+        def upload(data):
+            path = os.path.join(tmp.gettempdir(), uuid.uuid1().hex + '.h5')
+            with h5py.File(path, 'w') as f:
+                f.create_dataset(name='times', data=data, chunks=(2,))
+            try:
+                with open(path, 'rb') as f:
+                    return self.client.post(url + "times/", {'raw_file': f})
+            finally:
+                os.remove(path)
+
+        self.login(self.bob)
+
+        # metadata of the dummy files is recorded when objects are created
+        data = json.loads(self.client.get(url).content)
+        self.assertEqual(data['signal_shape'], "5")
+        self.assertEqual(data['times_shape'], "5")
+        self.assertEqual(data['times_min'], 1.48)
+        self.assertEqual(data['times_max'], 4.75)
+
+        response = upload([3.0, 1.0, 2.0])  # signal has 5 values
+        self.assertEqual(response.status_code, 400)
+
+        response = upload([3.0, 1.0, 2.0, 5.0, 4.0])
+        self.assertEqual(response.status_code, 202)
+
+        data = json.loads(self.client.get(url).content)
+        self.assertEqual(data['times_shape'], "5")
+        self.assertEqual(data['times_dtype'], "<f8")
+        self.assertEqual(data['times_chunks'], "2")
+        self.assertEqual(data['times_min'], 1.0)
+        self.assertEqual(data['times_max'], 5.0)
+        self.assertEqual(data['data_size'], 2 * 5 * 8)  # signal and times
+
+        current = IrregularlySampledSignal.objects.get(pk=irsa.pk)
+        self.assertEqual(current.times_checksum, ArrayBlob.objects.get(
+            path=current.times.name
+        ).checksum)
+
+        # metadata is read-only
+        response = self.client.put(url, json.dumps({'times_shape': "7"}),
+                                   content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(IrregularlySampledSignal.objects.get(
+            pk=irsa.pk).times_shape, "5")
+
+    def test_update_array_file(self):
+        array = self.assets['eventarray'][0]
+        storage = EventArray._meta.get_field('times').storage
+
+        path = os.path.join(tmp.gettempdir(), uuid.uuid1().hex + '.h5')
+        with h5py.File(path, 'w') as f:
+            f.create_dataset(name='times', data=[7.0, 8.0])
+        with open(path, 'rb') as f:
+            name = storage.save('ignored.h5', File(f))
+        os.remove(path)
+
+        EventArray.objects.filter(pk=array.pk).update(times=name)
+
+        current = EventArray.objects.get(pk=array.pk)
+        self.assertEqual(current.times.name, name)
+        self.assertEqual((current.times_shape, current.times_min,
+                          current.times_max), ("2", 7.0, 8.0))
+        self.assertEqual(current.labels_shape, array.labels_shape)
+        self.assertEqual(current.data_size - array.data_size,
+                         (2 - int(array.times_shape)) * 8)
+        self.assertEqual(ArrayBlob.objects.get(path=name).ref_count, 1)
+
+    def test_time_window(self):
+        irsa = self.assets['irsa'][0]
+        url = "/%s/electrophysiology/irregularlysampledsignal/%s/" % (
+            self.url_prefix, irsa.local_id
+        )
+
+        def read(response):
+            self.assertEqual(response.status_code, 200)
+            path = os.path.join(tmp.gettempdir(), uuid.uuid1().hex + '.h5')
+            with open(path, 'wb') as f:
+                f.write(''.join(response.streaming_content) if
+                        response.streaming else response.content)
+            try:
+                with h5py.File(path, 'r') as f:
+                    return list(f[f.keys()[0]][:])
+            finally:
+                os.remove(path)
+
+        self.login(self.bob)
+
+        path = os.path.join(tmp.gettempdir(), uuid.uuid1().hex + '.h5')
+        with h5py.File(path, 'w') as f:
+            f.create_dataset(name='times', data=[1.0, 2.0, 3.0, 4.0, 5.0])
+        with open(path, 'rb') as f:
+            response = self.client.post(url + "times/", {'raw_file': f})
+        os.remove(path)
+        self.assertEqual(response.status_code, 202)
+
+        signal = read(self.client.get(url + "signal/"))
+        window = {'start_time': 2, 'end_time': 4}
+
+        self.assertEqual(read(self.client.get(url + "times/", window)),
+                         [2.0, 3.0, 4.0])
+        self.assertEqual(read(self.client.get(url + "signal/", window)),
+                         signal[1:4])
+        self.assertEqual(read(self.client.get(url + "signal/", {
+            'start_time': 4.5})), signal[4:])
+        self.assertEqual(read(self.client.get(url + "times/", {
+            'start_time': 6})), [])
+        self.assertEqual(read(self.client.get(url + "times/", {
+            'end_time': 10})), [1.0, 2.0, 3.0, 4.0, 5.0])
+
+        response = self.client.get(url + "times/", {'start_time': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_columns(self):
+        for name in ['event', 'epoch']:  # older versions are not returned
+            obj = self.assets[name][0]
+            obj.label = "changed"
+            obj.save()
+
+        self.login(self.bob)
+
+        for name in ['event', 'epoch']:
+            url = "/%s/electrophysiology/%s/" % (self.url_prefix, name)
+            expected = json.loads(self.client.get(url).content)['selected']
+            expected.sort(key=lambda x: x['time'])
+
+            response = self.client.get(url + "columns/")
+            self.assertEqual(response.status_code, 200)
+            columns = json.loads(''.join(response.streaming_content))
+
+            self.assertEqual(columns['meta']['total_count'], len(expected))
+            self.assertEqual(columns['id'], [x['id'] for x in expected])
+            self.assertEqual(columns['time'], [x['time'] for x in expected])
+            self.assertEqual(columns['label'], [x['label'] for x in expected])
+            self.assertTrue('resource_uri' not in columns)
+
+            segment = expected[0]['segment'].rstrip('/').split('/')[-1]
+            response = self.client.get(url + "columns/", {
+                'segment': segment, 'time__gte': expected[0]['time'],
+                'format': 'hdf5'
+            })
+            self.assertEqual(response.status_code, 200)
+
+            path = os.path.join(tmp.gettempdir(), uuid.uuid1().hex + '.h5')
+            with open(path, 'wb') as f:
+                f.write(response.content)
+            with h5py.File(path, 'r') as f:
+                selected = [x for x in expected if
+                            x['segment'].endswith('/%s/' % segment)]
+                self.assertEqual(list(f['time'][:]),
+                                 [x['time'] for x in selected])
+                self.assertEqual(list(f['segment'][:]),
+                                 [segment] * len(selected))
+            os.remove(path)
+
+        self.logout()
+        self.login(self.ed)
+
+        response = self.client.get(
+            "/%s/electrophysiology/event/columns/" % self.url_prefix
+        )
+        columns = json.loads(''.join(response.streaming_content))
+        self.assertEqual(columns['meta']['total_count'],
+                         self.get_available_objs(
+                             EPHYS_RESOURCES['event'], self.ed
+                         ).count())
+
+    def test_create_columns(self):
+        segment = self.assets['segment'][0]
+        url = "/%s/electrophysiology/epoch/columns/" % self.url_prefix
+        columns = {
+            'segment': segment.local_id,
+            'time': [1.5, 2.5, 3.5],
+            'duration': [0.5, 0.5, 1.0],
+            'label': ["stimulus", "response", "reward"],
+            'time__unit': "s"
+        }
+        kwargs = {'content_type': "application/json"}
+
+        self.login(self.ed)
+        response = self.client.post(url, json.dumps(columns), **kwargs)
+        self.assertEqual(response.status_code, 401, response.content)
+
+        self.logout()
+        self.login(self.bob)
+
+        invalid = [
+            dict(columns, time__unit="parsec"),
+            dict(columns, label=["stimulus"]),
+            dict(columns, segment="nonexistent"),
+            dict(columns, unknown=[1, 2, 3]),
+            dict((k, v) for k, v in columns.items() if k != 'time'),
+        ]
+        for data in invalid:
+            response = self.client.post(url, json.dumps(data), **kwargs)
+            self.assertEqual(response.status_code, 400, response.content)
+
+        response = self.client.post(url, json.dumps(columns), **kwargs)
+        self.assertEqual(response.status_code, 201, response.content)
+        created = json.loads(response.content)
+        self.assertEqual(created['meta']['total_count'], 3)
+
+        epochs = Epoch.objects.filter(local_id__in=created['id'])
+        self.assertEqual(len(epochs), 3)
+        for epoch in epochs:
+            self.assertEqual(epoch.block_id, segment.block_id)
+            self.assertEqual(epoch.owner, self.bob)
+            self.assertEqual(epoch.time__unit, "s")
+            self.assertEqual(epoch.duration__unit, "ms")
+        self.assertEqual(sorted(e.label for e in epochs),
+                         sorted(columns['label']))
@@ -0,0 +1,113 @@
+import simplejson as json
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from ephys.tests.assets import Assets
+from ephys.models import Event
+from gndata_api.views import RESOURCES
+
+
+class TestChanges(TestCase):
+    """
+    Tests the incremental changes feed.
+    """
+    fixtures = ["users.json"]
+
+    def setUp(self):
+        self.origin = timezone.now()
+        self.assets = Assets().fill()
+
+        self.bob = User.objects.get(pk=1)
+        self.client.login(username=self.bob.username, password="pass")
+
+    def get_changes(self, since, **params):
+        params['since'] = since
+        response = self.client.get("/api/v1/changes/", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return json.loads(response.content)
+
+    def test_created(self):
+        expected = set()
+        for name, res in RESOURCES.items():
+            model = res._meta.object_class
+            available = model.security_filter(model.objects.all(), self.bob)
+            expected.update((name, obj.pk) for obj in available)
+
+        data = self.get_changes(self.origin.isoformat())
+        self.assertFalse(data['meta']['has_more'])
+        self.assertEqual(
+            set((x['type'], x['id']) for x in data['selected']), expected
+        )
+        self.assertEqual(set(x['action'] for x in data['selected']),
+                         set(['created']))
+
+        times = [x['time'] for x in data['selected']]
+        self.assertEqual(times, sorted(times))
+
+        # nothing changed since the last change
+        data = self.get_changes(data['meta']['next'])
+        self.assertEqual(data['selected'], [])
+
+    def test_updated_deleted(self):
+        since = timezone.now().isoformat()
+        updated, deleted = self.assets['event'][:2]
+
+        updated.label = "updated"
+        updated.save()
+        deleted.delete()
+        current = Event.objects.get(pk=updated.pk)
+
+        changes = self.get_changes(since)['selected']
+        self.assertEqual(
+            [(x['type'], x['id'], x['guid'], x['action']) for x in changes],
+            [('event', updated.pk, current.guid, 'updated'),
+             ('event', deleted.pk, deleted.guid, 'deleted')]
+        )
+
+    def test_cursor(self):
+        since = self.origin.isoformat()
+        expected = self.get_changes(since)['selected']
+
+        pages = []
+        while True:
+            data = self.get_changes(since, limit=7)
+            pages.extend(data['selected'])
+            since = data['meta']['next']
+            if not data['meta']['has_more']:
+                break
+
+        self.assertEqual(pages, expected)
+
+    def test_full_pages(self):
+        since = timezone.now().isoformat()
+        deleted, updated = self.assets['event'][:2]
+
+        for i in range(3):
+            deleted.label = "version %d" % i
+            deleted.save()
+        deleted.delete()
+        updated.label = "updated"
+        updated.save()
+
+        # closed versions of the deleted object do not take up the page
+        data = self.get_changes(since, limit=2)
+        self.assertFalse(data['meta']['has_more'])
+        self.assertEqual(
+            [(x['id'], x['action']) for x in data['selected']],
+            [(deleted.pk, 'deleted'), (updated.pk, 'updated')]
+        )
+
+    def test_bad_request(self):
+        response = self.client.get("/api/v1/changes/")
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get("/api/v1/changes/", {'since': 'today'})
+        self.assertEqual(response.status_code, 400)
+
+        self.client.logout()
+        response = self.client.get("/api/v1/changes/", {
+            'since': self.origin.isoformat()
+        })
+        self.assertEqual(response.status_code, 401)
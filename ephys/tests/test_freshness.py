@@ -0,0 +1,85 @@
+import simplejson as json
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ephys.tests.assets import Assets
+from ephys.models import Event
+from gndata_api import views
+
+
+class TestFreshness(TestCase):
+    """
+    Tests the bulk check of cached object versions.
+    """
+    fixtures = ["users.json"]
+
+    def setUp(self):
+        self.assets = Assets().fill()
+
+        self.bob = User.objects.get(pk=1)
+        self.client.login(username=self.bob.username, password="pass")
+
+    def check(self, data):
+        return self.client.post("/api/v1/freshness/", json.dumps(data),
+                                content_type="application/json")
+
+    def test_freshness(self):
+        current, updated, deleted = self.assets['event'][:3]
+        cached = [[obj.pk, obj.guid] for obj in (current, updated, deleted)]
+        cached.append(["NOTEXIST00", "0" * 40])
+
+        updated.label = "updated"
+        updated.save()
+        deleted.delete()
+        new_guid = Event.objects.get(pk=updated.pk).guid
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.check({'event': cached})
+        self.assertEqual(response.status_code, 200, response.content)
+
+        events = [q for q in queries.captured_queries
+                  if 'ephys_event' in q['sql']]
+        self.assertEqual(len(events), 1)
+
+        result = json.loads(response.content)['event']
+        self.assertEqual(result['current'], [current.pk])
+        self.assertEqual(result['outdated'], {updated.pk: new_guid})
+        self.assertEqual(sorted(result['deleted']),
+                         sorted([deleted.pk, "NOTEXIST00"]))
+
+    def test_chunks(self):
+        events = self.assets['event']
+        cached = [[obj.pk, obj.guid] for obj in events]
+
+        chunk_size = views.FRESHNESS_CHUNK_SIZE
+        views.FRESHNESS_CHUNK_SIZE = 3
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.check({'event': cached})
+        finally:
+            views.FRESHNESS_CHUNK_SIZE = chunk_size
+
+        events_queries = [q for q in queries.captured_queries
+                          if 'ephys_event' in q['sql']]
+        self.assertEqual(len(events_queries), (len(events) + 2) / 3)
+
+        result = json.loads(response.content)['event']
+        self.assertEqual(sorted(result['current']),
+                         sorted(obj.pk for obj in events))
+
+    def test_bad_request(self):
+        response = self.check({'unknown': []})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.check({'event': ["ABC"]})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.check([])
+        self.assertEqual(response.status_code, 400)
+
+        self.client.logout()
+        response = self.check({'event': []})
+        self.assertEqual(response.status_code, 401)
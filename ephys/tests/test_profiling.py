@@ -0,0 +1,60 @@
+import simplejson as json
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from ephys.tests.assets import Assets
+from gndata_api import settings
+from gndata_api import profiling
+
+
+class TestProfiling(TestCase):
+    """
+    Tests the request profiling middleware.
+    """
+    fixtures = ["users.json"]
+
+    def setUp(self):
+        self.enabled = getattr(settings, 'PROFILING', False)
+        settings.PROFILING = True
+        profiling.stats.reset()
+        Assets().fill()
+
+        self.bob = User.objects.get(pk=1)
+        self.bob.is_staff = True
+        self.bob.save()
+        self.client.login(username=self.bob.username, password="pass")
+
+    def test_report(self):
+        url = "/api/v1/electrophysiology/segment/"
+        threshold = getattr(settings, 'STREAMING_THRESHOLD', 200)
+        settings.STREAMING_THRESHOLD = 0  # lists are streamed
+        try:
+            for i in range(3):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.streaming)
+                content = ''.join(response.streaming_content)
+        finally:
+            settings.STREAMING_THRESHOLD = threshold
+
+        response = self.client.get("/api/v1/profiling/")
+        self.assertEqual(response.status_code, 200)
+
+        metrics = json.loads(response.content)['segment GET']
+        self.assertEqual(metrics['queries']['count'], 3)
+        self.assertTrue(metrics['queries']['max'] > 0)
+        for name in ['sql_ms', 'inject_time_ms', 'security_filter_ms',
+                     'dehydrate_ms', 'serialize_ms', 'size_bytes']:
+            self.assertTrue(name in metrics, name)
+        self.assertEqual(metrics['size_bytes']['max'], len(content))
+
+    def test_staff_only(self):
+        self.bob.is_staff = False
+        self.bob.save()
+
+        response = self.client.get("/api/v1/profiling/")
+        self.assertEqual(response.status_code, 401)
+
+    def tearDown(self):
+        settings.PROFILING = self.enabled
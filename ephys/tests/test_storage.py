@@ -0,0 +1,280 @@
+import os
+import time
+import uuid
+import datetime
+import shutil
+import tempfile as tmp
+from StringIO import StringIO
+
+import h5py
+import numpy as np
+
+from django.core.files import File
+from django.core.management import call_command
+from django.db.models.query import QuerySet
+from django.test import TestCase
+from django.utils import timezone
+
+from ephys.models import ArrayBlob, EventArray
+from ephys.storage import ContentAddressedStorage, file_info, search_sorted
+from ephys.tests.assets import Assets
+from gndata_api import settings
+
+
+class TestContentAddressedStorage(TestCase):
+    """
+    Tests deduplication of array files in the content-addressed storage.
+    """
+
+    def setUp(self):
+        self.location = tmp.mkdtemp()
+        self.storage = ContentAddressedStorage(location=self.location)
+
+    def make_file(self, dataset_name, data):
+        path = os.path.join(self.location, dataset_name + '.upload')
+        with h5py.File(path, 'w') as f:
+            f.create_dataset(name=dataset_name, data=data)
+        return path
+
+    def save(self, path):
+        with open(path, 'rb') as f:
+            return self.storage.save('ignored.h5', File(f))
+
+    def test_identical_arrays_share_file(self):
+        first = self.save(self.make_file('first', [1.48, 2.58, 3.30]))
+        second = self.save(self.make_file('second', [1.48, 2.58, 3.30]))
+
+        self.assertEqual(first, second)
+        self.assertTrue(self.storage.exists(first))
+        self.assertEqual(self.storage.checksum_from_name(first),
+                         os.path.basename(first)[:-3])
+
+    def test_different_arrays(self):
+        first = self.save(self.make_file('first', [1.48, 2.58, 3.30]))
+        second = self.save(self.make_file('second', [1.48, 2.58, 3.31]))
+        third = self.save(self.make_file('third', [[1.48, 2.58, 3.30]]))
+
+        self.assertEqual(len(set([first, second, third])), 3)
+
+    def test_concurrent_save(self):
+        path = self.make_file('first', [1.48, 2.58, 3.30])
+        name = self.save(path)
+
+        # another upload stores the file between the check and the write
+        self.storage.touch = lambda name: False
+        self.assertEqual(self.save(path), name)
+
+        stored = os.listdir(os.path.dirname(self.storage.path(name)))
+        self.assertEqual(stored, [os.path.basename(name)])
+
+    def test_array_only_is_stored(self):
+        first = self.make_file('first', [1.48, 2.58, 3.30])
+        with h5py.File(first, 'a') as f:
+            f['first'].attrs['units'] = 'ms'
+            f.create_dataset(name='other', data=[1, 2])
+        second = self.make_file('second', [1.48, 2.58, 3.30])
+        with h5py.File(second, 'a') as f:
+            f.attrs['comment'] = 'different'
+
+        name = self.save(first)
+        self.assertEqual(self.save(second), name)
+        with h5py.File(self.storage.path(name), 'r') as f:
+            self.assertEqual(f.keys(), ['first'])
+            self.assertEqual(len(f.attrs) + len(f['first'].attrs), 0)
+            self.assertEqual(list(f['first'][:]), [1.48, 2.58, 3.30])
+
+    def test_string_arrays(self):
+        labels = np.array(['stimulus', 'response'], dtype=object)
+        string_type = h5py.special_dtype(vlen=str)
+
+        names = []
+        for dataset_name in ['first', 'second']:
+            path = os.path.join(self.location, dataset_name + '.upload')
+            with h5py.File(path, 'w') as f:
+                f.create_dataset(dataset_name, data=labels, dtype=string_type)
+            names.append(self.save(path))
+
+        self.assertEqual(names[0], names[1])
+
+    def test_reference_count(self):
+        name = self.save(self.make_file('first', [1.48, 2.58, 3.30]))
+        checksum = self.storage.checksum_from_name(name)
+
+        ArrayBlob.objects.reference(checksum, name, self.storage)
+        ArrayBlob.objects.reference(checksum, name, self.storage, count=2)
+
+        blob = ArrayBlob.objects.get(checksum=checksum)
+        self.assertEqual(blob.ref_count, 3)
+        self.assertEqual(blob.size, self.storage.size(name))
+
+    def test_array_info(self):
+        name = self.save(self.make_file('first', [[1.0, 2.5], [-3.0, 4.0]]))
+        checksum = self.storage.checksum_from_name(name)
+
+        info = file_info(self.storage.path(name))
+        self.assertEqual(info, {
+            'shape': "2,2", 'dtype': "<f8", 'chunks': None,
+            'checksum': checksum, 'min': -3.0, 'max': 4.0
+        })
+
+        ArrayBlob.objects.reference(checksum, name, self.storage, info=info)
+        self.assertEqual(ArrayBlob.objects.get(checksum=checksum).info, info)
+
+    def test_search_sorted(self):
+        times = np.cumsum(np.random.randint(0, 4, 100000)) / 10.
+        path = os.path.join(self.location, 'times.h5')
+        with h5py.File(path, 'w') as f:
+            f.create_dataset('times', data=times, chunks=(256,))
+
+        class Counted(object):  # counts reads of the dataset
+            def __init__(self, dataset):
+                self.dataset, self.reads = dataset, 0
+                self.shape, self.chunks = dataset.shape, dataset.chunks
+
+            def __getitem__(self, key):
+                self.reads += 1
+                return self.dataset[key]
+
+        with h5py.File(path, 'r') as f:
+            for value in [-1.0, times[0], times[777], 1234.56, times[-1], 1e9]:
+                for side in ['left', 'right']:
+                    dataset = Counted(f['times'])
+                    self.assertEqual(
+                        search_sorted(dataset, value, side),
+                        np.searchsorted(times, value, side)
+                    )
+                    self.assertTrue(dataset.reads <= 10)  # log2(100000 / 256)
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+
+class TestCollectFiles(TestCase):
+    """
+    Tests the garbage collector for data files.
+    """
+    fixtures = ["users.json"]
+
+    def setUp(self):
+        self.root = tmp.mkdtemp()
+        self.archive = tmp.mkdtemp()
+        self.media_root, settings.FILE_MEDIA_ROOT = \
+            settings.FILE_MEDIA_ROOT, self.root
+
+    def make_file(self, path, age_days):
+        fullpath = os.path.join(self.root, path)
+        if not os.path.exists(os.path.dirname(fullpath)):
+            os.makedirs(os.path.dirname(fullpath))
+        with open(fullpath, 'w') as f:
+            f.write('12345')
+        mtime = time.time() - age_days * 24 * 3600
+        os.utime(fullpath, (mtime, mtime))
+        return fullpath
+
+    def collect(self, **options):
+        out, err = StringIO(), StringIO()
+        call_command('collect_files', days=30, stdout=out, stderr=err,
+                     **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_dry_run(self):
+        old = self.make_file('a/old.h5', 40)
+        self.make_file('a/recent.h5', 1)
+
+        out, err = self.collect(dry_run=True)
+
+        self.assertTrue('a/old.h5' in out)
+        self.assertFalse('a/recent.h5' in out)
+        self.assertTrue(os.path.exists(old))  # nothing removed
+
+    def test_remove(self):
+        old = self.make_file('a/old.h5', 40)
+        recent = self.make_file('a/recent.h5', 1)
+        ArrayBlob.objects.create(checksum='1' * 40, path='a/old.h5')
+
+        out, err = self.collect()
+
+        self.assertTrue("1 files (5 bytes) removed" in out, out)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(recent))
+        self.assertFalse(ArrayBlob.objects.filter(path='a/old.h5').exists())
+
+    def test_archive(self):
+        old = self.make_file('a/old.h5', 40)
+
+        self.collect(archive=self.archive)
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(os.path.join(self.archive, 'a/old.h5')))
+
+    def test_referenced_kept(self):
+        array = Assets().fill()['eventarray'][0]
+        by_object = self.make_file(array.times.name, 40)
+        by_blob = self.make_file('a/counted.h5', 40)
+        ArrayBlob.objects.create(checksum='1' * 40, path='a/counted.h5',
+                                 ref_count=1)
+
+        out, err = self.collect()
+
+        self.assertTrue(os.path.exists(by_object))
+        self.assertTrue(os.path.exists(by_blob))
+        self.assertTrue(ArrayBlob.objects.filter(path='a/counted.h5').exists())
+
+    def test_closed_reference(self):
+        array = Assets().fill()['eventarray'][0]
+        storage = EventArray._meta.get_field('times').storage
+        name = storage.content_name('1' * 40)
+        closed = self.make_file(name, 400)
+        ArrayBlob.objects.create(checksum='1' * 40, path=name, ref_count=1)
+        ended = timezone.now() - datetime.timedelta(days=400)
+        QuerySet(EventArray).filter(guid=array.guid).update(
+            times=name, starts_at=ended - datetime.timedelta(days=1),
+            ends_at=ended
+        )
+
+        self.collect()  # the closed version is still stored
+        self.assertTrue(os.path.exists(closed))
+
+        call_command('compact_history', 'ephys.EventArray', days=365,
+                     stdout=StringIO())
+        self.assertEqual(ArrayBlob.objects.get(path=name).ref_count, 0)
+
+        self.collect()
+        self.assertFalse(os.path.exists(closed))
+        self.assertFalse(ArrayBlob.objects.filter(path=name).exists())
+
+    def test_reused_kept(self):
+        storage = ContentAddressedStorage(location=self.root)
+        upload = os.path.join(self.archive, 'upload.h5')
+        with h5py.File(upload, 'w') as f:
+            f.create_dataset(name='upload', data=[1.0, 2.0])
+        with open(upload, 'rb') as f:
+            name = storage.save('ignored.h5', File(f))
+
+        stored = storage.path(name)
+        mtime = time.time() - 40 * 24 * 3600
+        os.utime(stored, (mtime, mtime))
+
+        with open(upload, 'rb') as f:  # upload reuses the stored file
+            self.assertEqual(storage.save('ignored.h5', File(f)), name)
+
+        self.collect()
+        self.assertTrue(os.path.exists(stored))
+
+    def test_failure_reported(self):
+        failing = self.make_file('a/old.h5', 40)
+        other = self.make_file('b/old.h5', 40)
+        with open(os.path.join(self.archive, 'a'), 'w') as f:
+            f.write('not a directory')
+
+        out, err = self.collect(archive=self.archive)
+
+        self.assertTrue('a/old.h5' in err)
+        self.assertTrue(os.path.exists(failing))  # left in place
+        self.assertFalse(os.path.exists(other))
+        self.assertTrue(os.path.exists(os.path.join(self.archive, 'b/old.h5')))
+
+    def tearDown(self):
+        settings.FILE_MEDIA_ROOT = self.media_root
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.archive)
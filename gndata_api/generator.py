@@ -0,0 +1,205 @@
+import os
+import random
+import shutil
+import tempfile as tmp
+
+import h5py
+import numpy as np
+
+from django.core.files import File
+
+from ephys.models import *
+from metadata.models import Document, Section, Property, Value
+
+
+class DatasetGenerator(object):
+    """
+    Generates realistic datasets for load testing: a Document with a deep odML
+    section tree (with properties and values) and Blocks with Segments,
+    a RecordingChannelGroup with RecordingChannels and Units, and per Segment
+    long analog signals, spike trains, spikes, events and epochs.
+
+    Objects are inserted with one bulk_create per model and level, arrays are
+    written to the data storage. Sizes are controlled by constructor params,
+    'seed' makes datasets reproducible.
+    """
+
+    def __init__(self, owner, blocks=1, segments=3, channels=8,
+                 signal_length=10000, spikes=1000, events=50,
+                 section_depth=3, section_width=3, seed=None):
+        self.owner = owner
+        self.blocks = blocks
+        self.segments = segments
+        self.channels = channels
+        self.signal_length = signal_length
+        self.spikes = spikes
+        self.events = events
+        self.section_depth = section_depth
+        self.section_width = section_width
+
+        self.random = random.Random(seed)
+        self.np_random = np.random.RandomState(seed)
+        self.created = {}
+
+    # helpers ------------------------------------------------------------------
+
+    def create(self, model, objects):
+        """ bulk-creates objects of a given model, sets their IDs """
+        model.objects.bulk_create(objects)
+        self.created.setdefault(model.__name__.lower(), []).extend(objects)
+        return objects
+
+    def array(self, data):
+        """ stores an array in the data storage, returns its file name """
+        tmpdir = tmp.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'array.h5')
+            with h5py.File(path, 'w') as f:
+                f.create_dataset(name='data', data=data)
+
+            with open(path, 'rb') as f:
+                return fs.save('array.h5', File(f))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def times(self, count, t_stop):
+        return np.sort(self.np_random.uniform(0, t_stop, count))
+
+    # metadata -----------------------------------------------------------------
+
+    def generate_metadata(self):
+        """ Document with a section tree of a given depth and width, every
+        section has a property with a value. Returns all sections. """
+        document = self.create(Document, [Document(
+            author="generator", version="1.0", owner=self.owner
+        )])[0]
+
+        sections, level = [], [None]
+        for depth in range(self.section_depth):
+            level = self.create(Section, [
+                Section(
+                    name="section %d.%d" % (depth, i), type="level #%d" % depth,
+                    section_id=parent and parent.pk, document_id=document.pk,
+                    tree_position=i, owner=self.owner
+                )
+                for parent in level for i in range(self.section_width)
+            ])
+            sections.extend(level)
+
+        properties = self.create(Property, [
+            Property(name="property %d" % i, section_id=s.pk,
+                     document_id=document.pk, owner=self.owner)
+            for i, s in enumerate(sections)
+        ])
+        self.create(Value, [
+            Value(data="%.3f" % self.random.random(), property_id=p.pk,
+                  document_id=document.pk, owner=self.owner)
+            for p in properties
+        ])
+
+        return sections
+
+    # ephys --------------------------------------------------------------------
+
+    def generate_block(self, index, sections):
+        metadata = lambda: self.random.choice(sections).pk if sections else None
+        common = lambda block: {'block_id': block.pk, 'owner': self.owner}
+        t_stop = self.signal_length / 10.0  # 10 kHz, in ms
+
+        block = self.create(Block, [Block(
+            name="generated block %d" % index, owner=self.owner,
+            metadata_id=sections and sections[0].pk or None
+        )])[0]
+
+        rcg = self.create(RecordingChannelGroup, [RecordingChannelGroup(
+            name="electrode group", **common(block)
+        )])[0]
+        channels = self.create(RecordingChannel, [
+            RecordingChannel(name="channel %d" % i, index=i, **common(block))
+            for i in range(self.channels)
+        ])
+        self.create(recordingchannel_rcg, [
+            recordingchannel_rcg(recordingchannelgroup_id=rcg.pk,
+                                 recordingchannel_id=rc.pk)
+            for rc in channels
+        ])
+        units = self.create(Unit, [
+            Unit(name="unit %d" % i, recordingchannelgroup_id=rcg.pk,
+                 **common(block))
+            for i in range(self.channels)
+        ])
+
+        segments = self.create(Segment, [
+            Segment(name="trial %d" % i, index=i, metadata_id=metadata(),
+                    **common(block))
+            for i in range(self.segments)
+        ])
+
+        for segment in segments:
+            self.generate_segment(block, segment, channels, units, t_stop)
+
+        return block
+
+    def generate_segment(self, block, segment, channels, units, t_stop):
+        common = {
+            'block_id': block.pk, 'segment_id': segment.pk, 'owner': self.owner
+        }
+
+        self.create(AnalogSignal, [
+            AnalogSignal(
+                name="signal %d" % i, sampling_rate=10.0, t_start=0.0,
+                recordingchannel_id=rc.pk,
+                signal=self.array(self.np_random.randn(self.signal_length)),
+                **common
+            ) for i, rc in enumerate(channels)
+        ])
+        self.create(AnalogSignalArray, [AnalogSignalArray(
+            name="signal array", sampling_rate=10.0, t_start=0.0,
+            signal=self.array(self.np_random.randn(
+                self.signal_length, len(channels)
+            )), **common
+        )])
+        self.create(IrregularlySampledSignal, [IrregularlySampledSignal(
+            name="irregular signal", t_start=0.0,
+            times=self.array(self.times(self.events, t_stop)),
+            signal=self.array(self.np_random.randn(self.events)), **common
+        )])
+
+        self.create(SpikeTrain, [
+            SpikeTrain(
+                name="spike train %d" % i, t_start=0.0, t_stop=t_stop,
+                unit_id=unit.pk,
+                times=self.array(self.times(self.spikes, t_stop)),
+                **common
+            ) for i, unit in enumerate(units)
+        ])
+        self.create(Spike, [
+            Spike(time=t, unit_id=self.random.choice(units).pk,
+                  waveform=self.array(self.np_random.randn(32)), **common)
+            for t in self.times(min(self.spikes, self.events), t_stop)
+        ])
+
+        self.create(EventArray, [EventArray(
+            name="events", times=self.array(self.times(self.events, t_stop)),
+            labels=self.array(["event"] * self.events), **common
+        )])
+        self.create(Event, [
+            Event(label="event %d" % i, time=t, **common)
+            for i, t in enumerate(self.times(self.events, t_stop))
+        ])
+        self.create(EpochArray, [EpochArray(
+            name="epochs", times=self.array(self.times(self.events, t_stop)),
+            durations=self.array(self.np_random.uniform(1, 10, self.events)),
+            labels=self.array(["epoch"] * self.events), **common
+        )])
+        self.create(Epoch, [
+            Epoch(label="epoch %d" % i, time=t, duration=5.0, **common)
+            for i, t in enumerate(self.times(self.events, t_stop))
+        ])
+
+    def generate(self):
+        """ generates the whole dataset, returns created objects by type """
+        sections = self.generate_metadata()
+        for i in range(self.blocks):
+            self.generate_block(i, sections)
+        return self.created
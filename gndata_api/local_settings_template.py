@@ -44,6 +44,13 @@ TEMPLATE_DIRS = (
 )
 
 API_LIMIT_PER_PAGE = 500
+# API lists with more objects than this are streamed, encoded in chunks. Lists
+# have at most API_LIMIT_PER_PAGE objects, so it should be lower to apply.
+STREAMING_THRESHOLD = 200
+# bulk inserts of more objects than this use COPY on PostgreSQL
+COPY_THRESHOLD = 1000
+# objects fetched at once from the database cursor by the /export/ endpoints
+EXPORT_CHUNK_SIZE = 1000
 BROWSER_LIMIT_PER_PAGE = 20
 
 TASTYPIE_FULL_DEBUG = True
@@ -51,5 +58,22 @@ TASTYPIE_FULL_DEBUG = True
 # Absolute path to the directory that holds storage of USER FILES.
 FILE_MEDIA_ROOT = "/data/private/"
 
+# Data files not referenced by any stored object version (see 'compact_history')
+# and not modified within this number of days are removed by the
+# 'collect_files' command.
+FILE_RETENTION_DAYS = 30
+
+# Object versions closed more than this number of days ago are removed by the
+# 'compact_history' command, except versions valid at the snapshot times
+# (ISO format, e.g. "2014-06-01T00:00:00Z").
+VERSIONING_RETENTION_DAYS = 365
+VERSIONING_SNAPSHOTS = []
+
+# Record query counts and timings per API resource (see gndata_api.profiling).
+# Reports are available for staff users at /api/v1/profiling/ and written to
+# the 'gndata_api.profiling' log every PROFILING_LOG_INTERVAL seconds.
+PROFILING = False
+PROFILING_LOG_INTERVAL = 300
+
 # Absolute path to the directory that holds PUBLIC media.
 MEDIA_ROOT = "/data/public/"
\ No newline at end of file
@@ -0,0 +1,247 @@
+"""
+Opt-in request profiling. Enable with PROFILING = True in local settings.
+
+For every request the middleware records the number and the time of SQL
+queries, the time spent in profiled sections (see 'profiled') and the response
+size. Measurements are aggregated per (resource, HTTP method) into histograms
+with logarithmic buckets, available as JSON for staff users at
+/api/v1/profiling/ and dumped to the 'gndata_api.profiling' log every
+PROFILING_LOG_INTERVAL seconds. Streamed responses are measured once their
+content is sent, as it is produced (and queried) lazily.
+"""
+import math
+import time
+import logging
+import threading
+from functools import wraps
+
+import simplejson as json
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import HttpResponse
+from tastypie import http
+
+from gndata_api import settings
+
+logger = logging.getLogger('gndata_api.profiling')
+
+_local = threading.local()
+
+
+def profiled(section):
+    """ decorator, accumulates time spent in a function as a 'section' of the
+    request being profiled. Does nothing if no request is profiled. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = getattr(_local, 'profile', None)
+            if profile is None:
+                return func(*args, **kwargs)
+
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.add(section, (time.time() - start) * 1000)
+        return wrapper
+    return decorator
+
+
+def profiled_iter(section):
+    """ decorator for generator functions, accumulates time spent producing
+    items (like chunks of streamed content) as a 'section' of the request
+    being profiled """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            items = iter(func(*args, **kwargs))
+            while True:
+                start = time.time()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                finally:
+                    profile = getattr(_local, 'profile', None)
+                    if profile is not None:
+                        profile.add(section, (time.time() - start) * 1000)
+                yield item
+        return wrapper
+    return decorator
+
+
+class Histogram(object):
+    """ histogram with buckets growing in powers of 2 """
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        bucket = 0 if value < 1 else int(math.ceil(math.log(value, 2)))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """ upper bound of the bucket containing the p-th percentile """
+        seen, limit = 0, self.count * p / 100.0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= limit:
+                return min(2 ** bucket, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.count and self.total / self.count,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'buckets': dict(('<=%d' % 2 ** k, v) for k, v in
+                            self.buckets.items())
+        }
+
+
+class Profile(object):
+    """ measurements of a single request """
+
+    def __init__(self):
+        self.start = time.time()
+        self.sections = {}
+
+    def add(self, section, elapsed):
+        self.sections[section] = self.sections.get(section, 0) + elapsed
+
+
+class Stats(object):
+    """ thread-safe aggregate of request profiles per (resource, method) """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.last_dump = time.time()
+
+    def record(self, endpoint, measurements):
+        with self._lock:
+            metrics = self.endpoints.setdefault(endpoint, {})
+            for name, value in measurements.items():
+                metrics.setdefault(name, Histogram()).add(value)
+
+    def as_dict(self):
+        with self._lock:
+            return dict(
+                ("%s %s" % endpoint, dict(
+                    (name, hist.as_dict()) for name, hist in metrics.items()
+                )) for endpoint, metrics in self.endpoints.items()
+            )
+
+    def dump_due(self, interval):
+        """ True once per interval, for periodic log dumps """
+        with self._lock:
+            now = time.time()
+            if now - self.last_dump < interval:
+                return False
+            self.last_dump = now
+            return True
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+
+
+stats = Stats()
+
+
+def get_endpoint(request):
+    """ resource name (or URL name) and HTTP method of a request """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return request.path, request.method
+
+    name = match.kwargs.get('resource_name') or match.url_name or \
+        request.path
+    return name, request.method
+
+
+class ProfilingMiddleware(object):
+    """
+    Records query count and time, time of profiled sections and response size
+    for every request. Not used unless PROFILING setting is True.
+    """
+
+    def __init__(self):
+        if not getattr(settings, 'PROFILING', False):
+            raise MiddlewareNotUsed()
+
+        self.interval = getattr(settings, 'PROFILING_LOG_INTERVAL', 300)
+
+    def process_request(self, request):
+        request._profiling = (connection.use_debug_cursor,
+                              len(connection.queries))
+        connection.use_debug_cursor = True
+        _local.profile = Profile()
+
+    def process_response(self, request, response):
+        profile = getattr(_local, 'profile', None)
+        if profile is None or not hasattr(request, '_profiling'):
+            return response
+
+        _local.profile = None
+        if getattr(response, 'streaming', False):
+            response.streaming_content = self.counted(
+                request, response.streaming_content, profile
+            )
+        else:
+            self.record(request, profile, len(response.content))
+
+        return response
+
+    def counted(self, request, content, profile):
+        """ yields streamed content, counting its size, and records the
+        request once the content is sent """
+        size = 0
+        _local.profile = profile
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            _local.profile = None
+            self.record(request, profile, size)
+
+    def record(self, request, profile, size):
+        debug_cursor, queries_before = request._profiling
+        queries = connection.queries[queries_before:]
+        connection.use_debug_cursor = debug_cursor
+
+        measurements = {
+            'total_ms': (time.time() - profile.start) * 1000,
+            'queries': len(queries),
+            'sql_ms': sum(float(q['time']) for q in queries) * 1000,
+            'size_bytes': size,
+        }
+        for section, elapsed in profile.sections.items():
+            measurements[section + '_ms'] = elapsed
+
+        stats.record(get_endpoint(request), measurements)
+
+        if stats.dump_due(self.interval):
+            logger.info(json.dumps(stats.as_dict()))
+
+
+def report(request):
+    """ aggregated profiling histograms as JSON, for staff users only """
+    if not request.user.is_authenticated() or not request.user.is_staff:
+        return http.HttpUnauthorized("Profiling report is for staff only")
+
+    if request.method == 'DELETE':
+        stats.reset()
+
+    return HttpResponse(json.dumps(stats.as_dict()),
+                        content_type='application/json')
@@ -72,6 +72,11 @@ urlpatterns = patterns('',
     # REST API -----------------------------------------------------------------
 
     url(r'^api/v1/in_bulk/$', 'gndata_api.views.in_bulk', name="in_bulk"),
+    url(r'^api/v1/changes/$', 'gndata_api.views.changes', name="changes"),
+    url(r'^api/v1/freshness/$', 'gndata_api.views.freshness',
+        name="freshness"),
+    url(r'^api/v1/profiling/$', 'gndata_api.profiling.report',
+        name="profiling"),
     url(r'^api/v1/', include(v1_user_api.urls)),
     url(r'^api/v1/', include(v1_metadata_api.urls)),
     url(r'^api/v1/', include(v1_ephys_api.urls)),
@@ -3,10 +3,11 @@ from django.contrib.auth.models import User
 import os
 import urlparse
 import string
-import random
 
 from django.core.management.color import no_style
-from django.db import connection
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from gndata_api import settings
 
 # this is base32hex alphabet, used to create unique IDs
@@ -40,6 +41,18 @@ def split_time(**kwargs):
     return kwargs, timeflt
 
 
+def parse_time(value):
+    """ parses time given as 'YYYY-MM-DD HH:MM:SS' (or ISO format) into an
+    aware datetime. Raises ValueError if the value can not be parsed. """
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError("Invalid time: %s" % value)
+
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+    return parsed
+
+
 def pathlist(permalink):
     """ returns a list like ['metadata', 'section', 'HTOS5G16RL'] from a given
     permalink '/metadata/section/HTOS5G16RL' """
@@ -108,12 +121,84 @@ def base32int(value):
     return int(value, 32)
 
 
-def get_new_local_id():
-    """ new 10-chars base32 ID, unique between different object versions """
-    uid = random.choice(alphabet[1:])
-    for i in range(9):
-        uid += random.choice(alphabet)
-    return uid
+class LocalIdGenerator(object):
+    """
+    Generates unique, time-ordered 10-chars base32 IDs (50 bits):
+
+    - 1 bit, always set: IDs always have 10 chars, so string order = number
+      order
+    - 49 bits: number from the 'local_id_seq' database sequence
+
+    Sequence numbers grow with time and are never given twice, also to
+    parallel processes, on different hosts or after a restart, as 'nextval'
+    is not rolled back with transactions. The sequence is created by
+    'syncdb' (see 'create_sequence'), existing databases are upgraded with
+    'state_machine/sql/upgrade_local_ids.sql'.
+
+    Databases without sequences (other than PostgreSQL) use a single-row
+    'local_id_seq' table as a counter instead. The counter row stays locked
+    until the end of the transaction, so parallel writers take their numbers
+    one after another. Numbers of a rolled back transaction are given again,
+    but so are the objects using them rolled back.
+    """
+    SEQUENCE = 'local_id_seq'
+    BITS = 49
+
+    def create_sequence(self, using='default'):
+        """ creates the sequence (or counter table) if it does not exist yet """
+        conn = connections[using]
+        cursor = conn.cursor()
+        if conn.vendor == 'postgresql':
+            cursor.execute("SELECT 1 FROM pg_class WHERE relkind = 'S' AND "
+                           "relname = %s", [self.SEQUENCE])
+            if cursor.fetchone() is None:
+                cursor.execute("CREATE SEQUENCE %s" % self.SEQUENCE)
+            return
+
+        table = conn.ops.quote_name(self.SEQUENCE)
+        if self.SEQUENCE not in conn.introspection.table_names(cursor):
+            cursor.execute("CREATE TABLE %s (value bigint NOT NULL)" % table)
+            cursor.execute("INSERT INTO %s (value) VALUES (0)" % table)
+
+    def numbers(self, count, using='default'):
+        """ list of 'count' new numbers, in ascending order """
+        conn = connections[using]
+        if conn.vendor != 'postgresql':
+            return self.counter_numbers(count, using)
+
+        cursor = conn.cursor()
+        cursor.execute("SELECT nextval(%s) FROM generate_series(1, %s)",
+                       [self.SEQUENCE, count])
+        return sorted(row[0] for row in cursor.fetchall())
+
+    def counter_numbers(self, count, using='default'):
+        """ list of 'count' new numbers from the counter table """
+        conn = connections[using]
+        table = conn.ops.quote_name(self.SEQUENCE)
+        with transaction.atomic(using=using):
+            cursor = conn.cursor()
+            cursor.execute("UPDATE %s SET value = value + %%s" % table, [count])
+            cursor.execute("SELECT value FROM %s" % table)
+            last = cursor.fetchone()[0]
+        return range(last - count + 1, last + 1)
+
+    def generate(self, count, using='default'):
+        """ list of 'count' new IDs """
+        flag = 1 << self.BITS
+        return [base32str(flag | x) for x in self.numbers(count, using)]
+
+
+local_ids = LocalIdGenerator()
+
+
+def get_new_local_ids(count, using='default'):
+    """ list of new 10-chars base32 IDs, unique between different objects """
+    return local_ids.generate(count, using)
+
+
+def get_new_local_id(using='default'):
+    """ new 10-chars base32 ID, unique between different objects """
+    return local_ids.generate(1, using)[0]
 
 
 #===============================================================================
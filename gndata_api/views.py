@@ -1,3 +1,4 @@
+from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.core.files.uploadhandler import MemoryFileUploadHandler
 from django.views.decorators.csrf import csrf_exempt
@@ -5,49 +6,99 @@ from django.shortcuts import render_to_response
 from django.http import HttpResponseBadRequest
 from django.template import RequestContext
 from django.utils import six
-from django.db import transaction
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.query import QuerySet
 from tastypie import http
+from tastypie.exceptions import ApiFieldError, ImmediateHttpResponse
 
 from gndata_api.urls import METADATA_RESOURCES, EPHYS_RESOURCES
 from gndata_api.paginator import ListPaginator
+from gndata_api.utils import parse_time
+from rest.resource import RelatedObjects
+from ephys.storage import dataset_checksum
 
 import gndata_api.settings as settings
 import tempfile as tmp
 import simplejson as json
+from collections import Counter
 import uuid
 import h5py
 import os
 
 RESOURCES = dict(METADATA_RESOURCES.items() + EPHYS_RESOURCES.items())
-RESOURCE_SCHEMAS = dict(
-    (name, resource.build_schema()) for name, resource in RESOURCES.items()
-)
+
+# number of object IDs checked with one query, below the limit of query
+# parameters in SQLite (999)
+FRESHNESS_CHUNK_SIZE = 900
 
 # helper functions -------------------------------------------------------------
 
 
 def get_simple_field_names(model_name):
-    schema = RESOURCE_SCHEMAS[model_name]
-    fields = schema['fields']
-
-    normal = lambda x: x['type'] != 'related'
-    return [k for k, v in fields.items() if normal(v)]
+    return RESOURCES[model_name].field_names['simple']
 
 
 def get_fk_field_names(model_name):
-    schema = RESOURCE_SCHEMAS[model_name]
-    fields = schema['fields']
-
-    fk = lambda x: x['type'] == 'related' and x['related_type'] == 'to_one'
-    return [k for k, v in fields.items() if fk(v)]
+    return RESOURCES[model_name].field_names['fk']
 
 
 def get_m2m_field_names(model_name):
-    schema = RESOURCE_SCHEMAS[model_name]
-    fields = schema['fields']
+    return RESOURCES[model_name].field_names['m2m']
+
+
+def parse_cursor(value):
+    """ position (time, type, ID) in the changes feed from a cursor like
+    '<ISO time>|<type>|<ID>', or (time, None, None) for a plain timestamp """
+    bits = value.split('|')
+    if len(bits) == 3:
+        return parse_time(bits[0]), bits[1], bits[2]
+    return parse_time(value), None, None
+
+
+def get_changes(request, model_name, cursor, limit):
+    """ up to 'limit' changes of objects of a given type, available to the
+    request user, after the cursor position, ordered by time and ID, as
+    (time, type, ID, guid, deleted). Deletions are found as the last closed
+    versions of objects without a current version. """
+    since, after_type, after_id = cursor
 
-    to_many = lambda x: x['type'] == 'related' and x['related_type'] == 'to_many'
-    return [k for k, v in fields.items() if to_many(v)]
+    def after(field):
+        if after_type is None or model_name < after_type:
+            return Q(**{field + '__gt': since})
+        if model_name == after_type:
+            return Q(**{field + '__gt': since}) | \
+                Q(**{field: since, 'local_id__gt': after_id})
+        return Q(**{field + '__gte': since})
+
+    res = RESOURCES[model_name]
+    bundle = res.build_bundle(request=request)
+    model = res._meta.object_class
+    versions = QuerySet(model)  # sees all versions
+    current = versions.filter(ends_at__isnull=True)
+
+    qn = connection.ops.quote_name
+    last_closed = "NOT EXISTS (SELECT 1 FROM %(table)s AS later WHERE " \
+        "later.%(id)s = %(table)s.%(id)s AND later.%(ends)s > %(table)s.%(ends)s)" \
+        % {'table': qn(model._meta.db_table), 'id': qn('local_id'),
+           'ends': qn('ends_at')}
+
+    upserts = res.authorized_read_list(current, bundle).filter(
+        after('starts_at')
+    ).order_by('starts_at', 'local_id').values_list(
+        'starts_at', 'local_id', 'guid'
+    )[:limit]
+
+    deletes = res.authorized_read_list(versions, bundle).filter(
+        after('ends_at')
+    ).exclude(
+        local_id__in=current.values('local_id')
+    ).extra(where=[last_closed]).order_by('ends_at', 'local_id').values_list(
+        'ends_at', 'local_id', 'guid'
+    )[:limit]
+
+    return [(t, model_name, pk, guid, False) for t, pk, guid in upserts] + \
+        [(t, model_name, pk, guid, True) for t, pk, guid in deletes]
 
 
 # views ------------------------------------------------------------------------
@@ -70,8 +121,10 @@ def list_view(request, resource_type):
 
     lp = ListPaginator(sorted_objects, request.get_full_path(), offset, limit)
 
-    can_be_rendered = lambda x: x not in ['local_id', 'guid', 'resource_uri']
-    fields = filter(can_be_rendered, get_simple_field_names(resource_type))
+    simple = get_simple_field_names(resource_type)
+    can_be_rendered = lambda x: x in simple and \
+        x not in ['local_id', 'guid', 'resource_uri']
+    fields = filter(can_be_rendered, res.fields.keys())
 
     content = {
         'resource_type': resource_type,
@@ -185,11 +238,10 @@ def in_bulk(request):
     todo = []  # array of ids to process as an ordered sequence
     ids_map = {}  # map of the temporary IDs to the new IDs of created objects
     saved = []  # collector of processed objects
+    objects = {}  # parsed JSON of every object by location
+    depends_on = {}  # IDs of parent and m2m related objects by location
 
-    # this loop sorts object tree as "breadth-first" sequence based on their
-    # parent <- children relations
-    while incoming_locations:
-        location = incoming_locations[0]
+    for location in incoming_locations:
         json_obj = json.loads(f[location]['json'].value)
 
         model_name = location.split('-')[4]  # FIXME make more robust
@@ -197,80 +249,124 @@ def in_bulk(request):
         m2m_names = get_m2m_field_names(model_name)
 
         parents = [v for k, v in json_obj.items() if k in fk_names]
-        m2ms = [v for k, v in json_obj.items() if k in m2m_names]
-        m2m_flat = [v for m2m in m2ms for v in m2m]
+        m2ms = [v or [] for k, v in json_obj.items() if k in m2m_names]
 
-        match = lambda x: len([k for k in incoming_locations if k.split('-')[5] == x]) > 0
+        objects[location] = json_obj
+        depends_on[location] = set(parents + [v for m2m in m2ms for v in m2m])
 
-        if len([x for x in parents + m2m_flat if match(x)]) == 0:
-            todo.append(location)
-            incoming_locations.remove(location)
+    # this loop sorts object tree as "breadth-first" sequence based on their
+    # parent <- children relations
+    incoming_ids = Counter(l.split('-')[5] for l in incoming_locations)
+    while incoming_locations:
+        location = incoming_locations[0]
+
+        if not any(incoming_ids[x] for x in depends_on[location]):
+            todo.append(incoming_locations.pop(0))
+            incoming_ids[location.split('-')[5]] -= 1
         else:
             incoming_locations.append(incoming_locations.pop(0))
 
-    # this loop saves actual objects
-    while todo:
-        location = todo[0]
-        group = f[location]
-        json_obj = json.loads(group['json'].value)
-
-        _, _, _, _, model_name, obj_id, _ = location.split('-')  # FIXME robust?
-        fk_names = get_fk_field_names(model_name)
-        m2m_names = get_m2m_field_names(model_name)
-
-        # update parent IDs to the IDs of created objects
-        to_update = [k for k in json_obj.keys() if k in fk_names]
-        for name in to_update:
-            value = json_obj[name]
-            if value is not None and value.startswith('TEMP'):
-                json_obj[name] = ids_map[value]
-
-        # update m2m IDs to the IDs of created objects
-        to_update = [k for k in json_obj.keys() if k in m2m_names]
-        for name in to_update:
-            m2m_list = json_obj[name]
-            if m2m_list is not None:
-                json_obj[name] = [ids_map[x] if x.startswith('TEMP') else x for x in m2m_list]
-
-        res = RESOURCES[model_name]
-        if obj_id.startswith('TEMP'):  # create new object
-            bundle = res.build_bundle(request=request, data=json_obj)
-            res_bundle = res.obj_create(bundle)
-
-            ids_map[obj_id] = res_bundle.obj.local_id
-
-        else:  # update object
-            request_bundle = res.build_bundle(request=request)
-            obj = res.obj_get(request_bundle, pk=obj_id)
-
-            bundle = res.build_bundle(obj=obj, data=json_obj, request=request)
-            res_bundle = res.obj_update(bundle)
-
-        # update data fields. no need to check permissions as they must be
-        # already validated with the object update
-        data_fields = [k for k in group.keys() if not k == 'json']
-        temp_paths = []  # collector of temp data files
-        for name in data_fields:
-
-            filename = uuid.uuid1().hex + ".h5"
-            path = os.path.join(tmp.gettempdir(), filename)
-
-            with h5py.File(path, 'w') as temp_f:
-                temp_f.create_dataset(
-                    name=res_bundle.obj.local_id, data=group[name].value
-                )
-
-            setattr(res_bundle.obj, name, File(open(path), name=filename))
-            temp_paths.append(path)
-
-        if len(data_fields) > 0:  # clean temp files
-            res_bundle.obj.save()
-            for path in temp_paths:
+    # existing related objects are resolved for the whole batch at once,
+    # created and updated objects are added as they are saved
+    is_known = lambda v: not (isinstance(v, basestring) and
+                              v.startswith('TEMP'))
+    related = RelatedObjects.for_request(request)
+    for location, json_obj in objects.items():
+        known = {}
+        for name, value in json_obj.items():
+            if isinstance(value, list):
+                known[name] = [x for x in value if is_known(x)]
+            elif is_known(value):
+                known[name] = value
+        related.collect(RESOURCES[location.split('-')[4]], known)
+
+    # this loop saves actual objects. temp data files are removed also if
+    # saving fails, files already written to the storage are cleaned up by the
+    # 'collect_files' command
+    temp_paths = []  # collector of temp data files
+    try:
+        related.fetch()
+
+        with transaction.atomic():  # invalid objects roll back the batch
+            while todo:
+                location = todo[0]
+                group = f[location]
+                json_obj = objects[location]
+
+                _, _, _, _, model_name, obj_id, _ = location.split('-')  # FIXME robust?
+                fk_names = get_fk_field_names(model_name)
+                m2m_names = get_m2m_field_names(model_name)
+
+                # update parent IDs to the IDs of created objects
+                to_update = [k for k in json_obj.keys() if k in fk_names]
+                for name in to_update:
+                    value = json_obj[name]
+                    if value is not None and value.startswith('TEMP'):
+                        json_obj[name] = ids_map[value]
+
+                # update m2m IDs to the IDs of created objects
+                to_update = [k for k in json_obj.keys() if k in m2m_names]
+                for name in to_update:
+                    m2m_list = json_obj[name]
+                    if m2m_list is not None:
+                        json_obj[name] = [ids_map[x] if x.startswith('TEMP') else x for x in m2m_list]
+
+                res = RESOURCES[model_name]
+                if obj_id.startswith('TEMP'):  # create new object
+                    bundle = res.build_bundle(request=request, data=json_obj)
+                    res_bundle = res.obj_create(bundle)
+
+                    ids_map[obj_id] = res_bundle.obj.local_id
+
+                else:  # update object
+                    request_bundle = res.build_bundle(request=request)
+                    obj = res.obj_get(request_bundle, pk=obj_id)
+
+                    bundle = res.build_bundle(obj=obj, data=json_obj, request=request)
+                    res_bundle = res.obj_update(bundle)
+
+                # update data fields. no need to check permissions as they must be
+                # already validated with the object update
+                data_fields = [k for k in group.keys() if not k == 'json']
+                for name in data_fields:
+
+                    # content-addressed storage: skip writing arrays already stored
+                    storage = res_bundle.obj._meta.get_field(name).storage
+                    if hasattr(storage, 'content_name'):
+                        stored = storage.content_name(dataset_checksum(group[name]))
+                        if storage.touch(stored):
+                            setattr(res_bundle.obj, name, stored)
+                            continue
+
+                    filename = uuid.uuid1().hex + ".h5"
+                    path = os.path.join(tmp.gettempdir(), filename)
+
+                    with h5py.File(path, 'w') as temp_f:
+                        temp_f.create_dataset(
+                            name=res_bundle.obj.local_id, data=group[name].value
+                        )
+
+                    setattr(res_bundle.obj, name, File(open(path), name=filename))
+                    temp_paths.append(path)
+
+                if len(data_fields) > 0:
+                    res_bundle.obj.save()
+
+                related.add(res_bundle.obj)
+                saved.append((model_name, res_bundle.obj.local_id))
+                todo.remove(location)
+    except ValidationError, e:
+        return http.HttpBadRequest("; ".join(e.messages))
+    except ApiFieldError, e:  # unknown related objects
+        return http.HttpBadRequest(str(e))
+    except ImmediateHttpResponse, e:  # like 401 for inaccessible objects
+        return e.response
+    finally:
+        f.close()
+        for path in temp_paths:
+            if os.path.exists(path):
                 os.remove(path)
 
-        saved.append((model_name, res_bundle.obj.local_id))
-        todo.remove(location)
-
     model_name, obj_id = saved[0]  # return top object
     res = RESOURCES[model_name]
     bundle = res.build_bundle(request=request)
@@ -280,4 +376,147 @@ def in_bulk(request):
         None, res.full_dehydrate(res_bundle), 'application/json'
     ))
 
-    return response
\ No newline at end of file
+    return response
+
+
+def changes(request):
+    """
+    Incremental changes feed for client synchronization. Returns created,
+    updated and deleted objects of all types, available to the user, since a
+    given time or cursor ('since' GET parameter), ordered by time of change,
+    up to 'limit' changes per request.
+
+    Every change is given as {type, id, guid, action, time}, with the guid of
+    the current version (of the last version for deleted objects). Clients
+    pass the 'next' cursor from the response meta as 'since' to get the
+    following changes.
+
+    :param request:     GET request with 'since' (ISO time or cursor) and an
+                        optional 'limit'
+    :return             JSON {'meta': {...}, 'selected': [changes]}
+    """
+    if not request.method == 'GET':
+        return http.HttpMethodNotAllowed()
+
+    if not request.user.is_authenticated():
+        return http.HttpUnauthorized("Must authorize to get changes")
+
+    try:
+        cursor = parse_cursor(request.GET['since'])
+        limit = int(request.GET.get('limit', settings.API_LIMIT_PER_PAGE))
+    except KeyError:
+        return http.HttpBadRequest("Parameter 'since' is required")
+    except ValueError, e:
+        return http.HttpBadRequest(str(e))
+    limit = max(1, min(limit, settings.API_LIMIT_PER_PAGE))
+
+    # one more change than needed, to know if there are more
+    found = []
+    for model_name in RESOURCES.keys():
+        found += get_changes(request, model_name, cursor, limit + 1)
+    found.sort(key=lambda x: x[:3])
+    has_more = len(found) > limit
+    found = found[:limit]
+
+    # actions: objects with versions before the cursor are updated
+    selected = []
+    for model_name in set(x[1] for x in found):
+        model = RESOURCES[model_name]._meta.object_class
+        versions = QuerySet(model)
+        of_type = [x for x in found if x[1] == model_name]
+
+        ids = [pk for t, _, pk, guid, deleted in of_type if not deleted]
+        existed = set(versions.filter(
+            local_id__in=ids, starts_at__lte=cursor[0]
+        ).values_list('local_id', flat=True)) if ids else set()
+
+        for t, _, pk, guid, deleted in of_type:
+            action = deleted and 'deleted' or \
+                (pk in existed and 'updated' or 'created')
+            selected.append((t, model_name, pk, guid, action))
+    selected.sort()
+
+    if found:
+        t, model_name, pk = found[-1][:3]
+        next_cursor = "%s|%s|%s" % (t.isoformat(), model_name, pk)
+    else:
+        next_cursor = request.GET['since']
+
+    data = {
+        'meta': {'limit': limit, 'next': next_cursor, 'has_more': has_more},
+        'selected': [{
+            'type': model_name,
+            'id': pk,
+            'guid': guid,
+            'action': action,
+            'time': t.isoformat()
+        } for t, model_name, pk, guid, action in selected]
+    }
+    return http.HttpResponse(json.dumps(data), content_type='application/json')
+
+
+@csrf_exempt
+def freshness(request):
+    """
+    Checks which of the object versions cached by a client are current, with
+    one query per object type and FRESHNESS_CHUNK_SIZE objects. Objects are
+    given as [<id>, <guid>] pairs by type. Objects not available to the user
+    are reported as deleted.
+
+    :param request:     POST request with JSON {<type>: [[<id>, <guid>], ..]}
+    :return             JSON {<type>: {'current': [<id>, ..],
+                                       'outdated': {<id>: <current guid>},
+                                       'deleted': [<id>, ..]}}
+    """
+    if not request.method == 'POST':
+        return http.HttpMethodNotAllowed()
+
+    if not request.user.is_authenticated():
+        return http.HttpUnauthorized("Must authorize to check objects")
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return http.HttpBadRequest("Content should be a JSON object")
+
+    if not isinstance(data, dict):
+        return http.HttpBadRequest("Content should be a JSON object")
+
+    unknown = [name for name in data.keys() if name not in RESOURCES]
+    if unknown:
+        return http.HttpBadRequest("Objects of type %s are not supported" %
+                                   ", ".join(unknown))
+
+    result = {}
+    for model_name, pairs in data.items():
+        try:
+            cached = dict((pk, guid) for pk, guid in pairs)
+        except (TypeError, ValueError):
+            return http.HttpBadRequest("Objects should be given as [<id>, "
+                                       "<guid>] pairs")
+
+        res = RESOURCES[model_name]
+        bundle = res.build_bundle(request=request)
+        ids = cached.keys()
+
+        # IDs are passed in chunks, as databases limit the query parameters
+        guids = {}
+        for i in range(0, len(ids), FRESHNESS_CHUNK_SIZE):
+            current = QuerySet(res._meta.object_class).filter(
+                ends_at__isnull=True,
+                local_id__in=ids[i:i + FRESHNESS_CHUNK_SIZE]
+            )
+            guids.update(res.authorized_read_list(current, bundle).values_list(
+                'local_id', 'guid'
+            ))
+
+        result[model_name] = {
+            'current': [pk for pk, guid in cached.items()
+                        if guids.get(pk) == guid],
+            'outdated': dict((pk, guids[pk]) for pk, guid in cached.items()
+                             if pk in guids and guids[pk] != guid),
+            'deleted': [pk for pk in cached.keys() if pk not in guids]
+        }
+
+    return http.HttpResponse(json.dumps(result),
+                             content_type='application/json')
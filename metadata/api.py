@@ -2,7 +2,7 @@ from tastypie.resources import ALL, ALL_WITH_RELATIONS
 from tastypie import fields
 
 from metadata.models import Document, Section, Property, Value
-from rest.resource import BaseGNodeResource, BaseMeta
+from rest.resource import BaseGNodeResource, BaseMeta, VersionedToOneField
 from permissions.resource import PermissionsResourceMixin
 
 
@@ -19,8 +19,8 @@ class DocumentResource(BaseGNodeResource, PermissionsResourceMixin):
 
 
 class SectionResource(BaseGNodeResource):
-    document = fields.ForeignKey(DocumentResource, 'document')
-    section = fields.ToOneField('self', 'section', blank=True, null=True)
+    document = VersionedToOneField(DocumentResource, 'document')
+    section = VersionedToOneField('self', 'section', blank=True, null=True)
     section_set = fields.ToManyField(
         'metadata.api.SectionResource', 'section_set', related_name='section',
         full=False, blank=True, null=True
@@ -43,7 +43,7 @@ class SectionResource(BaseGNodeResource):
 
 
 class PropertyResource(BaseGNodeResource):
-    section = fields.ToOneField(SectionResource, 'section')
+    section = VersionedToOneField(SectionResource, 'section')
     value_set = fields.ToManyField(
         'metadata.api.ValueResource', 'value_set', related_name='property',
         full=False, blank=True, null=True
@@ -55,7 +55,7 @@ class PropertyResource(BaseGNodeResource):
 
 
 class ValueResource(BaseGNodeResource):
-    property = fields.ForeignKey(PropertyResource, 'property')
+    property = VersionedToOneField(PropertyResource, 'property')
 
     class Meta(BaseMeta):
         queryset = Value.objects.all()
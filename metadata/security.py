@@ -1,4 +1,5 @@
 from permissions.models import BasePermissionsMixin, SingleAccess
+from gndata_api.profiling import profiled
 
 
 class DocumentBasedPermissionsMixin(BasePermissionsMixin):
@@ -21,6 +22,7 @@ class DocumentBasedPermissionsMixin(BasePermissionsMixin):
             or self.owner == user
 
     @classmethod
+    @profiled('security_filter')
     def security_filter(cls, queryset, user, update=False):
         if not issubclass(queryset.model, cls):
             raise ReferenceError("Cannot filter queryset of an alien type.")
@@ -3,13 +3,17 @@
 
 ALTER TABLE metadata_value DROP CONSTRAINT metadata_value_pkey CASCADE;
 ALTER TABLE metadata_value ADD PRIMARY KEY (guid);
+CREATE INDEX metadata_value_history ON metadata_value (local_id, starts_at);
 
 ALTER TABLE metadata_property DROP CONSTRAINT metadata_property_pkey CASCADE;
 ALTER TABLE metadata_property ADD PRIMARY KEY (guid);
+CREATE INDEX metadata_property_history ON metadata_property (local_id, starts_at);
 
 ALTER TABLE metadata_section DROP CONSTRAINT metadata_section_pkey CASCADE;
 ALTER TABLE metadata_section ADD PRIMARY KEY (guid);
+CREATE INDEX metadata_section_history ON metadata_section (local_id, starts_at);
 
 ALTER TABLE metadata_document DROP CONSTRAINT metadata_document_pkey CASCADE;
 ALTER TABLE metadata_document ADD PRIMARY KEY (guid);
+CREATE INDEX metadata_document_history ON metadata_document (local_id, starts_at);
 
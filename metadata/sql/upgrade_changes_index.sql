@@ -0,0 +1,18 @@
+-- Upgrade of existing databases to the starts_at and ends_at indexes of
+-- versioned tables, used by the changes feed. Not run by syncdb, new
+-- databases get these indexes with their tables. Run once:
+--
+--   psql <database> -f metadata/sql/upgrade_changes_index.sql
+
+BEGIN;
+
+CREATE INDEX metadata_value_starts_at ON metadata_value (starts_at);
+CREATE INDEX metadata_value_ends_at ON metadata_value (ends_at);
+CREATE INDEX metadata_property_starts_at ON metadata_property (starts_at);
+CREATE INDEX metadata_property_ends_at ON metadata_property (ends_at);
+CREATE INDEX metadata_section_starts_at ON metadata_section (starts_at);
+CREATE INDEX metadata_section_ends_at ON metadata_section (ends_at);
+CREATE INDEX metadata_document_starts_at ON metadata_document (starts_at);
+CREATE INDEX metadata_document_ends_at ON metadata_document (ends_at);
+
+COMMIT;
@@ -0,0 +1,14 @@
+-- Upgrade of existing databases to the (local_id, starts_at) index used by
+-- the version history and diff requests. Not run by syncdb, new databases
+-- get the index with the custom SQL in metadata/sql/section.sql. Run once:
+--
+--   psql <database> -f metadata/sql/upgrade_history_index.sql
+
+BEGIN;
+
+CREATE INDEX metadata_value_history ON metadata_value (local_id, starts_at);
+CREATE INDEX metadata_property_history ON metadata_property (local_id, starts_at);
+CREATE INDEX metadata_section_history ON metadata_section (local_id, starts_at);
+CREATE INDEX metadata_document_history ON metadata_document (local_id, starts_at);
+
+COMMIT;
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from gndata_api.utils import *
+from gndata_api.profiling import profiled
 
 
 class BasePermissionsMixin(models.Model):
@@ -107,6 +108,7 @@ class BasePermissionsMixin(models.Model):
                 self.get_access_for_user(user).access_level == 2)
 
     @classmethod
+    @profiled('security_filter')
     def security_filter(cls, queryset, user, update=False):
         """ filters given queryset for objects available for a given user. Does
         not evaluate QuerySet, does not hit the database. """
@@ -90,7 +90,8 @@ class BaseService(object):
         test = lambda x: not x.primary_key and x.editable
         fields = [f for f in obj._meta.local_fields if test(f)]
         params = dict([(f.attname, getattr(obj, f.attname)) for f in fields])
-        return qs.update(**params)[0]
+        qs.update(**params)
+        return self.model.objects.get(pk=pk)
 
     def delete(self, user, pk):
         """
@@ -2,17 +2,30 @@ import os
 import urlparse
 
 from django.conf.urls import url
+from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
-from django.http import HttpResponse
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.core.urlresolvers import NoReverseMatch
+from django.http import HttpResponse, HttpResponseBase
+from django.http import StreamingHttpResponse
+from django.db import models, connections, transaction
+from django.db.models import signals
 from django.db.models.fields import FieldDoesNotExist
 from tastypie import fields, http
+from tastypie.bundle import Bundle
+from tastypie.exceptions import ImmediateHttpResponse, InvalidFilterError
 from tastypie.utils import trailing_slash
+from tastypie.utils.mime import build_content_type
 from tastypie.constants import ALL, ALL_WITH_RELATIONS
-from tastypie.resources import ModelResource
+from tastypie.resources import ModelResource, convert_post_to_put
 from account.api import UserResource
+from gndata_api import settings
+from gndata_api.profiling import profiled
+from gndata_api.utils import parse_time
+from state_machine.versioning.models import version_diff
 from permissions.authorization import BaseAuthorization
 from permissions.authorization import SessionAuthenticationNoSCRF
+from rest.serializers import GNodeSerializer, BINARY_FORMATS, get_base_url
 
 
 class BaseMeta(object):
@@ -24,6 +37,7 @@ class BaseMeta(object):
     authorization = BaseAuthorization()
     collection_name = 'selected'
     always_return_data = True
+    serializer = GNodeSerializer()
     filtering = {
         'id': ALL,
         'date_created': ALL,
@@ -49,45 +63,298 @@ class BaseMeta(object):
         return filters
 
 
+class OwnerField(fields.ForeignKey):
+    """ owner of an object as the URI of the user, built from the 'owner_id'
+    value. URIs are cached per process by user ID and dropped when a user is
+    saved or deleted, so objects in lists do not load their owners. """
+
+    _uris = {}
+
+    def dehydrate(self, bundle, for_list=True):
+        if self.should_full_dehydrate(bundle, for_list=for_list):
+            return super(OwnerField, self).dehydrate(bundle, for_list)
+
+        user_id = getattr(bundle.obj, '%s_id' % self.attribute)
+        if user_id is None:
+            return super(OwnerField, self).dehydrate(bundle, for_list)
+
+        uri = self._uris.get(user_id)
+        if uri is None:
+            user = self.to_class._meta.queryset.model.objects.get(pk=user_id)
+            resource = self.get_related_resource(user)
+            uri = self._uris[user_id] = resource.get_resource_uri(user)
+        return uri
+
+    @classmethod
+    def invalidate(cls, sender, instance, **kwargs):
+        cls._uris.pop(instance.pk, None)
+
+
+signals.post_save.connect(OwnerField.invalidate, sender=User,
+                          dispatch_uid='owner_uri_save')
+signals.post_delete.connect(OwnerField.invalidate, sender=User,
+                            dispatch_uid='owner_uri_delete')
+
+
+class VersionedToOneField(fields.ToOneField):
+    """ related object as URI built from the stored FK value ('<name>_id'),
+    without loading the object. Versioned FKs point to the 'local_id' of the
+    related object, which is the same in all its versions, so the URI is valid
+    for objects fetched at any 'at_time'. Full dehydration loads the related
+    object (at the time of the object) as usual. """
+
+    _uri_resource = None
+
+    def dehydrate(self, bundle, for_list=True):
+        if self.should_full_dehydrate(bundle, for_list=for_list) or \
+                not isinstance(self.attribute, basestring) or \
+                '__' in self.attribute:
+            return super(VersionedToOneField, self).dehydrate(bundle, for_list)
+
+        field = bundle.obj._meta.get_field(self.attribute)
+        related_id = getattr(bundle.obj, field.attname)
+        if related_id is None:
+            if self.null:
+                return None
+            return super(VersionedToOneField, self).dehydrate(bundle, for_list)
+
+        # resources are expensive to build, one is kept per field
+        if self._uri_resource is None:
+            self._uri_resource = self.get_related_resource(None)
+        resource = self._uri_resource
+
+        kwargs = resource.resource_uri_kwargs()
+        kwargs[resource._meta.detail_uri_name] = related_id
+        try:
+            return resource._build_reverse_url(
+                'api_dispatch_detail', kwargs=kwargs
+            )
+        except NoReverseMatch:
+            return ''
+
+
+class RelatedObjects(object):
+    """ related objects for hydration, resolved in bulk. IDs of related objects
+    are collected from the data of one or many objects (see 'collect') and
+    fetched with one query per model, filtered by the read permissions of the
+    request user. Kept on the request, so every object is fetched once per
+    request. """
+
+    def __init__(self, request):
+        self.request = request
+        self.pending = {}  # model: (resource, {ID: given value})
+        self.objects = {}  # (model, ID): object
+
+    @classmethod
+    def for_request(cls, request):
+        related = getattr(request, '_related_objects', None)
+        if related is None:
+            related = request._related_objects = cls(request)
+        return related
+
+    def collect(self, resource, data):
+        """ remembers IDs of related objects given in the data of an object of
+        a given resource """
+        for name, field in resource.related_fields(data):
+            values = data[name]
+            if not isinstance(values, list):
+                values = [values]
+
+            to = field.to_class
+            model = to._meta.object_class
+            for value in values:
+                pk = resource.parse_related_id(field, value)
+                if pk is None or (model, pk) in self.objects:
+                    continue
+                pending = self.pending.setdefault(model, (to, {}))[1]
+                pending[pk] = value
+
+    def add(self, obj):
+        """ adds an object, created or updated in the request """
+        self.objects[(obj.__class__, obj.pk)] = obj
+
+    def fetch(self):
+        """ fetches all collected objects, one query per model. Raises 401 if
+        some objects are not accessible, ApiFieldError if they don't exist """
+        pending, self.pending = self.pending, {}
+
+        for model, (to, values) in pending.items():
+            resource = to()
+            bundle = resource.build_bundle(request=self.request)
+            object_list = resource.get_object_list(self.request).filter(
+                pk__in=values.keys()
+            )
+            for obj in resource.authorized_read_list(object_list, bundle):
+                self.objects[(model, obj.pk)] = obj
+
+            missing = [pk for pk in values if (model, pk) not in self.objects]
+            if not missing:
+                continue
+
+            if model.objects.filter(pk__in=missing).exists():
+                raise ImmediateHttpResponse(response=http.HttpUnauthorized(
+                    "You are not authorized to access this object"
+                ))
+            raise fields.ApiFieldError(
+                "Could not find the provided object via resource URI '%s'." %
+                values[missing[0]]
+            )
+
+    def get(self, model, pk):
+        return self.objects.get((model, pk))
+
+
 class BaseGNodeResource(ModelResource):
 
-    owner = fields.ForeignKey(UserResource, 'owner', readonly=True)
+    owner = OwnerField(UserResource, 'owner', readonly=True)
     date_created = fields.DateTimeField(attribute='date_created', readonly=True)
     guid = fields.CharField(attribute='guid', readonly=True)
     id = fields.CharField(attribute='local_id', readonly=True)
 
+    _field_names = None
+
+    @property
+    def field_names(self):
+        """ names of resource fields as {'simple': .., 'fk': .., 'm2m': ..}
+        sets, classified once per resource instead of on every lookup """
+        if self._field_names is None:
+            names = {'simple': set(), 'fk': set(), 'm2m': set()}
+            for name, field in self.fields.items():
+                if not getattr(field, 'is_related', False):
+                    names['simple'].add(name)
+                elif getattr(field, 'is_m2m', False):
+                    names['m2m'].add(name)
+                else:
+                    names['fk'].add(name)
+
+            self._field_names = dict(
+                (k, frozenset(v)) for k, v in names.items()
+            )
+        return self._field_names
+
     def determine_format(self, request):
+        """ JSON, unless a binary format (MessagePack, columnar HDF5) is asked
+        for with the 'format' parameter or the Accept header """
+        desired_format = super(BaseGNodeResource, self).determine_format(
+            request
+        )
+        if desired_format in BINARY_FORMATS:
+            return desired_format
         return 'application/json'
 
     def dehydrate(self, bundle):
         """ tastypie does not (?) support full URLs having hostname etc. This is
         a hack to make full URLs with http:// etc. """
+        base = get_base_url(bundle.request)
+
         def extend_if_url(sample):
-            if sample.startswith('/api/'):
-                return urlparse.urljoin(base, sample)
+            if isinstance(sample, basestring) and sample.startswith('/api/'):
+                return base + sample
             return sample
 
-        prefix = bundle.request.is_secure() and 'https' or 'http'
-        base = '%s://%s' % (prefix, bundle.request.get_host())
-
         fresh_bundle = super(BaseGNodeResource, self).dehydrate(bundle)
 
-        for k, v in fresh_bundle.data.copy().items():
+        data = fresh_bundle.data
+        for k, v in data.items():
             if k == 'resource_uri':  # add location
-                fresh_bundle.data['location'] = v
-
-            elif isinstance(v, basestring):
-                fresh_bundle.data[k] = extend_if_url(v)
+                data['location'] = v
+                continue
 
-            elif isinstance(v, list):
-                fresh_bundle.data[k] = [extend_if_url(x) for x in v]
+            if isinstance(v, list):
+                data[k] = [extend_if_url(x) for x in v]
+            else:
+                data[k] = extend_if_url(v)
 
         return fresh_bundle
 
+    @profiled('dehydrate')
+    def full_dehydrate(self, bundle, for_list=False):
+        return super(BaseGNodeResource, self).full_dehydrate(bundle, for_list)
+
+    @profiled('serialize')
+    def serialize(self, request, data, format, options=None):
+        return super(BaseGNodeResource, self).serialize(
+            request, data, format, options
+        )
+
+    def dispatch(self, request_type, request, **kwargs):
+        """ same as the superclass method, but passes streamed responses (see
+        'create_response') through, which are no HttpResponse instances """
+        allowed_methods = getattr(
+            self._meta, "%s_allowed_methods" % request_type, None
+        )
+        if 'HTTP_X_HTTP_METHOD_OVERRIDE' in request.META:
+            request.method = request.META['HTTP_X_HTTP_METHOD_OVERRIDE']
+
+        request_method = self.method_check(request, allowed=allowed_methods)
+        method = getattr(self, "%s_%s" % (request_method, request_type), None)
+        if method is None:
+            raise ImmediateHttpResponse(response=http.HttpNotImplemented())
+
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        request = convert_post_to_put(request)
+        response = method(request, **kwargs)
+        self.log_throttled_access(request)
+
+        if not isinstance(response, HttpResponseBase):
+            return http.HttpNoContent()
+        return response
+
+    def create_response(self, request, data, response_class=HttpResponse,
+                        **response_kwargs):
+        """ streams lists longer than STREAMING_THRESHOLD objects, encoding
+        them in chunks instead of building the whole JSON in memory """
+        objects = data.get(self._meta.collection_name) if \
+            isinstance(data, dict) else None
+        threshold = getattr(settings, 'STREAMING_THRESHOLD', 200)
+        desired_format = self.determine_format(request)
+
+        if response_class is not HttpResponse or objects is None or \
+                len(objects) <= threshold or \
+                desired_format != 'application/json' or \
+                not hasattr(self._meta.serializer, 'iter_json'):
+            return super(BaseGNodeResource, self).create_response(
+                request, data, response_class, **response_kwargs
+            )
+
+        return StreamingHttpResponse(
+            self._meta.serializer.iter_json(data),
+            content_type=build_content_type(desired_format), **response_kwargs
+        )
+
+    def related_fields(self, data):
+        """ (name, field) of writable FK and M2M fields given in the data """
+        names = self.field_names['fk'] | self.field_names['m2m']
+        for name in names.intersection(data.keys()):
+            field = self.fields[name]
+            if not field.readonly:
+                yield name, field
+
+    def parse_related_id(self, field, value):
+        """ ID of a related object given as a full URL, an API URI like
+        /api/v1/<api>/<resource>/<id>/ or just an ID. None if the value is not
+        a reference to an object of the related resource. """
+        if not isinstance(value, basestring):
+            return None
+
+        if value.lower().startswith("http"):
+            value = urlparse.urlparse(value).path
+
+        if not value.lower().startswith("/api/"):
+            return value
+
+        bits = value.strip('/').split('/')
+        if len(bits) != 5 or bits[3] != field.to_class._meta.resource_name:
+            return None
+        return bits[4]
+
     def hydrate(self, bundle):
-        """ convert given full URLs (with http:// etc.) and single IDs for
-        related FK fields into standard API form like /api/v1/<resource>/<id>/
-        """
+        """ resolves related objects, given as full URLs, API URIs like
+        /api/v1/<resource>/<id>/ or just IDs, in bulk (see 'RelatedObjects').
+        Resolved objects are given to the fields as bundles, other values as
+        standard API URIs. """
         def normalize_if_url(value):
             # check if full URL is given
             if value.lower().startswith("http"):
@@ -101,20 +368,29 @@ class BaseGNodeResource(ModelResource):
                 )
             return value
 
+        def resolve(value):
+            if not isinstance(value, basestring):
+                return value
+
+            obj = related.get(model, self.parse_related_id(field, value))
+            if obj is None:
+                return normalize_if_url(value)
+            return Bundle(obj=obj, request=bundle.request)
+
         fresh_bundle = super(BaseGNodeResource, self).hydrate(bundle)
 
-        is_related = lambda x: hasattr(x, 'is_related') and x.is_related
-        rel_fields = [(n, f) for n, f in self.fields.items() if is_related(f)]
-        for name, field in rel_fields:
-            if not name in fresh_bundle.data.keys():
-                continue
+        related = RelatedObjects.for_request(bundle.request)
+        related.collect(self, fresh_bundle.data)
+        related.fetch()
 
+        for name, field in self.related_fields(fresh_bundle.data):
+            model = field.to_class._meta.object_class
             value = fresh_bundle.data[name]
-            if isinstance(value, basestring):
-                fresh_bundle.data[name] = normalize_if_url(value)
 
-            elif isinstance(value, list):
-                fresh_bundle.data[name] = [normalize_if_url(x) for x in value]
+            if isinstance(value, list):
+                fresh_bundle.data[name] = [resolve(x) for x in value]
+            else:
+                fresh_bundle.data[name] = resolve(value)
 
         return fresh_bundle
 
@@ -129,6 +405,144 @@ class BaseGNodeResource(ModelResource):
         for RCG <-> RC and others, if any """
         pass
 
+    def prepend_urls(self):
+        object_url = r"^(?P<resource_name>%s)/(?P<pk>\w[\w-]*)/%s%s$"
+        name = self._meta.resource_name
+
+        return [
+            url(
+                r"^(?P<resource_name>%s)/export%s$" % (name, trailing_slash()),
+                self.wrap_view('get_export'),
+                name="api_%s_export" % name
+            ),
+            url(
+                object_url % (name, 'history', trailing_slash()),
+                self.wrap_view('get_history'),
+                name="api_%s_history" % name
+            ),
+            url(
+                object_url % (name, 'diff', trailing_slash()),
+                self.wrap_view('get_diff'),
+                name="api_%s_diff" % name
+            )
+        ] + super(BaseGNodeResource, self).prepend_urls()
+
+    def get_export(self, request, **kwargs):
+        """
+        Exports all objects, matching the filters given as GET parameters, as
+        newline-delimited JSON (one object per line), without pagination. The
+        security filter and versioning are applied once, objects are fetched
+        from a server-side cursor in chunks of EXPORT_CHUNK_SIZE and streamed.
+
+        Should return a StreamingHttpResponse (200 OK).
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+        self.log_throttled_access(request)
+
+        filters = request.GET.copy()
+        filters.pop('format', None)
+        try:
+            applicable = self.build_filters(filters=filters)
+            objects = self.apply_filters(request, applicable)
+        except (InvalidFilterError, ValueError), e:
+            return http.HttpBadRequest(str(e))
+
+        bundle = self.build_bundle(request=request)
+        objects = self.authorized_read_list(objects, bundle)
+        objects = objects.order_by(self._meta.object_class._meta.pk.attname)
+        chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 1000)
+
+        def export():
+            serializer = self._meta.serializer
+            for obj in objects.iterate_chunked(chunk_size):
+                bundle = self.full_dehydrate(
+                    self.build_bundle(obj=obj, request=request), for_list=True
+                )
+                yield serializer.to_json(bundle) + "\n"
+
+        return StreamingHttpResponse(export(),
+                                     content_type='application/x-ndjson')
+
+    def get_versions(self, request, pk):
+        """ all versions of an object (oldest first), fetched with one query.
+        Access is validated against the latest version, at the time it was
+        created, so the history of deleted objects (or objects of deleted
+        blocks) is available too. """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+        self.log_throttled_access(request)
+
+        versions = list(self._meta.object_class.objects.versions(pk))
+        if not versions:
+            raise ImmediateHttpResponse(response=http.HttpNotFound())
+
+        latest = versions[-1]
+        if latest.ends_at is not None:  # related objects of that time
+            latest._at_time = latest.starts_at
+
+        bundle = self.build_bundle(obj=latest, request=request)
+        try:
+            self.authorized_read_detail(self.get_object_list(request), bundle)
+        except ObjectDoesNotExist:
+            raise ImmediateHttpResponse(response=http.HttpNotFound())
+        finally:
+            latest._at_time = None
+        return versions
+
+    def get_history(self, request, **kwargs):
+        """
+        Returns all versions of an object with changes made by every version
+        compared to the previous one.
+
+        Should return a HttpResponse (200 OK).
+        """
+        versions = self.get_versions(request, kwargs['pk'])
+
+        history = []
+        for previous, version in zip([None] + versions[:-1], versions):
+            history.append({
+                'guid': version.guid,
+                'starts_at': version.starts_at,
+                'ends_at': version.ends_at,
+                'changes': version_diff(previous, version)
+            })
+
+        return self.create_response(request, {
+            'id': kwargs['pk'],
+            self._meta.collection_name: history
+        })
+
+    def get_diff(self, request, **kwargs):
+        """
+        Returns changes of an object between two points in time, given as
+        'from' and 'to' parameters (YYYY-MM-DD HH:MM:SS). By default changes
+        are computed from the object creation to the latest version.
+
+        Should return a HttpResponse (200 OK).
+        """
+        versions = self.get_versions(request, kwargs['pk'])
+
+        try:
+            moments = [parse_time(request.GET[k]) if k in request.GET else None
+                       for k in ('from', 'to')]
+        except ValueError, e:
+            return http.HttpBadRequest(str(e))
+
+        at = lambda moment: ([v for v in versions if v.is_valid_at(moment)]
+                             or [None])[0]
+        old = versions[0] if moments[0] is None else at(moments[0])
+        new = versions[-1] if moments[1] is None else at(moments[1])
+
+        return self.create_response(request, {
+            'id': kwargs['pk'],
+            'from': old and old.guid,
+            'to': new and new.guid,
+            'changes': version_diff(old, new) if old or new else {}
+        })
+
     def get_schema(self, request, **kwargs):
         """
         Returns a serialized form of the schema of the resource.
@@ -150,12 +564,17 @@ class BaseGNodeResource(ModelResource):
 class BaseFileResourceMixin(ModelResource):
 
     def __init__(self, *args, **kwargs):
-        """ makes all file fields read-only to avoid parsing these fields on
-        create / update """
+        """ makes all file fields, and fields with metadata recorded for the
+        files ('companion_of' a file field), read-only to avoid parsing these
+        fields on create / update """
         super(BaseFileResourceMixin, self).__init__(*args, **kwargs)
         for name, field in self.file_fields.items():
             field.readonly = True
 
+        for f in self._meta.object_class._meta.fields:
+            if getattr(f, 'companion_of', None) and f.name in self.fields:
+                self.fields[f.name].readonly = True
+
     def dehydrate(self, bundle):
         """ converts output for every FileField into an URL (as defined in
         file_url_regex """
@@ -189,6 +608,15 @@ class BaseFileResourceMixin(ModelResource):
 
     # TODO implement different file response formats (HDF5, JSON, etc.)
 
+    def get_file(self, request, obj, attr_name, filepath):
+        """ response with the data file stored for a given object attribute """
+        with open(filepath, 'r') as f:
+            response = HttpResponse(f.read(), content_type='application/x-hdf')
+            response['Content-Disposition'] = "attachment; filename=%s" % \
+                                              os.path.basename(filepath)
+            response['Content-Length'] = os.path.getsize(f.name)
+            return response
+
     def process_file(self, request, **kwargs):
         """
         :param request:     incoming http request
@@ -233,12 +661,7 @@ class BaseFileResourceMixin(ModelResource):
             except ValueError:  # file is not set, empty
                 return http.HttpNoContent()
 
-            with open(filepath, 'r') as f:
-                response = HttpResponse(f.read(), content_type='application/x-hdf')
-                response['Content-Disposition'] = "attachment; filename=%s" % \
-                                                  os.path.basename(filepath)
-                response['Content-Length'] = os.path.getsize(f.name)
-                return response
+            return self.get_file(request, obj, attr_name, filepath)
 
         if not obj.is_editable(request.user):
             return http.HttpUnauthorized("No access to the update this object")
@@ -248,5 +671,209 @@ class BaseFileResourceMixin(ModelResource):
 
         # take first file in the multipart/form request
         setattr(obj, attr_name, request.FILES.values()[0])
-        obj.save()
+        try:
+            obj.save()
+        except ValidationError, e:
+            return http.HttpBadRequest("; ".join(e.messages))
         return http.HttpAccepted("File content updated successfully")
+
+
+class ColumnsResourceMixin(ModelResource):
+    """ columnar access to objects stored as one small row each (like Events):
+    all objects matching the list filters are returned as one array per field,
+    read with 'values_list' without building objects or bundles. New objects
+    can be created from columns with one bulk insert. """
+
+    columns_order_by = ('local_id',)
+
+    def prepend_urls(self):
+        name = self._meta.resource_name
+        return [
+            url(
+                r"^(?P<resource_name>%s)/columns%s$" % (name, trailing_slash()),
+                self.wrap_view('dispatch_columns'),
+                name="api_%s_columns" % name
+            )
+        ] + super(ColumnsResourceMixin, self).prepend_urls()
+
+    @property
+    def columns(self):
+        """ [(name, model attname)] of simple and FK resource fields stored in
+        the model table """
+        model_fields = dict(
+            (f.name, f) for f in self._meta.object_class._meta.local_fields
+        )
+        names = self.field_names['simple'] | self.field_names['fk']
+        return sorted(
+            (name, model_fields[self.fields[name].attribute].attname)
+            for name in names if self.fields[name].attribute in model_fields
+        )
+
+    def dispatch_columns(self, request, **kwargs):
+        method = self.method_check(request, allowed=['get', 'post'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+        self.log_throttled_access(request)
+
+        return getattr(self, '%s_columns' % method)(request, **kwargs)
+
+    def get_columns(self, request, **kwargs):
+        """
+        Returns fields of all objects, matching the filters given as GET
+        parameters, as columns {<field name>: [values]}. Related objects are
+        given as IDs. Rows are fetched with one query and collected per
+        column, JSON responses are encoded and sent in chunks.
+
+        Should return a HttpResponse (200 OK).
+        """
+        filters = request.GET.copy()
+        filters.pop('format', None)
+        try:
+            applicable = self.build_filters(filters=filters)
+            objects = self.apply_filters(request, applicable)
+        except (InvalidFilterError, ValueError), e:
+            return http.HttpBadRequest(str(e))
+
+        bundle = self.build_bundle(request=request)
+        objects = self.authorized_read_list(objects, bundle)
+        objects = objects.order_by(*self.columns_order_by)
+
+        # versioning filters are not applied to values querysets
+        objects.inject_time()
+
+        # columns like 'time__unit' can not be selected by name
+        qn = connections[objects.db].ops.quote_name
+        table = self._meta.object_class._meta.db_table
+        objects = objects.extra(select=dict(
+            (attname, "%s.%s" % (qn(table), qn(attname)))
+            for name, attname in self.columns if '__' in attname
+        ))
+
+        # rows are appended to the columns as they are fetched, so the result
+        # is held in memory only once, as columns
+        names, attnames = zip(*self.columns)
+        values = [[] for name in names]
+        appends = [column.append for column in values]
+        for row in objects.values_list(*attnames).iterator():
+            for append, value in zip(appends, row):
+                append(value)
+
+        data = dict(zip(names, values))
+        data['meta'] = {'total_count': len(values[0])}
+
+        desired_format = self.determine_format(request)
+        serializer = self._meta.serializer
+        content_type = build_content_type(desired_format)
+
+        if desired_format == 'application/x-hdf5':
+            meta = data.pop('meta')
+            return HttpResponse(serializer.columns_to_hdf5(data, {
+                'meta': meta
+            }), content_type=content_type)
+
+        if desired_format == 'application/json':
+            return StreamingHttpResponse(
+                serializer.iter_json(data), content_type=content_type
+            )
+
+        return self.create_response(request, data)
+
+    def hydrate_columns(self, values, parents):
+        """ hook to set values for all created objects, {attname: value},
+        from related objects {<field name>: object} """
+        return values
+
+    def post_columns(self, request, **kwargs):
+        """
+        Creates objects from columns {<field name>: [values]}, one object per
+        value. Fields given as single values, like related objects (IDs) or
+        units, apply to all objects and are validated only once. Objects are
+        inserted with one versioned bulk_create.
+
+        Should return a HttpResponse (201 Created) with IDs of new objects.
+        """
+        data = self.deserialize(request, request.body, format=request.META.get(
+            'CONTENT_TYPE', 'application/json'
+        ))
+        if not isinstance(data, dict):
+            return http.HttpBadRequest("Columns should be given as an object")
+
+        model = self._meta.object_class
+        writable = dict(
+            (name, model._meta.get_field(self.fields[name].attribute))
+            for name, attname in self.columns if not
+            (self.fields[name].readonly or attname == model._meta.pk.attname)
+        )
+
+        unknown = [name for name in data.keys() if name not in writable]
+        if unknown:
+            return http.HttpBadRequest("Fields can not be set: %s" %
+                                       ", ".join(unknown))
+
+        missing = [name for name, field in writable.items()
+                   if name not in data and not field.has_default()
+                   and not field.null and not field.blank]
+        if missing:
+            return http.HttpBadRequest("Fields are required: %s" %
+                                       ", ".join(missing))
+
+        lists = dict((k, v) for k, v in data.items() if isinstance(v, list))
+        if len(set(len(v) for v in lists.values())) != 1:
+            return http.HttpBadRequest("At least one column is required, all "
+                                       "columns should have the same length")
+
+        values, parents, columns = {}, {}, {}
+        try:
+            for name, value in data.items():
+                field = writable[name]
+
+                if name in self.field_names['fk']:
+                    if name in lists:
+                        raise ValidationError("Related object '%s' should be "
+                                              "given as a single ID" % name)
+                    parents[name] = self.get_column_parent(request, field,
+                                                           value)
+                    values[field.attname] = parents[name].pk
+
+                elif name in lists:
+                    columns[field.attname] = [field.clean(v, None)
+                                              for v in value]
+                else:
+                    values[field.attname] = field.clean(value, None)
+
+        except ValidationError, e:
+            return http.HttpBadRequest("; ".join(e.messages))
+
+        values = self.hydrate_columns(values, parents)
+
+        count = len(lists.values()[0])
+        objects = []
+        for i in range(count):
+            kwargs = dict(values, owner=request.user)
+            for attname, column in columns.items():
+                kwargs[attname] = column[i]
+            objects.append(model(**kwargs))
+
+        with transaction.atomic():
+            model.objects.bulk_create(objects)
+
+        return self.create_response(request, {
+            'id': [obj.local_id for obj in objects],
+            'meta': {'total_count': count}
+        }, response_class=http.HttpCreated)
+
+    def get_column_parent(self, request, field, value):
+        """ related object for an ID or URL, editable by the request user """
+        if isinstance(value, basestring) and '/' in value:
+            value = value.rstrip('/').split('/')[-1]
+
+        try:
+            parent = field.rel.to.objects.get(local_id=value)
+        except (ObjectDoesNotExist, ValueError):
+            raise ValidationError("%s %s does not exist" % (field.name, value))
+
+        if not parent.is_editable(request.user):
+            raise ImmediateHttpResponse(response=http.HttpUnauthorized(
+                "No access to create objects in %s %s" % (field.name, value)
+            ))
+        return parent
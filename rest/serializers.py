@@ -0,0 +1,213 @@
+import os
+import datetime
+import tempfile as tmp
+
+import h5py
+import numpy as np
+
+from django.core.exceptions import ImproperlyConfigured
+from tastypie.bundle import Bundle
+from tastypie.exceptions import BadRequest
+from tastypie.serializers import Serializer
+
+from gndata_api.profiling import profiled_iter
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# the fastest available JSON backend: ujson, simplejson (with C speedups) or
+# the standard library json module
+try:
+    import ujson
+
+    def dumps(data):
+        return ujson.dumps(data, sort_keys=True, ensure_ascii=False,
+                           escape_forward_slashes=False)
+
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        import json
+
+    def dumps(data):
+        return json.dumps(data, sort_keys=True, ensure_ascii=False)
+
+
+NATIVE_TYPES = (basestring, bool, int, long, float, type(None))
+NUMBER_TYPES = (int, long, float)
+BINARY_FORMATS = ('application/x-msgpack', 'application/x-hdf5')
+
+
+def get_base_url(request):
+    """ scheme and host of a request, like 'https://host:port'. Computed once
+    per request and cached on it. """
+    base = getattr(request, '_base_url', None)
+    if base is None:
+        prefix = request.is_secure() and 'https' or 'http'
+        base = '%s://%s' % (prefix, request.get_host())
+        request._base_url = base
+    return base
+
+
+def to_text(data):
+    """ converts byte strings (UTF-8) in simple data to unicode, so binary
+    formats encode them as text, not as bytes """
+    if isinstance(data, str):
+        return data.decode('utf-8')
+    if isinstance(data, dict):
+        return dict((to_text(k), to_text(v)) for k, v in data.items())
+    if isinstance(data, list):
+        return [to_text(item) for item in data]
+    return data
+
+
+def to_column(values):
+    """ converts values of a field into a numpy array: numbers (None as NaN
+    if any), booleans or strings (None as ''). Lists are stored as JSON. """
+    present = [v for v in values if v is not None]
+
+    if present and all(isinstance(v, bool) for v in values):
+        return np.array(values, dtype=bool)
+
+    if present and all(isinstance(v, NUMBER_TYPES) and
+                       not isinstance(v, bool) for v in present):
+        if len(present) < len(values) or \
+                any(isinstance(v, float) for v in present):
+            return np.array([np.nan if v is None else v for v in values],
+                            dtype=float)
+        return np.array(values, dtype=np.int64)
+
+    def as_string(value):
+        if value is None:
+            return ''
+        if isinstance(value, (list, tuple, dict)):
+            value = dumps(value)
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return str(value)
+
+    return np.array([as_string(v) for v in values], dtype=str)
+
+
+class GNodeSerializer(Serializer):
+    """
+    Serializer with a fast JSON path for dehydrated bundles. Bundles contain
+    only native values, lists and dates after dehydration, so the generic
+    'to_simple' conversion (resolving fields, related resources etc.) is
+    replaced by a type check per value, and the result is encoded with the
+    fastest available JSON backend. 'iter_json' encodes large lists in chunks
+    to stream them.
+
+    Binary formats: MessagePack (if installed) and a columnar HDF5 file with
+    one array per field, for clients loading many objects at once.
+    """
+    formats = ['json', 'msgpack', 'hdf5']
+    content_types = {
+        'json': 'application/json',
+        'msgpack': 'application/x-msgpack',
+        'hdf5': 'application/x-hdf5',
+    }
+
+    def to_simple(self, data, options=None):
+        if isinstance(data, NATIVE_TYPES):
+            return data
+        if isinstance(data, Bundle):
+            data = data.data
+        if isinstance(data, dict):
+            return dict((k, self.to_simple(v)) for k, v in data.items())
+        if isinstance(data, (list, tuple)):
+            return [self.to_simple(item) for item in data]
+        if isinstance(data, datetime.datetime):
+            return self.format_datetime(data)
+        if isinstance(data, datetime.date):
+            return self.format_date(data)
+        if isinstance(data, datetime.time):
+            return self.format_time(data)
+
+        # fields, related resources and other objects
+        return super(GNodeSerializer, self).to_simple(data, options or {})
+
+    def to_json(self, data, options=None):
+        return dumps(self.to_simple(data, options))
+
+    @profiled_iter('serialize')
+    def iter_json(self, data, chunk_size=100):
+        """ yields JSON of a dict piece by piece, lists are encoded in chunks
+        of 'chunk_size' items """
+        yield '{'
+        for i, key in enumerate(sorted(data.keys())):
+            value = data[key]
+            prefix = '%s%s: ' % (i and ', ' or '', dumps(key))
+
+            if not isinstance(value, (list, tuple)):
+                yield prefix + dumps(self.to_simple(value))
+                continue
+
+            yield prefix + '['
+            for start in range(0, len(value), chunk_size):
+                chunk = self.to_simple(value[start:start + chunk_size])
+                yield (start and ', ' or '') + dumps(chunk)[1:-1]
+            yield ']'
+        yield '}'
+
+    def to_msgpack(self, data, options=None):
+        if msgpack is None:
+            raise ImproperlyConfigured("Usage of the MessagePack format "
+                                       "requires the msgpack package.")
+        return msgpack.packb(to_text(self.to_simple(data, options)),
+                             use_bin_type=True)
+
+    def from_msgpack(self, content):
+        if msgpack is None:
+            raise ImproperlyConfigured("Usage of the MessagePack format "
+                                       "requires the msgpack package.")
+        try:
+            return msgpack.unpackb(content, raw=False)
+        except Exception:
+            raise BadRequest("Malformed MessagePack content")
+
+    def to_hdf5(self, data, options=None):
+        """ columnar HDF5: every field of the listed objects is stored as an
+        array at the root of the file, other values of the response (like
+        'meta') as root attributes. Single objects are stored as a list of one
+        object. """
+        data = self.to_simple(data, options)
+
+        rows, attrs = [data], {}
+        if isinstance(data, dict) and 'meta' in data:  # list response
+            for key, value in data.items():
+                if isinstance(value, list):
+                    rows = value
+                else:
+                    attrs[key] = value
+
+        names = set(k for row in rows for k in row.keys())
+        columns = dict(
+            (name, [row.get(name) for row in rows]) for name in names
+        )
+        return self.columns_to_hdf5(columns, attrs)
+
+    def columns_to_hdf5(self, columns, attrs=None):
+        """ HDF5 file content with one array per column (name: values) and
+        'attrs' as root attributes (nested dicts as 'key.subkey') """
+        fd, path = tmp.mkstemp(suffix='.h5')
+        os.close(fd)
+        try:
+            with h5py.File(path, 'w') as f:
+                for name in sorted(columns.keys()):
+                    f.create_dataset(name, data=to_column(columns[name]))
+
+                for key, value in (attrs or {}).items():
+                    if isinstance(value, dict):
+                        for k, v in value.items():
+                            f.attrs['%s.%s' % (key, k)] = to_column([v])[0]
+                    else:
+                        f.attrs[key] = to_column([value])[0]
+
+            with open(path, 'rb') as f:
+                return f.read()
+        finally:
+            os.remove(path)
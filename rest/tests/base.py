@@ -1,11 +1,19 @@
 import simplejson as json
+import tempfile
 import string
 import random
+import h5py
 from datetime import datetime
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from tastypie import fields
 from tastypie.test import ResourceTestCase
-from rest.resource import BaseFileResourceMixin
+from rest.resource import BaseFileResourceMixin, OwnerField
+from rest.resource import VersionedToOneField
+from rest.serializers import msgpack
+from gndata_api import settings
 
 
 class TestApi(ResourceTestCase):
@@ -35,6 +43,9 @@ class TestApi(ResourceTestCase):
         self.assets = {}
         self.url_prefix = 'api/v1'
 
+        # fixture users are reloaded for every test, without signals
+        OwnerField._uris.clear()
+
     def get_available_objs(self, resource, user):
         model = resource._meta.queryset.model
         if hasattr(model, 'security_filter'):
@@ -114,6 +125,166 @@ class TestApi(ResourceTestCase):
                 count = self.get_available_objs(resource, user).count()
                 validate_obj_count(count)
 
+    def test_list_streaming(self):
+        threshold = getattr(settings, 'STREAMING_THRESHOLD', None)
+        self.login(self.bob)
+
+        for resource in self.resources:
+            name = resource._meta.resource_name
+            api_name = resource._meta.api_name
+            url = "/%s/%s/%s/" % (self.url_prefix, api_name, name)
+
+            response = self.client.get(url)
+            expected = json.loads(response.content)
+
+            settings.STREAMING_THRESHOLD = 0
+            try:
+                response = self.client.get(url)
+            finally:
+                if threshold is None:
+                    del settings.STREAMING_THRESHOLD
+                else:
+                    settings.STREAMING_THRESHOLD = threshold
+
+            self.assertEqual(response.status_code, 200)
+            if expected[resource._meta.collection_name]:
+                self.assertTrue(response.streaming)
+                content = "".join(response.streaming_content)
+            else:
+                content = response.content
+            self.assertEqual(json.loads(content), expected)
+
+        self.logout()
+
+    def test_list_formats(self):
+        self.login(self.bob)
+
+        for resource in self.resources:
+            name = resource._meta.resource_name
+            api_name = resource._meta.api_name
+            url = "/%s/%s/%s/" % (self.url_prefix, api_name, name)
+            objects = json.loads(self.client.get(url).content)[
+                resource._meta.collection_name
+            ]
+
+            if msgpack is not None:
+                response = self.client.get(url, {'format': 'msgpack'})
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response['Content-Type'].startswith(
+                    'application/x-msgpack'
+                ))
+                data = msgpack.unpackb(response.content, raw=False)
+                self.assertEqual(data[resource._meta.collection_name], objects)
+
+                # text is packed as str, decoded as unicode (not bytes)
+                for obj in data[resource._meta.collection_name]:
+                    for key, value in obj.items():
+                        self.assertTrue(isinstance(key, unicode), key)
+                        self.assertFalse(isinstance(value, str), key)
+
+            response = self.client.get(
+                url, HTTP_ACCEPT='application/x-hdf5'
+            )
+            self.assertEqual(response.status_code, 200)
+
+            with tempfile.NamedTemporaryFile(suffix='.h5') as f:
+                f.write(response.content)
+                f.flush()
+                with h5py.File(f.name, 'r') as h5:
+                    self.assertEqual(h5.attrs['meta.total_count'],
+                                     len(objects))
+                    if objects:
+                        ids = [obj['id'] for obj in objects]
+                        self.assertEqual(list(h5['id'][:]), ids)
+
+        self.logout()
+
+    def test_export(self):
+        chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 1000)
+
+        for resource in self.resources:
+            name = resource._meta.resource_name
+            api_name = resource._meta.api_name
+            url = "/%s/%s/%s/" % (self.url_prefix, api_name, name)
+
+            for user in [self.bob, self.ed]:
+                self.login(user)
+                expected = json.loads(self.client.get(url).content)[
+                    resource._meta.collection_name
+                ]
+
+                settings.EXPORT_CHUNK_SIZE = 1
+                try:
+                    response = self.client.get(url + "export/")
+                    self.assertEqual(response.status_code, 200)
+                    self.assertTrue(response.streaming)
+                    content = "".join(response.streaming_content)
+                finally:
+                    settings.EXPORT_CHUNK_SIZE = chunk_size
+
+                self.assertTrue(response['Content-Type'].startswith(
+                    'application/x-ndjson'
+                ))
+                exported = [json.loads(x) for x in content.splitlines()]
+                by_id = lambda obj: obj['id']
+                self.assertEqual(sorted(exported, key=by_id),
+                                 sorted(expected, key=by_id))
+                self.logout()
+
+    def test_owner_uri(self):
+        self.login(self.bob)
+
+        for resource in self.resources:
+            name = resource._meta.resource_name
+            api_name = resource._meta.api_name
+            url = "/%s/%s/%s/" % (self.url_prefix, api_name, name)
+
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+
+            # only the user of the session is loaded
+            users = [q for q in context.captured_queries
+                     if 'FROM "auth_user"' in q['sql']]
+            self.assertEqual(len(users), 1)
+
+            # cached URIs are the same as built from loaded users
+            field = resource.fields['owner']
+            for obj in self.get_available_objs(resource, self.bob):
+                bundle = resource.build_bundle(obj=obj)
+                expected = fields.ForeignKey.dehydrate(field, bundle)
+                self.assertEqual(field.dehydrate(bundle), expected)
+
+        # renamed users get new URIs
+        self.bob.username = "robert"
+        self.bob.save()
+        for resource in self.resources:
+            field = resource.fields['owner']
+            obj = self.get_available_objs(resource, self.bob)[0]
+            bundle = resource.build_bundle(obj=obj)
+            expected = fields.ForeignKey.dehydrate(field, bundle)
+            self.assertEqual(field.dehydrate(bundle), expected)
+
+    def test_related_uris(self):
+        for resource in self.resources:
+            related = [f for f in resource.fields.values()
+                       if isinstance(f, VersionedToOneField)]
+            model = resource._meta.object_class
+
+            for obj in self.get_available_objs(resource, self.bob):
+                past = model.objects.filter(at_time=timezone.now()).get(
+                    pk=obj.pk
+                )
+                for field in related:
+                    for version in (obj, past):
+                        bundle = resource.build_bundle(obj=version)
+                        expected = fields.ToOneField.dehydrate(field, bundle)
+
+                        with CaptureQueriesContext(connection) as context:
+                            uri = field.dehydrate(bundle)
+                        self.assertEqual(uri, expected)
+                        self.assertEqual(len(context.captured_queries), 0)
+
     def test_get(self):
         # TODO also test back in time
         for resource in self.resources:
@@ -135,6 +306,11 @@ class TestApi(ResourceTestCase):
             response = self.client.get(url)
             self.assertEqual(response.status_code, 200, response.content)
 
+            # only related object URIs are absolute
+            data = json.loads(response.content)
+            self.assertEqual(data['resource_uri'], url)
+            self.assertEqual(data['location'], url)
+
     def test_get_data(self):
         for resource in self.resources:
             if not isinstance(resource, BaseFileResourceMixin):
@@ -180,6 +356,44 @@ class TestApi(ResourceTestCase):
 
             # TODO update data-fields
 
+    def test_create_related(self):
+        self.login(self.bob)
+
+        for resource in self.resources:
+            name = resource._meta.resource_name
+            api_name = resource._meta.api_name
+            url = "/%s/%s/%s/" % (self.url_prefix, api_name, name)
+            kwargs = {'content_type': "application/json"}
+
+            dummy = self.build_dummy_json(resource, self.bob)
+            related = [(k, field.to_class._meta.object_class)
+                       for k, field in resource.related_fields(dummy)]
+
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(url, json.dumps(dummy), **kwargs)
+            self.assertEqual(response.status_code, 201, response.content)
+
+            # related objects are fetched with one query per model, before
+            # the object is inserted (model validation may check existence)
+            queries = [q['sql'] for q in context.captured_queries
+                       if not q['sql'].startswith('SELECT (1) AS')]
+            inserted = [i for i, sql in enumerate(queries)
+                        if sql.startswith('INSERT')][0]
+            for k, model in related:
+                table = 'FROM "%s"' % model._meta.db_table
+                selects = [sql for sql in queries[:inserted]
+                           if table in sql.split(' WHERE ')[0]]
+                self.assertEqual(len(selects), 1, k)
+
+            for k, model in related:
+                wrong = dict(dummy)
+                wrong[k] = [u'NOTEXIST00'] if isinstance(dummy[k], list) \
+                    else u'NOTEXIST00'
+                response = self.client.post(url, json.dumps(wrong), **kwargs)
+                self.assertEqual(response.status_code, 400, response.content)
+
+        self.logout()
+
     def test_update(self):
         for resource in self.resources:
             name = resource._meta.resource_name
@@ -227,6 +441,59 @@ class TestApi(ResourceTestCase):
             response = self.client.delete(url)
             self.assertEqual(response.status_code, 204, response.content)
 
+    def test_history(self):
+        for resource in self.resources:
+            obj = self.get_available_objs(resource, self.bob)[0]
+            name = resource._meta.resource_name
+            api_name = resource._meta.api_name
+            url = "/%s/%s/%s/%s/" % (
+                self.url_prefix, api_name, name, obj.local_id
+            )
+
+            self.login(self.bob)
+            response = self.client.delete(url)
+            self.assertEqual(response.status_code, 204, response.content)
+
+            threshold = getattr(settings, 'STREAMING_THRESHOLD', 200)
+            settings.STREAMING_THRESHOLD = 0  # long histories are streamed
+            try:
+                response = self.client.get(url + "history/")
+            finally:
+                settings.STREAMING_THRESHOLD = threshold
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            history = json.loads("".join(response.streaming_content))
+            versions = history[resource._meta.collection_name]
+            self.assertEqual(len(versions), 1)
+            self.assertTrue(versions[0]['ends_at'] is not None)
+
+            response = self.client.get(url + "diff/")
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(json.loads(response.content)['changes'], {})
+
+            self.logout()
+            self.login(self.ed)
+
+            response = self.client.get(url + "history/")
+            self.assertEqual(response.status_code, 401, response.content)
+
+            self.logout()
+
+    def test_field_names(self):
+        for resource in self.resources:
+            fields = resource.build_schema()['fields']
+            of_type = lambda t: set(
+                k for k, v in fields.items() if v.get('related_type') == t
+            )
+
+            names = resource.field_names
+            self.assertEqual(names['fk'], of_type('to_one'))
+            self.assertEqual(names['m2m'], of_type('to_many'))
+            self.assertEqual(names['simple'], set(
+                k for k, v in fields.items() if v['type'] != 'related'
+            ))
+            self.assertTrue(resource.field_names is names)
+
     def login(self, user):
         logged = self.client.login(username=user.username, password="pass")
         self.assertTrue(logged)
@@ -0,0 +1,11 @@
+from django.db.models import signals
+
+from state_machine import models as state_machine_app
+from gndata_api.utils import local_ids
+
+
+def create_local_id_sequence(sender, db='default', **kwargs):
+    """ creates the database sequence for object IDs (see 'LocalIdGenerator') """
+    local_ids.create_sequence(db)
+
+signals.post_syncdb.connect(create_local_id_sequence, sender=state_machine_app)
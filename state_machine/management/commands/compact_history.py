@@ -0,0 +1,152 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, connection, transaction
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.utils import timezone
+
+from state_machine.versioning.models import BaseVersionedObject
+from gndata_api import settings
+from gndata_api.utils import parse_time
+
+
+class Command(BaseCommand):
+    """
+    Prunes historical object versions of all versioned models. A version is
+    removed when it was closed (ends_at) before the retention horizon and it
+    is not the version valid at one of the declared snapshot times (the
+    VERSIONING_SNAPSHOTS setting or --keep-at option), so 'at_time' requests
+    keep working for the snapshot times and for the whole retention period.
+    Current versions are never removed.
+
+    Rows are removed in batches, every batch in a separate transaction, to
+    avoid long table locks.
+    """
+    help = "Removes object versions closed before the retention horizon, " \
+           "except versions needed for snapshot times."
+    args = "[app_label.ModelName ...]"
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--days', type='int', dest='days',
+            default=getattr(settings, 'VERSIONING_RETENTION_DAYS', 365),
+            help="Retention period in days (default: VERSIONING_RETENTION_DAYS)."
+        ),
+        make_option(
+            '--keep-at', action='append', dest='keep_at', default=[],
+            help="Keep versions valid at this time (ISO format). Can be "
+                 "given multiple times, adds to VERSIONING_SNAPSHOTS."
+        ),
+        make_option(
+            '--dry-run', action='store_true', dest='dry_run', default=False,
+            help="Only report versions that would be removed."
+        ),
+        make_option(
+            '--batch-size', type='int', dest='batch_size', default=1000,
+            help="Number of rows removed per transaction."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['batch_size'] < 1:
+            raise CommandError("Options must be positive numbers")
+
+        horizon = timezone.now() - datetime.timedelta(days=options['days'])
+        snapshots = [self.parse_time(x) for x in
+                     list(getattr(settings, 'VERSIONING_SNAPSHOTS', [])) +
+                     options['keep_at']]
+
+        total_rows, total_bytes = 0, 0
+        for model in self.versioned_models(args):
+            qs = self.prunable(model, horizon, snapshots)
+
+            if options['dry_run']:
+                rows, size = qs.count(), None
+            else:
+                rows, size = self.prune(model, qs, options['batch_size'])
+
+            total_rows += rows
+            total_bytes += size or 0
+            self.stdout.write("%s: %d versions %s%s" % (
+                model._meta.object_name, rows,
+                options['dry_run'] and "to remove" or "removed",
+                size is not None and " (%d bytes)" % size or ""
+            ))
+
+        self.stdout.write("%d versions (%d bytes) closed before %s %s" % (
+            total_rows, total_bytes, horizon.isoformat(),
+            options['dry_run'] and "can be removed" or "removed"
+        ))
+
+    @staticmethod
+    def parse_time(value):
+        if isinstance(value, datetime.datetime):
+            return value
+        try:
+            return parse_time(value)
+        except ValueError, e:
+            raise CommandError(str(e))
+
+    @staticmethod
+    def versioned_models(labels):
+        """ concrete versioned models, optionally filtered by given labels """
+        is_versioned = lambda m: issubclass(m, BaseVersionedObject)
+        if not labels:
+            return filter(is_versioned, models.get_models(
+                include_auto_created=True
+            ))
+
+        versioned = filter(is_versioned, models.get_models(
+            include_auto_created=True, only_installed=False
+        ))
+        by_label = dict(("%s.%s" % (m._meta.app_label, m._meta.object_name), m)
+                        for m in versioned)
+        for label in labels:
+            if label not in by_label:
+                raise CommandError("Unknown versioned model: %s" % label)
+        return [by_label[label] for label in labels]
+
+    @staticmethod
+    def prunable(model, horizon, snapshots):
+        """ plain QuerySet (seeing all versions) of removable versions """
+        qs = QuerySet(model).filter(ends_at__lt=horizon)
+        for moment in snapshots:
+            qs = qs.exclude(Q(starts_at__lte=moment) & Q(ends_at__gt=moment))
+        return qs
+
+    def prune(self, model, qs, batch_size):
+        """ removes versions in batches. Rows are deleted with raw SQL by
+        'guid', the real primary key: the Django collector would treat
+        'local_id' as PK and cascade to all versions of related objects. """
+        table = connection.ops.quote_name(model._meta.db_table)
+        file_fields = [f for f in model._meta.local_fields
+                       if hasattr(f, 'release')]
+        count_size = connection.vendor == 'postgresql'
+
+        rows, size = 0, 0
+        while True:
+            with transaction.atomic():
+                guids = list(qs.values_list('guid', flat=True)[:batch_size])
+                if not guids:
+                    break
+
+                where = "guid IN (%s)" % ", ".join(["%s"] * len(guids))
+                cursor = connection.cursor()
+
+                if count_size:
+                    cursor.execute("SELECT COALESCE(SUM(pg_column_size(t.*)), 0) "
+                                   "FROM %s t WHERE %s" % (table, where), guids)
+                    size += int(cursor.fetchone()[0])
+
+                for field in file_fields:
+                    names = QuerySet(model).filter(guid__in=guids).values_list(
+                        field.attname, flat=True
+                    )
+                    field.release([name for name in names if name])
+
+                cursor.execute("DELETE FROM %s WHERE %s" % (table, where), guids)
+                rows += len(guids)
+
+        return rows, size if count_size else None
@@ -2,6 +2,7 @@ from django.db import models
 from django.contrib.auth.models import User
 
 from state_machine.versioning.models import BaseVersionedObject
+from gndata_api.profiling import profiled
 
 
 class BaseGnodeObject(BaseVersionedObject):
@@ -43,5 +44,6 @@ class BaseGnodeObject(BaseVersionedObject):
         return self.owner == user
 
     @classmethod
+    @profiled('security_filter')
     def security_filter(cls, queryset, user, update=False):
         return queryset.filter(owner=user.id)
\ No newline at end of file
@@ -0,0 +1,47 @@
+-- Upgrade of existing databases to object IDs taken from a sequence (see
+-- 'LocalIdGenerator' in gndata_api/utils.py). New databases get the sequence
+-- with syncdb. Run once:
+--
+--   psql <database> -f state_machine/sql/upgrade_local_ids.sql
+--
+-- New IDs are the sequence number with the highest of 50 bits set. IDs given
+-- before are random, so the sequence starts above the highest existing ID of
+-- all tables with a 'local_id' column. IDs of 10 base32hex characters sort
+-- like their numbers in the "C" collation.
+
+BEGIN;
+
+CREATE SEQUENCE local_id_seq;
+
+DO $$
+DECLARE
+    tbl record;
+    top varchar(10) := '';
+    candidate varchar(10);
+    number bigint := 0;
+    flag bigint := 1::bigint << 49;
+BEGIN
+    FOR tbl IN SELECT table_name FROM information_schema.columns
+               WHERE column_name = 'local_id'
+               AND table_schema = current_schema() LOOP
+        EXECUTE format('SELECT max(local_id COLLATE "C") FROM %I '
+                       'WHERE length(local_id) = 10', tbl.table_name)
+            INTO candidate;
+        IF candidate COLLATE "C" > top COLLATE "C" THEN
+            top := candidate;
+        END IF;
+    END LOOP;
+
+    FOR i IN 1 .. length(top) LOOP
+        number := number * 32 + position(substr(top, i, 1) IN
+                                         '0123456789ABCDEFGHIJKLMNOPQRSTUV') - 1;
+    END LOOP;
+
+    -- IDs below the flag can not be given by the sequence
+    IF number >= flag THEN
+        PERFORM setval('local_id_seq', number - flag + 1, false);
+    END IF;
+END
+$$;
+
+COMMIT;
@@ -1,11 +1,38 @@
 import time
+from StringIO import StringIO
+from contextlib import contextmanager
 
+from django.core.management import call_command
+from django.db.models import signals
+from django.db.models.query import QuerySet
 from django.utils import timezone
 from django.test import TestCase
 from django.contrib.auth.models import User
 
+from gndata_api import settings
+from gndata_api.utils import LocalIdGenerator
 from state_machine.tests.fake import *
 from state_machine.tests.assets import Assets
+from state_machine.versioning import queryset
+
+
+@contextmanager
+def frozen_now(module, now):
+    """ makes 'timezone.now()' return 'now' within the given module only, the
+    original 'timezone' is restored on exit """
+    original = module.timezone
+
+    class Frozen(object):
+        def __getattr__(self, name):
+            return getattr(original, name)
+
+    frozen = Frozen()
+    frozen.now = lambda: now
+    module.timezone = frozen
+    try:
+        yield
+    finally:
+        module.timezone = original
 
 
 class TestVersionedQuerySet(TestCase):
@@ -37,6 +64,45 @@ class TestVersionedQuerySet(TestCase):
         old_obj = self.qs.filter(at_time=obj.date_created).get(pk=obj.pk)
         self.assertEqual(old_obj.test_attr, obj.test_attr)
 
+    def test_update_many(self):
+        count = self.qs.count()
+        versions = QuerySet(FakeModel).count()
+
+        updated = self.qs.filter(test_attr__gte=0).update(test_attr=271828)
+
+        self.assertEqual(updated, count)
+        self.assertEqual(self.qs.filter(test_attr=271828).count(), count)
+        self.assertEqual(QuerySet(FakeModel).count(), versions + count)
+
+        guids = QuerySet(FakeModel).values_list('guid', flat=True)
+        self.assertEqual(len(set(guids)), versions + count)
+
+    def test_update_concurrent_close(self):
+        obj, other = self.qs.all()[:2]
+        versions = QuerySet(FakeModel).count()
+
+        # another request closed a version at the same time
+        now = timezone.now()
+        QuerySet(FakeModel).filter(
+            pk=other.pk, ends_at__isnull=True
+        ).update(ends_at=now)
+
+        with frozen_now(queryset, now):
+            self.qs.filter(pk=obj.pk).update(test_attr=271828)
+
+        self.assertFalse(self.qs.filter(pk=other.pk).exists())
+        self.assertEqual(QuerySet(FakeModel).count(), versions + 1)
+
+    def test_update_fk(self):
+        fc = self.assets.fc(1)
+        fp = self.assets.fp(2)
+
+        FakeChildModel.objects.filter(pk=fc.pk).update(test_ref=fp)
+        self.assertEqual(self.assets.fc(1).test_ref_id, fp.pk)
+
+        FakeChildModel.objects.filter(pk=fc.pk).update(test_ref_id=None)
+        self.assertEqual(self.assets.fc(1).test_ref_id, None)
+
     def test_delete(self):
         obj = self.qs.all()[0]
         count = self.qs.count()
@@ -58,6 +124,57 @@ class TestVersionedQuerySet(TestCase):
         self.qs.bulk_create(objects)
         self.assertEqual(self.qs.count(), count + 3)
 
+    def test_bulk_create_copy(self):
+        threshold = getattr(settings, 'COPY_THRESHOLD', 1000)
+        settings.COPY_THRESHOLD = 0
+        try:
+            text = u"tab\tnew\nline back\\slash \\N \u00fcml"
+            objects = [FakeModel(test_attr=attr, test_str_attr=text,
+                                 owner=self.owner) for attr in [15, 16, 17]]
+            self.qs.bulk_create(objects)
+
+            created = self.qs.filter(pk__in=[x.pk for x in objects])
+            self.assertEqual(sorted(x.test_attr for x in created), [15, 16, 17])
+            self.assertEqual(set(x.test_str_attr for x in created), set([text]))
+
+            # new versions of existing objects close the old ones
+            for obj in objects:
+                obj.test_attr += 10
+            self.qs.bulk_create(objects)
+        finally:
+            settings.COPY_THRESHOLD = threshold
+
+        created = self.qs.filter(pk__in=[x.pk for x in objects])
+        self.assertEqual(sorted(x.test_attr for x in created), [25, 26, 27])
+        self.assertEqual(
+            QuerySet(FakeModel).filter(pk__in=[x.pk for x in objects]).count(),
+            6
+        )
+
+    def test_delete_keeps_history(self):
+        obj = self.qs.all()[0]
+        self.qs.filter(pk=obj.pk).update(test_attr=271828)
+        first = FakeModel.objects.versions(obj.pk)[0]
+
+        self.qs.filter(pk=obj.pk).delete()
+
+        versions = list(FakeModel.objects.versions(obj.pk))
+        self.assertEqual(versions[0].ends_at, first.ends_at)
+        self.assertTrue(versions[1].ends_at is not None)
+
+    def test_delete_signals(self):
+        received = []
+        receiver = lambda sender, instance, **kwargs: received.append(instance)
+        signals.pre_delete.connect(receiver, sender=FakeModel)
+
+        try:
+            obj = self.qs.all()[0]
+            self.qs.filter(pk=obj.pk).delete()
+        finally:
+            signals.pre_delete.disconnect(receiver, sender=FakeModel)
+
+        self.assertEqual([x.pk for x in received], [obj.pk])
+
     def test_exists(self):
         self.qs.all().delete()
         self.assertFalse(self.qs.exists())
@@ -291,5 +408,81 @@ class TestVersionedObject(TestCase):
 
         # relations are tested in *delete methods in TestObjectRelations
 
+    def test_versions_diff(self):
+        fm = self.assets.fm(1)
+        original = fm.test_attr
+        fm.test_attr = 271828
+        fm.save()
+
+        versions = list(FakeModel.objects.versions(fm.pk))
+        self.assertEqual(len(versions), 2)
+        self.assertTrue(versions[0].starts_at < versions[1].starts_at)
+
+        changes = versions[0].diff(versions[1])
+        self.assertEqual(changes, {'test_attr': (original, 271828)})
+
     def tearDown(self):
         self.assets.flush()
+
+
+class TestCompactHistory(TestCase):
+    """
+    Tests the pruning of historical object versions.
+    """
+    fixtures = ["users.json"]
+
+    def setUp(self):
+        self.assets = Assets()
+        self.assets.fill()
+        self.qs = FakeModel.objects
+        time.sleep(1)  # needed to test versioned objects
+
+    def versions(self, obj):
+        return QuerySet(FakeModel).filter(local_id=obj.pk).count()
+
+    def test_prune(self):
+        obj = self.qs.all()[0]
+        self.qs.filter(pk=obj.pk).update(test_attr=271828)
+        self.assertEqual(self.versions(obj), 2)
+
+        call_command('compact_history', 'tests.FakeModel', days=0,
+                     stdout=StringIO())
+
+        self.assertEqual(self.versions(obj), 1)
+        self.assertEqual(self.qs.get(pk=obj.pk).test_attr, 271828)
+
+    def test_keep_snapshot(self):
+        obj = self.qs.all()[0]
+        snapshot = obj.date_created.isoformat()
+        self.qs.filter(pk=obj.pk).update(test_attr=271828)
+
+        out = StringIO()
+        call_command('compact_history', 'tests.FakeModel', days=0,
+                     keep_at=[snapshot], stdout=out)
+
+        self.assertEqual(self.versions(obj), 2)
+        old_obj = self.qs.filter(at_time=obj.date_created).get(pk=obj.pk)
+        self.assertEqual(old_obj.test_attr, obj.test_attr)
+
+
+class TestLocalIds(TestCase):
+    """
+    Tests generation of object IDs.
+    """
+
+    def test_unique_ordered(self):
+        generator = LocalIdGenerator()
+        ids = generator.generate(20000) + generator.generate(10)
+
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(sorted(ids), ids)
+        self.assertEqual(set(len(x) for x in ids), set([10]))
+
+    def test_processes(self):
+        # generators of parallel or restarted processes, in the same second
+        first = LocalIdGenerator().generate(100)
+        second = LocalIdGenerator().generate(100)
+        more = LocalIdGenerator().generate(100)
+
+        self.assertEqual(len(set(first + second + more)), 300)
+        self.assertEqual(sorted(first + second + more), first + second + more)
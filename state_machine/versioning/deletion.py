@@ -2,10 +2,127 @@ from operator import attrgetter
 
 from django.db import transaction
 from django.db.models import signals, sql
-from django.db.models.deletion import Collector
+from django.db.models.deletion import Collector, ProtectedError
+from django.db.models.deletion import CASCADE, SET_NULL, PROTECT, DO_NOTHING
 from django.utils import timezone, six
 
 
+def is_versioned(model):
+    from state_machine.versioning.models import BaseVersionedObject
+    return issubclass(model, BaseVersionedObject)
+
+
+def related_objects(model):
+    return model._meta.get_all_related_objects(
+        include_hidden=True, include_proxy_eq=True
+    )
+
+
+class VersionedCascade(object):
+    """
+    Set-based versioned deletion. Instead of collecting related instances
+    into memory (like VersionedCollector), builds a subquery for every model
+    reachable through reverse FKs and closes current versions ('ends_at') with
+    one UPDATE per subquery. Children are closed before their parents, as
+    child subqueries select by current (still open) parent versions.
+    Self-referencing FKs (like Section.section) are followed level by level
+    while a level is not empty.
+
+    pre/post_delete signals are sent per instance only for models having
+    receivers connected, these instances are loaded before closing.
+    """
+
+    supported = (CASCADE, SET_NULL, PROTECT, DO_NOTHING)
+
+    def __init__(self, using):
+        self.using = using
+        # [(queryset to close, [(queryset to update, FK field), ..]), ..] in
+        # the order of collection: parents before children
+        self.data = []
+
+    @classmethod
+    def can_cascade(cls, model):
+        """ True if all relations reachable from the model are versioned and
+        use supported on_delete handlers """
+        todo, seen = [model], set()
+        while todo:
+            current = todo.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+
+            for related in related_objects(current):
+                if not is_versioned(related.model) or \
+                        related.field.rel.on_delete not in cls.supported:
+                    return False
+                if related.field.rel.on_delete == CASCADE:
+                    todo.append(related.model)
+        return True
+
+    def collect(self, queryset, path=()):
+        """ collects subqueries for the queryset and all related objects.
+        Raises ProtectedError if protected related objects exist. """
+        model = queryset.model
+        updates = []
+        self.data.append((queryset, updates))
+
+        selected = queryset.filter()
+        selected.inject_time()
+        selected = selected.values_list('local_id', flat=True)
+
+        for related in related_objects(model):
+            field = related.field
+            sub = related.model.objects.db_manager(self.using).filter(
+                **{'%s__in' % field.name: selected}
+            )
+            on_delete = field.rel.on_delete
+
+            if on_delete == CASCADE:
+                # cycles (self-references) are followed while not empty
+                if related.model in path + (model,) and not sub.exists():
+                    continue
+                self.collect(sub, path + (model,))
+
+            elif on_delete == SET_NULL:
+                updates.append((sub, field))
+
+            elif on_delete == PROTECT and sub.exists():
+                raise ProtectedError(
+                    "Cannot delete some instances of model '%s' because they "
+                    "are referenced through a protected foreign key: '%s.%s'" %
+                    (field.rel.to.__name__, related.model.__name__, field.name),
+                    list(sub[:100])
+                )
+
+    def delete(self):
+        """ closes collected versions, children first """
+        now = timezone.now()
+
+        with transaction.commit_on_success_unless_managed(using=self.using):
+            for queryset, updates in reversed(self.data):
+                for sub, field in updates:
+                    sub.update(**{field.attname: None})
+
+                model = queryset.model
+                send = not model._meta.auto_created and (
+                    signals.pre_delete.has_listeners(model) or
+                    signals.post_delete.has_listeners(model)
+                )
+                instances = list(queryset) if send else []
+
+                for obj in instances:
+                    signals.pre_delete.send(
+                        sender=model, instance=obj, using=self.using
+                    )
+
+                queryset.close_versions(now)
+
+                for obj in instances:
+                    signals.post_delete.send(
+                        sender=model, instance=obj, using=self.using
+                    )
+
+
 class VersionedCollector(Collector):
 
     def delete(self):
@@ -1,4 +1,5 @@
 from django.db.models.fields.related import ReverseSingleRelatedObjectDescriptor
+from django.db.models.fields.related import ForeignRelatedObjectsDescriptor
 from django.db.models.fields.related import ManyRelatedObjectsDescriptor
 from django.db.models.fields.related import ReverseManyRelatedObjectsDescriptor
 from django.db import models
@@ -31,18 +32,34 @@ class VReverseSingleRelatedObjectDescriptor(ReverseSingleRelatedObjectDescriptor
         return qs
 
 
-class VManyRelatedObjectsDescriptor(ManyRelatedObjectsDescriptor):
+class VersionedRelatedManagerMixin(object):
+    """ related managers (reverse FK, direct and reverse M2M) are created for
+    every access to the descriptor. The manager of an object fetched at some
+    time in the past ('_at_time') gets this time, so related objects are
+    fetched at the same time as the original object. """
 
-    def related_manager_cls(self):
-        # one can do some monkey patching here
-        return super(VManyRelatedObjectsDescriptor, self).related_manager_cls()
+    def __get__(self, instance, instance_type=None):
+        manager = super(VersionedRelatedManagerMixin, self).__get__(
+            instance, instance_type
+        )
+        if instance is not None and getattr(instance, '_at_time', None):
+            manager._at_time = instance._at_time
+        return manager
 
 
-class VReverseManyRelatedObjectsDescriptor(ReverseManyRelatedObjectsDescriptor):
+class VForeignRelatedObjectsDescriptor(VersionedRelatedManagerMixin,
+                                       ForeignRelatedObjectsDescriptor):
+    pass
 
-    def related_manager_cls(self):
-        # one can do some monkey patching here
-        return super(VReverseManyRelatedObjectsDescriptor, self).related_manager_cls()
+
+class VManyRelatedObjectsDescriptor(VersionedRelatedManagerMixin,
+                                    ManyRelatedObjectsDescriptor):
+    pass
+
+
+class VReverseManyRelatedObjectsDescriptor(VersionedRelatedManagerMixin,
+                                           ReverseManyRelatedObjectsDescriptor):
+    pass
 
 #===============================================================================
 # Field subclasses for VERSIONED relationships
@@ -59,9 +76,29 @@ class VersionedForeignKey(models.ForeignKey):
         super(VersionedForeignKey, self).contribute_to_class(cls, name)
         setattr(cls, self.name, VReverseSingleRelatedObjectDescriptor(self))
 
+    def contribute_to_related_class(self, cls, related):
+        super(VersionedForeignKey, self).contribute_to_related_class(
+            cls, related
+        )
+        if not self.rel.is_hidden() and not related.model._meta.swapped:
+            setattr(cls, related.get_accessor_name(),
+                    VForeignRelatedObjectsDescriptor(related))
+
 
 class VersionedManyToManyField(models.ManyToManyField):
 
     def __init__(self, *args, **kwargs):
         super(VersionedManyToManyField, self).__init__(*args, **kwargs)
-        self.db_constraint = False
\ No newline at end of file
+        self.db_constraint = False
+
+    def contribute_to_class(self, cls, name):
+        super(VersionedManyToManyField, self).contribute_to_class(cls, name)
+        setattr(cls, self.name, VReverseManyRelatedObjectsDescriptor(self))
+
+    def contribute_to_related_class(self, cls, related):
+        super(VersionedManyToManyField, self).contribute_to_related_class(
+            cls, related
+        )
+        if not self.rel.is_hidden() and not related.model._meta.swapped:
+            setattr(cls, related.get_accessor_name(),
+                    VManyRelatedObjectsDescriptor(related))
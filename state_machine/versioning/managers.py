@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.query import QuerySet
 
 from queryset import VersionedQuerySet
 from gndata_api.utils import *
@@ -26,6 +27,13 @@ class VersionManager(models.Manager):
         kwargs, timeflt = split_time(**kwargs)
         return self.get_queryset(**timeflt).filter(**kwargs)
 
+    def versions(self, pk):
+        """ all versions of an object with a given local_id, oldest first. Uses
+        a plain QuerySet as a versioned one sees only one version at a time.
+        Served by the (local_id, starts_at) index. """
+        qs = QuerySet(self.model, using=self._db)
+        return qs.filter(local_id=pk).order_by('starts_at')
+
     def proxy_time(self, proxy_to, **timeflt):
         if timeflt.has_key('at_time'):
             proxy_to._at_time = timeflt['at_time']
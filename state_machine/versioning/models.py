@@ -1,7 +1,7 @@
 from django.db import models
+from django.db.models.fields.files import FieldFile
 from django.utils import timezone
 
-from state_machine.versioning.managers import VersionManager
 from state_machine.versioning.managers import VersionedObjectManager
 from state_machine.versioning.managers import VersionedM2MManager
 
@@ -11,6 +11,9 @@ from gndata_api.utils import base32str
 # Base models for a simple Versioned Object, M2M relations
 #===============================================================================
 
+# attributes which always differ between object versions
+VERSION_FIELDS = ('guid', 'local_id', 'starts_at', 'ends_at')
+
 
 class BaseVersionedObject(models.Model):
     """
@@ -34,30 +37,17 @@ class BaseVersionedObject(models.Model):
     #local_id = models.BigIntegerField('LID', primary_key=True, editable=False)
     local_id = models.CharField(max_length=10, primary_key=True, editable=False)
     date_created = models.DateTimeField(editable=False)
-    starts_at = models.DateTimeField(serialize=False, default=timezone.now, editable=False)
-    ends_at = models.DateTimeField(serialize=False, blank=True, null=True, editable=False)
+    # indexed for the changes feed
+    starts_at = models.DateTimeField(serialize=False, default=timezone.now, editable=False, db_index=True)
+    ends_at = models.DateTimeField(serialize=False, blank=True, null=True, editable=False, db_index=True)
     objects = VersionedObjectManager()
-    _at_time = None  # indicates an older version for object instance
+    # indicates an older version for object instance, proxied to related
+    # managers by the versioned relation descriptors
+    _at_time = None
 
     class Meta:
         abstract = True
 
-    def __getattribute__(self, name):
-        """ wrap getting object attributes to catch calls to related managers,
-        which require '_at_time' parameter to retrieve related objects at time,
-        equal to the original object.
-
-        Direct FK, direct M2M or reverse M2M related manager is requested. By
-        adding '_at_time' attribute we make the related manager support
-        versioning by requesting related objects at the time equal to the
-        original object ('self' in this case). For reverse FKs (like
-        'event.segment') we need to override related descriptor, see
-        'VersionedForeignKey' field class. """
-        attr = object.__getattribute__(self, name)
-        if isinstance(attr, VersionManager) and self._at_time:
-            attr._at_time = self._at_time
-        return attr
-
     def delete(self, using=None):
         """ uses queryset delete() method to perform versioned deletion """
         self.__class__.objects.filter(pk=self.pk).delete()
@@ -87,6 +77,42 @@ class BaseVersionedObject(models.Model):
     def is_active(self):
         return not self.ends_at
 
+    def is_valid_at(self, at_time):
+        """ True if this version was the actual one at a given time """
+        return self.starts_at <= at_time and \
+            (self.ends_at is None or self.ends_at > at_time)
+
+    def diff(self, other):
+        """ field-level differences between this and another version of an
+        object, see 'version_diff' """
+        return version_diff(self, other)
+
+
+def version_diff(old, new):
+    """ field-level differences between two versions of an object as
+    {field name: (old value, new value)}. Related objects are compared by IDs,
+    files by names. Any version can be None (object did not exist). Version
+    attributes (guid, starts_at etc.) are ignored. """
+    def value(obj, field):
+        if obj is None:
+            return None
+        val = getattr(obj, field.attname)
+        if isinstance(val, FieldFile):
+            return val.name or None
+        return val
+
+    base = old if old is not None else new
+    changes = {}
+    for field in base._meta.local_fields:
+        if field.name in VERSION_FIELDS:
+            continue
+
+        before, after = value(old, field), value(new, field)
+        if before != after:
+            changes[field.name] = (before, after)
+
+    return changes
+
 
 class VersionedM2M(BaseVersionedObject):
     """ this abstract model is used as a connection between two objects for many 
@@ -1,24 +1,71 @@
-from django.db import connection, transaction
+from django.db import connection, connections, transaction
 from django.db.models.query import QuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.db import models
 from django.db.models import sql
 from django.db.models import Q
+from django.core.files import File
 from django.utils import timezone
 
+from gndata_api import settings
 from gndata_api.utils import *
-from deletion import VersionedCollector
+from gndata_api.profiling import profiled
+from deletion import VersionedCollector, VersionedCascade
 
+import re
 import uuid
+import datetime
+from cStringIO import StringIO
 
 #===============================================================================
 # VERSIONED QuerySets
 #===============================================================================
 
+# SQL expressions generating a new 'guid' for a copied row, by DB vendor. Set-
+# based updates fall back to updating objects one by one for other vendors.
+GUID_SQL = {
+    'postgresql': "md5(%(guid)s || random()::text || clock_timestamp()::text)",
+    'sqlite': "lower(hex(randomblob(16)))",
+    'mysql': "replace(uuid(), '-', '')",
+}
+
+
+# characters escaped in the text format of PostgreSQL COPY
+COPY_SPECIAL = re.compile(r'[\\\t\n\r]')
+COPY_ESCAPES = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'}
+
+
+def copy_value(value):
+    """ a value in the text format of PostgreSQL COPY """
+    kind = type(value)
+    if kind is unicode:
+        value = value.encode('utf-8')
+    elif kind is str:
+        pass
+    elif value is None:
+        return "\\N"
+    elif kind is bool:
+        return value and "t" or "f"
+    elif kind is float:
+        return repr(value)
+    elif kind in (int, long):
+        return str(value)
+    elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    else:
+        value = str(value)
+
+    if COPY_SPECIAL.search(value):
+        return COPY_SPECIAL.sub(lambda m: COPY_ESCAPES[m.group()], value)
+    return value
+
 
 class VersionedQuerySet(QuerySet):
     """ basic extension for every queryset class to support versioning """
     _at_time = None  # proxy version time for related models
     _time_injected = False
 
+    @profiled('inject_time')
     def inject_time(self):
         """ pre-processing versioned queryset before evaluating against database 
         back-end. Inject version time filters for every versioned model (table),
@@ -119,6 +166,50 @@ class VersionedQuerySet(QuerySet):
                 obj._at_time = self._at_time
             yield obj
 
+    def iterate_chunked(self, chunk_size=1000):
+        """ iterates over objects fetched from a server-side cursor in chunks
+        of 'chunk_size' rows (PostgreSQL only), so memory does not grow with
+        the number of objects. The query is executed once, in a transaction
+        kept open until the iteration ends. Falls back to 'iterator' for other
+        databases and for querysets with select_related, extra, only/defer or
+        aggregates. """
+        conn = connections[self.db]
+        query = self.query
+        if conn.vendor != 'postgresql' or query.select_related or \
+                query.extra_select or query.aggregate_select or \
+                query.deferred_loading[0]:
+            for obj in self.iterator():
+                yield obj
+            return
+
+        self.inject_time()
+        try:
+            sql, params = query.get_compiler(using=self.db).as_sql()
+        except EmptyResultSet:  # like for a filter 'pk__in=[]'
+            return
+
+        model = self.model
+        with transaction.atomic(using=self.db):
+            conn.ensure_connection()
+            cursor = conn.connection.cursor(name="chunked_%s" % uuid.uuid1().hex)
+            try:
+                cursor.itersize = chunk_size
+                cursor.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+
+                    for row in rows:
+                        obj = model(*row)
+                        obj._state.db = self.db
+                        obj._state.adding = False
+                        if self._at_time:
+                            obj._at_time = self._at_time
+                        yield obj
+            finally:
+                cursor.close()
+
     def bulk_create(self, objs, batch_size=None):
         """ wrapping around a usual bulk_create to provide version-specific
         information for all objects. As with original bulk creation, reverse
@@ -128,6 +219,9 @@ class VersionedQuerySet(QuerySet):
 
         WARNING: has side-effects """
         def close_records(ids_to_close):
+            if use_copy and len(ids_to_close) > threshold:
+                return self._close_copied(ids_to_close, now)
+
             query = sql.UpdateQuery(self.model)
 
             pk_field = query.get_meta().pk
@@ -146,15 +240,22 @@ class VersionedQuerySet(QuerySet):
         if not objs:
             return objs
 
+        # large batches are loaded with COPY on PostgreSQL
+        threshold = getattr(settings, 'COPY_THRESHOLD', 1000)
+        use_copy = connections[self.db].vendor == 'postgresql' and \
+            len(objs) > threshold
+
         now = timezone.now()
         ids_to_close = []
+        new_ids = iter(get_new_local_ids(len([x for x in objs if not x.pk]),
+                                         using=self.db))
         for obj in objs:  # this loop modifies given objects
 
             if obj.pk:  # existing object, need to "close" old version later
                 ids_to_close.append(obj.pk)
 
             else:  # new object
-                obj.pk = get_new_local_id()
+                obj.pk = next(new_ids)
                 obj.date_created = now
 
             obj.starts_at = now
@@ -168,26 +269,275 @@ class VersionedQuerySet(QuerySet):
             close_records(ids_to_close)
 
             # insert records with new / updated objects
-            self._batched_insert(list(objs), fields, batch_size)
+            if use_copy:
+                self._copy_insert(list(objs), fields, batch_size or 10000)
+            else:
+                self._batched_insert(list(objs), fields, batch_size)
+
+            # fields keeping track of references (like array files) count
+            # the inserted rows at once
+            for field in fields:
+                if hasattr(field, 'inserted'):
+                    field.inserted(objs)
 
         return objs
 
+    def _copy_insert(self, objs, fields, batch_size):
+        """ inserts objects with COPY ... FROM STDIN (PostgreSQL only), in
+        chunks of 'batch_size' rows. Values are prepared like for an INSERT,
+        so files are saved etc. """
+        conn = connections[self.db]
+        qn = conn.ops.quote_name
+        copy_sql = "COPY %s (%s) FROM STDIN" % (
+            qn(self.model._meta.db_table),
+            ", ".join(qn(f.column) for f in fields)
+        )
+
+        # 'pre_save' is called only if a field needs it (files, auto dates)
+        base_pre_save = models.Field.pre_save.im_func
+        getters = [
+            (f, f.pre_save.im_func is not base_pre_save, f.attname)
+            for f in fields
+        ]
+
+        cursor = conn.cursor()
+        for start in range(0, len(objs), batch_size):
+            rows = []
+            for obj in objs[start:start + batch_size]:
+                rows.append("\t".join([
+                    copy_value(f.get_db_prep_save(
+                        f.pre_save(obj, True) if pre_save else
+                        getattr(obj, attname), connection=conn
+                    )) for f, pre_save, attname in getters
+                ]))
+            rows.append("")
+
+            cursor.copy_expert(copy_sql, StringIO("\n".join(rows)))
+
+    def _close_copied(self, ids_to_close, now):
+        """ closes current versions of objects with given IDs, passed to the
+        database with COPY into a temporary table instead of an IN list
+        (PostgreSQL only) """
+        conn = connections[self.db]
+        qn = conn.ops.quote_name
+        pk_field = self.model._meta.pk
+        time_field = self.model._meta.get_field('ends_at')
+        db_now = time_field.get_db_prep_value(now, connection=conn)
+        temp = qn('close_%s' % self.model._meta.db_table)
+
+        cursor = conn.cursor()
+        cursor.execute("CREATE TEMPORARY TABLE %s (%s %s)" % (
+            temp, qn(pk_field.column), pk_field.db_type(conn)
+        ))
+        data = "".join(copy_value(pk) + "\n" for pk in ids_to_close)
+        cursor.copy_expert("COPY %s FROM STDIN" % temp, StringIO(data))
+
+        cursor.execute(
+            "UPDATE %s SET %s = %%s WHERE %s IS NULL AND %s IN "
+            "(SELECT %s FROM %s)" % (
+                qn(self.model._meta.db_table), qn('ends_at'), qn('ends_at'),
+                qn(pk_field.column), qn(pk_field.column), temp
+            ), [db_now]
+        )
+        cursor.execute("DROP TABLE %s" % temp)
+
     def update(self, **kwargs):
-        """ update objects with new attrs and FKs """
+        """ versioned update of all selected objects with new attrs and FKs.
+        Closes current versions and inserts their modified copies with a
+        single INSERT ... SELECT, so no objects are loaded into memory. Accepts
+        field names or attnames (like 'segment_id'), ignores other names.
+
+        :returns: number of updated objects """
         assert self.query.can_filter(), \
             "Cannot update a query once a slice has been taken."
 
+        if self._at_time:
+            raise ValueError("Only current object versions can be updated")
+
         test = lambda x: (not x.primary_key) and x.editable
-        allowed = [f.name for f in self.model._meta.local_fields if test(f)]
+        allowed = [f for f in self.model._meta.local_fields if test(f)]
+
+        values = {}
+        for field in allowed:
+            for key in set([field.name, field.attname]) & set(kwargs.keys()):
+                values[field] = kwargs[key]
 
-        if kwargs:
-            objs = self._clone()
-            for obj in objs:
-                for name, value in kwargs.items():
-                    if name in allowed:
-                        setattr(obj, name, value)
-            return self.bulk_create(objs)
-        return self
+        if not values:
+            return 0
+
+        conn = connections[self.db]
+        if conn.vendor not in GUID_SQL:
+            return len(self._update_objects(values))
+
+        for field, value in values.items():
+            if isinstance(value, File) and not getattr(value, '_committed', 1):
+                raise ValueError("Files can't be saved with a set-based update")
+
+            # fields recording details of their value in other fields
+            if hasattr(field, 'companion_values'):
+                values.update(field.companion_values(value))
+
+        now = timezone.now()
+        qn = conn.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        time_field = self.model._meta.get_field('starts_at')
+        db_now = time_field.get_db_prep_value(now, connection=conn)
+
+        columns, exprs, params = [], [], []
+        for field in self.model._meta.local_fields:
+            columns.append(qn(field.column))
+            if field.name == 'guid':
+                exprs.append(GUID_SQL[conn.vendor] % {'guid': qn(field.column)})
+            elif field.name == 'starts_at':
+                exprs.append("%s")
+                params.append(db_now)
+            elif field.name == 'ends_at':
+                exprs.append("NULL")
+            elif field in values:
+                value = values[field]
+                if hasattr(value, '_meta') and field.rel is not None:
+                    value = value.pk  # related object given
+                exprs.append("%s")
+                params.append(field.get_db_prep_save(value, connection=conn))
+            else:
+                exprs.append(qn(field.column))
+
+        # rows closed and copied by this update, identified by their 'guid', as
+        # other rows may be closed at the same time by concurrent requests
+        temp = qn('update_%s' % self.model._meta.db_table)
+        closed = "%s = %%s AND %s IN (SELECT %s FROM %s)" % (
+            qn('ends_at'), qn('guid'), qn('guid'), temp
+        )
+        insert_sql = "INSERT INTO %s (%s) SELECT %s FROM %s WHERE %s" % (
+            table, ", ".join(columns), ", ".join(exprs), table, closed
+        )
+        drop_sql = conn.vendor == 'mysql' and "DROP TEMPORARY TABLE %s" or \
+            "DROP TABLE %s"
+
+        with transaction.commit_on_success_unless_managed(using=self.db):
+            cursor = conn.cursor()
+            guid_type = self.model._meta.get_field('guid').db_type(conn)
+            cursor.execute("CREATE TEMPORARY TABLE %s (%s %s)" % (
+                temp, qn('guid'), guid_type
+            ))
+            try:
+                # close old records by setting 'ends_at' to 'now', must be first
+                count = self.close_versions(now, temp)
+
+                # insert modified copies of just closed records
+                if count:
+                    cursor.execute(insert_sql, params + [db_now])
+                    self._copied(closed, [db_now], values)
+                    self._recompute(closed, now, db_now, values)
+            except Exception:
+                # a failed statement aborts the transaction on PostgreSQL, so
+                # no DROP is possible there; the rollback removes the table
+                if conn.vendor != 'postgresql':
+                    cursor.execute(drop_sql % temp)
+                raise
+            else:
+                cursor.execute(drop_sql % temp)
+
+        self._result_cache = None
+        return count
+
+    def close_versions(self, now, temp=None):
+        """ closes current versions of all selected objects by setting their
+        'ends_at' to 'now' with a single UPDATE. Selected objects are passed
+        to the database as a subquery, nothing is loaded into memory. With a
+        'temp' table (single 'guid' column) given, guids of the closed versions
+        are recorded in it, and the versions locked (PostgreSQL) first.
+
+        :returns: number of closed versions """
+        conn = connections[self.db]
+        qn = conn.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        time_field = self.model._meta.get_field('ends_at')
+        db_now = time_field.get_db_prep_value(now, connection=conn)
+
+        selection = self.filter()
+        selection.inject_time()
+        selection = selection.values_list('local_id', flat=True)
+        selection.query.clear_ordering(force_empty=True)
+        sel_sql, sel_params = selection.query.get_compiler(self.db).as_sql()
+
+        # derived table: MySQL can't select from the table being updated
+        current = "%s IS NULL AND %s IN (SELECT %s FROM (%s) AS selection)" % (
+            qn('ends_at'), qn('local_id'), qn('local_id'), sel_sql
+        )
+
+        cursor = conn.cursor()
+        if temp is not None:
+            cursor.execute("INSERT INTO %s SELECT %s FROM %s WHERE %s%s" % (
+                temp, qn('guid'), table, current,
+                conn.vendor == 'postgresql' and " FOR UPDATE" or ""
+            ), list(sel_params))
+            current = "%s IS NULL AND %s IN (SELECT %s FROM %s)" % (
+                qn('ends_at'), qn('guid'), qn('guid'), temp
+            )
+            sel_params = []
+
+        cursor.execute("UPDATE %s SET %s = %%s WHERE %s" % (
+            table, qn('ends_at'), current
+        ), [db_now] + list(sel_params))
+        return cursor.rowcount
+
+    def _copied(self, closed, params, values):
+        """ notifies fields, that keep track of references (like array files),
+        about rows copied from the closed rows (matching the 'closed' SQL
+        condition), with the given new 'values' """
+        conn = connections[self.db]
+        qn = conn.ops.quote_name
+        cursor = conn.cursor()
+
+        for field in self.model._meta.local_fields:
+            if not hasattr(field, 'retain'):
+                continue
+
+            column = qn(field.column)
+            cursor.execute(
+                "SELECT %s, COUNT(*) FROM %s WHERE %s GROUP BY %s" % (
+                    column, qn(self.model._meta.db_table), closed, column
+                ), params
+            )
+            counts = dict(cursor.fetchall())
+            if field in values:
+                name = getattr(values[field], 'name', values[field])
+                counts = {name: sum(counts.values())}
+
+            field.retain(dict((k, v) for k, v in counts.items() if k))
+
+    def _recompute(self, closed, now, db_now, values):
+        """ recomputes fields, derived on save from other fields of a row (like
+        the size of all arrays, see 'ArraySizeField'), in rows copied from the
+        closed rows (matching the 'closed' SQL condition), if given 'values'
+        change fields they depend on """
+        derived = [f for f in self.model._meta.local_fields
+                   if hasattr(f, 'update_rows') and
+                   any(f.depends_on(field) for field in values)]
+        if not derived:
+            return
+
+        qn = connections[self.db].ops.quote_name
+        # derived table: MySQL can't select from the table being updated
+        copied = QuerySet(self.model).filter(starts_at=now).extra(where=[
+            "%s IN (SELECT %s FROM (SELECT %s FROM %s WHERE %s) AS copied)" % (
+                qn('local_id'), qn('local_id'), qn('local_id'),
+                qn(self.model._meta.db_table), closed
+            )
+        ], params=[db_now])
+        for field in derived:
+            field.update_rows(copied)
+
+    def _update_objects(self, values):
+        """ update by loading every object, used if the set-based update is
+        not available for a database """
+        objs = self._clone()
+        for obj in objs:
+            for field, value in values.items():
+                related = field.rel is not None and hasattr(value, '_meta')
+                setattr(obj, field.name if related else field.attname, value)
+        return self.bulk_create(objs)
 
     def delete(self):
         """ a special versioned delete, which removes appropriate direct and
@@ -211,9 +561,15 @@ class VersionedQuerySet(QuerySet):
         del_query.query.select_related = False
         del_query.query.clear_ordering(force_empty=True)
 
-        collector = VersionedCollector(using=del_query.db)
-        collector.collect(del_query)
-        collector.delete()
+        if VersionedCascade.can_cascade(self.model):
+            cascade = VersionedCascade(using=del_query.db)
+            cascade.collect(del_query)
+            cascade.delete()
+
+        else:
+            collector = VersionedCollector(using=del_query.db)
+            collector.collect(del_query)
+            collector.delete()
 
         # Clear the result cache, in case this QuerySet gets reused.
         self._result_cache = None